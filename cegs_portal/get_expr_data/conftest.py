@@ -4,11 +4,7 @@ import pytest
 from django.core.files.storage import default_storage
 from psycopg.types.range import Int4Range
 
-from cegs_portal.get_expr_data.models import (
-    EXPR_DATA_DIR,
-    ReoSourcesTargets,
-    ReoSourcesTargetsSigOnly,
-)
+from cegs_portal.get_expr_data.models import EXPR_DATA_DIR, ReoSourcesTargets
 from cegs_portal.search.models import (
     DNAFeatureType,
     EffectObservationDirectionType,
@@ -110,7 +106,6 @@ def _reg_effects(public=True, archived=False) -> list[RegulatoryEffectObservatio
         facet_values=[nonsig_facet],
     )
     ReoSourcesTargets.load_analysis(analysis.accession_id)
-    ReoSourcesTargetsSigOnly.load_analysis(analysis.accession_id)
 
     return (effect_source, effect_both, enriched_facet, depleted_facet, nonsig_facet, experiment)
 
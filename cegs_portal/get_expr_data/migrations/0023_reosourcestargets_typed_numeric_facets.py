@@ -0,0 +1,70 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+BACKFILL = """UPDATE {table} SET
+                effect_size = (reo_facets->>'Effect Size')::double precision,
+                raw_p_value = (reo_facets->>'Raw p value')::double precision,
+                adj_p_value = (reo_facets->>'Significance')::double precision,
+                log_significance = (reo_facets->>'-log10 Significance')::double precision"""
+
+
+def numeric_fields(model_name):
+    return [
+        migrations.AddField(
+            model_name=model_name,
+            name=field_name,
+            field=models.FloatField(blank=True, null=True),
+        )
+        for field_name in ["effect_size", "raw_p_value", "adj_p_value", "log_significance"]
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("get_expr_data", "0022_auto_20240820_1602"),
+    ]
+
+    operations = [
+        *numeric_fields("reosourcestargets"),
+        *numeric_fields("reosourcestargetssigonly"),
+        migrations.RunSQL(
+            BACKFILL.format(table="get_expr_data_reo_sources_targets"), reverse_sql=migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            BACKFILL.format(table="get_expr_data_reo_sources_targets_sig_only"), reverse_sql=migrations.RunSQL.noop
+        ),
+        migrations.RemoveIndex(
+            model_name="reosourcestargets",
+            name="idx_rstm_pval_asc",
+        ),
+        migrations.RemoveIndex(
+            model_name="reosourcestargetssigonly",
+            name="idx_rstsom_pval_asc",
+        ),
+        migrations.AddIndex(
+            model_name="reosourcestargets",
+            index=models.Index(fields=["raw_p_value"], name="idx_rstm_raw_p_value"),
+        ),
+        migrations.AddIndex(
+            model_name="reosourcestargets",
+            index=models.Index(fields=["effect_size"], name="idx_rstm_effect_size"),
+        ),
+        migrations.AddIndex(
+            model_name="reosourcestargets",
+            index=models.Index(fields=["log_significance"], name="idx_rstm_log_significance"),
+        ),
+        migrations.AddIndex(
+            model_name="reosourcestargetssigonly",
+            index=models.Index(fields=["raw_p_value"], name="idx_rstsom_raw_p_value"),
+        ),
+        migrations.AddIndex(
+            model_name="reosourcestargetssigonly",
+            index=models.Index(fields=["effect_size"], name="idx_rstsom_effect_size"),
+        ),
+        migrations.AddIndex(
+            model_name="reosourcestargetssigonly",
+            index=models.Index(fields=["log_significance"], name="idx_rstsom_log_significance"),
+        ),
+    ]
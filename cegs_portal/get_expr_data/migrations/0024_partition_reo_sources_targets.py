@@ -0,0 +1,81 @@
+from django.db import migrations
+
+# get_expr_data_reo_sources_targets and get_expr_data_reo_sources_targets_sig_only are list partitioned by
+# genome_assembly, and each assembly is list partitioned by source_chrom. Rows for any other assembly or
+# chromosome go in the default partitions.
+GENOME_ASSEMBLIES = ["hg19", "hg38"]
+CHROMOSOMES = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY", "chrM"]
+TABLES = [
+    ("get_expr_data", "ReoSourcesTargets"),
+    ("get_expr_data", "ReoSourcesTargetsSigOnly"),
+]
+
+
+def move_rows(schema_editor, model, create_table, primary_key):
+    """
+    Replace a model's table with a new one, made by create_table, and move the rows over. The primary key and
+    the model's indexes are created after the rows are moved.
+    """
+    table = model._meta.db_table
+    old_table = f"{table}_old"
+
+    schema_editor.execute(f"ALTER TABLE {table} RENAME TO {old_table}")
+    create_table(table, old_table)
+    schema_editor.execute(f"INSERT INTO {table} SELECT * FROM {old_table}")
+    # This also drops the old table's primary key, indexes, and id sequence, whose names are reused below
+    schema_editor.execute(f"DROP TABLE {old_table}")
+
+    schema_editor.execute(f"CREATE SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    schema_editor.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+    schema_editor.execute(f"SELECT setval('{table}_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM {table}")
+
+    schema_editor.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(primary_key)})")
+
+    for index in model._meta.indexes:
+        schema_editor.add_index(model, index)
+
+    schema_editor.execute(f"ANALYZE {table}")
+
+
+def partition(apps, schema_editor):
+    def create_table(table, old_table):
+        schema_editor.execute(f"CREATE TABLE {table} (LIKE {old_table}) PARTITION BY LIST (genome_assembly)")
+        for assembly in GENOME_ASSEMBLIES:
+            schema_editor.execute(
+                f"""CREATE TABLE {table}_{assembly} PARTITION OF {table}
+                    FOR VALUES IN ('{assembly}') PARTITION BY LIST (source_chrom)"""
+            )
+            for chrom in CHROMOSOMES:
+                schema_editor.execute(
+                    f"CREATE TABLE {table}_{assembly}_{chrom} PARTITION OF {table}_{assembly} FOR VALUES IN ('{chrom}')"
+                )
+            schema_editor.execute(f"CREATE TABLE {table}_{assembly}_default PARTITION OF {table}_{assembly} DEFAULT")
+        schema_editor.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    # The primary key of a partitioned table has to include the partition keys
+    for app_label, model_name in TABLES:
+        move_rows(
+            schema_editor,
+            apps.get_model(app_label, model_name),
+            create_table,
+            ["id", "genome_assembly", "source_chrom"],
+        )
+
+
+def unpartition(apps, schema_editor):
+    def create_table(table, old_table):
+        schema_editor.execute(f"CREATE TABLE {table} (LIKE {old_table})")
+
+    for app_label, model_name in TABLES:
+        move_rows(schema_editor, apps.get_model(app_label, model_name), create_table, ["id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("get_expr_data", "0023_reosourcestargets_typed_numeric_facets"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition, unpartition),
+    ]
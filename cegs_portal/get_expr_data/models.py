@@ -1,16 +1,145 @@
+import logging
+import math
 import os.path
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, IntegerRangeField
 from django.contrib.postgres.indexes import GinIndex, GistIndex
 from django.core.files.storage import default_storage
 from django.db import connection, models
-from django.db.models.expressions import RawSQL
 
 from cegs_portal.search.models.validators import validate_accession_id
 
 EXPR_DATA_DIR = "expr_data_dir"
 
+logger = logging.getLogger(__name__)
+
+# The denormalized rows of a range of an analysis's REOs are computed once and added to both
+# get_expr_data_reo_sources_targets and, for REOs with categorical facets other than "Non-significant",
+# get_expr_data_reo_sources_targets_sig_only. The categorical facets of the REO and its source and target are
+# collected with subqueries rather than by joining all of the facet tables, which would multiply the rows that
+# have to be grouped back together.
+DENORMALIZE_SQL = """WITH denormalized AS MATERIALIZED (
+    SELECT
+        sr.id AS reo_id,
+        sr.archived as archived,
+        sr.public as public,
+        sr.accession_id AS reo_accession,
+        sr.experiment_accession_id AS reo_experiment,
+        sr.analysis_accession_id AS reo_analysis,
+        sr.facet_num_values AS reo_facets,
+        (sr.facet_num_values->>'Effect Size')::double precision AS effect_size,
+        (sr.facet_num_values->>'Raw p value')::double precision AS raw_p_value,
+        (sr.facet_num_values->>'Significance')::double precision AS adj_p_value,
+        (sr.facet_num_values->>'-log10 Significance')::double precision AS log_significance,
+        sds.id AS source_id,
+        sds.accession_id AS source_accession,
+        sds.chrom_name AS source_chrom,
+        sds.location AS source_loc,
+        sdt.id AS target_id,
+        sdt.accession_id AS target_accession,
+        sdt.chrom_name AS target_chrom,
+        sdt.location AS target_loc,
+        sdt.name AS target_gene_symbol,
+        sdt.ensembl_id AS target_ensembl_id,
+        sa.genome_assembly AS genome_assembly,
+        ARRAY(SELECT DISTINCT srfv.facetvalue_id
+            FROM search_regulatoryeffectobservation_facet_values AS srfv
+            WHERE srfv.regulatoryeffectobservation_id = sr.id
+            ORDER BY srfv.facetvalue_id) AS reo_cat_facets,
+        ARRAY(SELECT DISTINCT sdsfv.facetvalue_id
+            FROM search_dnafeature_facet_values AS sdsfv
+            WHERE sdsfv.dnafeature_id = sds.id
+            ORDER BY sdsfv.facetvalue_id) ||
+        ARRAY(SELECT DISTINCT sdtfv.facetvalue_id
+            FROM search_dnafeature_facet_values AS sdtfv
+            WHERE sdtfv.dnafeature_id = sdt.id
+            ORDER BY sdtfv.facetvalue_id) AS feature_cat_facets
+    FROM search_regulatoryeffectobservation AS sr
+    LEFT JOIN search_regulatoryeffectobservation_sources AS srs ON sr.id = srs.regulatoryeffectobservation_id
+    LEFT JOIN search_regulatoryeffectobservation_targets AS srt ON sr.id = srt.regulatoryeffectobservation_id
+    LEFT JOIN search_dnafeature AS sds ON sds.id = srs.dnafeature_id
+    LEFT JOIN search_dnafeature AS sdt ON sdt.id = srt.dnafeature_id
+    LEFT JOIN search_analysis AS sa ON sr.analysis_accession_id = sa.accession_id
+    WHERE sr.analysis_accession_id = %(analysis_accession)s AND sr.id BETWEEN %(first_reo_id)s AND %(last_reo_id)s
+), non_significant AS (
+    SELECT id FROM search_facetvalue WHERE value = 'Non-significant'
+), all_rows AS (
+    INSERT INTO get_expr_data_reo_sources_targets
+    (reo_id, archived, public, reo_accession, reo_experiment, reo_analysis, reo_facets,
+    effect_size, raw_p_value, adj_p_value, log_significance,
+    source_id, source_accession, source_chrom, source_loc,
+    target_id, target_accession, target_chrom, target_loc,
+    target_gene_symbol, target_ensembl_id, genome_assembly, cat_facets)
+    SELECT
+        reo_id, archived, public, reo_accession, reo_experiment, reo_analysis, reo_facets,
+        effect_size, raw_p_value, adj_p_value, log_significance,
+        source_id, source_accession, source_chrom, source_loc,
+        target_id, target_accession, target_chrom, target_loc,
+        target_gene_symbol, target_ensembl_id, genome_assembly, reo_cat_facets || feature_cat_facets
+    FROM denormalized
+    RETURNING 1
+), sig_rows AS (
+    INSERT INTO get_expr_data_reo_sources_targets_sig_only
+    (reo_id, archived, public, reo_accession, reo_experiment, reo_analysis, reo_facets,
+    effect_size, raw_p_value, adj_p_value, log_significance,
+    source_id, source_accession, source_chrom, source_loc,
+    target_id, target_accession, target_chrom, target_loc,
+    target_gene_symbol, target_ensembl_id, genome_assembly, cat_facets)
+    SELECT
+        reo_id, archived, public, reo_accession, reo_experiment, reo_analysis, reo_facets,
+        effect_size, raw_p_value, adj_p_value, log_significance,
+        source_id, source_accession, source_chrom, source_loc,
+        target_id, target_accession, target_chrom, target_loc,
+        target_gene_symbol, target_ensembl_id, genome_assembly, sig_cat_facets || feature_cat_facets
+    FROM (
+        SELECT *, array_remove(reo_cat_facets, (SELECT id FROM non_significant)) AS sig_cat_facets FROM denormalized
+    ) AS sig_denormalized
+    WHERE cardinality(sig_cat_facets) > 0
+    RETURNING 1
+)
+SELECT (SELECT count(*) FROM all_rows), (SELECT count(*) FROM sig_rows)"""
+
+
+def reo_id_ranges(analysis_accession, range_size) -> list[tuple[int, int]]:
+    """Split an analysis's REO ids into ranges of (about) range_size ids each"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT count(*) FROM search_regulatoryeffectobservation WHERE analysis_accession_id = %s",
+            [analysis_accession],
+        )
+        reo_count = cursor.fetchone()[0]
+        cursor.execute(
+            """SELECT min(id), max(id) FROM (
+                SELECT id, ntile(%s) OVER (ORDER BY id) AS id_range
+                FROM search_regulatoryeffectobservation
+                WHERE analysis_accession_id = %s
+            ) AS id_ranges
+            GROUP BY id_range
+            ORDER BY 1""",
+            [max(1, math.ceil(reo_count / range_size)), analysis_accession],
+        )
+        return cursor.fetchall()
+
+
+def denormalize_reo_id_range(analysis_accession, first_reo_id, last_reo_id) -> tuple[int, int]:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            DENORMALIZE_SQL,
+            {"analysis_accession": analysis_accession, "first_reo_id": first_reo_id, "last_reo_id": last_reo_id},
+        )
+        return cursor.fetchone()
+
+
+def denormalize_reo_id_range_in_thread(analysis_accession, first_reo_id, last_reo_id) -> tuple[int, int]:
+    try:
+        return denormalize_reo_id_range(analysis_accession, first_reo_id, last_reo_id)
+    finally:
+        # This runs in a worker thread, which gets its own database connection
+        connection.close()
+
 
 def expr_data_base_path():
     return os.path.join(default_storage.location, EXPR_DATA_DIR)
@@ -30,6 +159,8 @@ class ExperimentData(models.Model):
 
 
 class ReoSourcesTargets(models.Model):
+    # The table is list partitioned by genome_assembly and then by source_chrom (see migration 0024), so its
+    # primary key in the database is (id, genome_assembly, source_chrom).
     class Meta:
         db_table = "get_expr_data_reo_sources_targets"
         indexes = [
@@ -38,10 +169,9 @@ class ReoSourcesTargets(models.Model):
             GistIndex(fields=["source_loc"], name="idx_rstm_source_loc"),
             GistIndex(fields=["target_loc"], name="idx_rstm_target_loc"),
             GinIndex(fields=["cat_facets"], name="idx_rstm_cat_facet"),
-            models.Index(
-                RawSQL("((reo_facets->>'Raw p value')::numeric)", []),
-                name="idx_rstm_pval_asc",
-            ),
+            models.Index(fields=["raw_p_value"], name="idx_rstm_raw_p_value"),
+            models.Index(fields=["effect_size"], name="idx_rstm_effect_size"),
+            models.Index(fields=["log_significance"], name="idx_rstm_log_significance"),
         ]
 
     reo_id = models.BigIntegerField()
@@ -51,6 +181,12 @@ class ReoSourcesTargets(models.Model):
     reo_experiment = models.CharField(max_length=17, validators=[validate_accession_id])
     reo_analysis = models.CharField(max_length=17, validators=[validate_accession_id])
     reo_facets = models.JSONField(null=True, blank=True)
+    # Typed copies of the numeric values in reo_facets, so they can be filtered and sorted on without
+    # extracting them from JSON for every row
+    effect_size = models.FloatField(null=True, blank=True)
+    raw_p_value = models.FloatField(null=True, blank=True)
+    adj_p_value = models.FloatField(null=True, blank=True)
+    log_significance = models.FloatField(null=True, blank=True)
     source_id = models.BigIntegerField()
     source_accession = models.CharField(max_length=17, validators=[validate_accession_id])
     source_chrom = models.CharField(max_length=10)
@@ -65,53 +201,62 @@ class ReoSourcesTargets(models.Model):
     cat_facets = ArrayField(models.BigIntegerField())
 
     @classmethod
-    def load_analysis(cls, analysis_accession):
+    def load_analysis(cls, analysis_accession) -> int:
+        """
+        Add the analysis's observations, and add the significant ones to ReoSourcesTargetsSigOnly, replacing
+        any that were already added so loading an analysis again is safe. The analysis's REOs are split into
+        ranges of ids that are loaded in parallel, each on its own connection. Both tables are analyzed after
+        loads of at least settings.UPLOAD_ANALYZE_ROWS rows.
+
+        Returns the number of rows added.
+        """
+        start_time = time.perf_counter()
         with connection.cursor() as cursor:
             cursor.execute(
-                """INSERT INTO get_expr_data_reo_sources_targets
-                    (reo_id, archived, public, reo_accession, reo_experiment, reo_analysis, reo_facets,
-                    source_id, source_accession, source_chrom, source_loc,
-                    target_id, target_accession, target_chrom, target_loc,
-                    target_gene_symbol, target_ensembl_id, genome_assembly, cat_facets) SELECT
-                    sr.id AS reo_id,
-                    sr.archived as archived,
-                    sr.public as public,
-                    sr.accession_id AS reo_accession,
-                    sr.experiment_accession_id AS reo_experiment,
-                    sr.analysis_accession_id AS reo_analysis,
-                    sr.facet_num_values AS reo_facets,
-                    sds.id AS source_id,
-                    sds.accession_id AS source_accession,
-                    sds.chrom_name AS source_chrom,
-                    sds.location AS source_loc,
-                    sdt.id AS target_id,
-                    sdt.accession_id AS target_accession,
-                    sdt.chrom_name AS target_chrom,
-                    sdt.location AS target_loc,
-                    sdt.name AS target_gene_symbol,
-                    sdt.ensembl_id AS target_ensembl_id,
-                    sa.genome_assembly AS genome_assembly,
-                    array_remove(ARRAY_AGG(DISTINCT(srfv.facetvalue_id)) || ARRAY_AGG(DISTINCT(sdsfv.facetvalue_id)) || ARRAY_AGG(DISTINCT(sdtfv.facetvalue_id)), NULL) AS cat_facets
-                FROM search_regulatoryeffectobservation AS sr
-                LEFT JOIN search_regulatoryeffectobservation_facet_values as srfv on sr.id = srfv.regulatoryeffectobservation_id
-                LEFT JOIN search_regulatoryeffectobservation_sources AS srs ON sr.id = srs.regulatoryeffectobservation_id
-                LEFT JOIN search_regulatoryeffectobservation_targets AS srt ON sr.id = srt.regulatoryeffectobservation_id
-                LEFT JOIN search_dnafeature AS sds ON sds.id = srs.dnafeature_id
-                LEFT JOIN search_dnafeature_facet_values as sdsfv on sds.id = sdsfv.dnafeature_id
-                LEFT JOIN search_dnafeature AS sdt ON sdt.id = srt.dnafeature_id
-                LEFT JOIN search_dnafeature_facet_values as sdtfv on sdt.id = sdtfv.dnafeature_id
-                LEFT JOIN search_analysis AS sa ON sr.analysis_accession_id = sa.accession_id
-                LEFT JOIN search_file AS sf ON sa.id = sf.analysis_id
-                WHERE sr.analysis_accession_id = %s
-                GROUP BY sr.id, sds.id, sdt.id, sa.genome_assembly""",
-                [analysis_accession],
+                "DELETE FROM get_expr_data_reo_sources_targets WHERE reo_analysis = %s", [analysis_accession]
+            )
+            cursor.execute(
+                "DELETE FROM get_expr_data_reo_sources_targets_sig_only WHERE reo_analysis = %s", [analysis_accession]
             )
 
+        id_ranges = reo_id_ranges(analysis_accession, settings.DENORMALIZE_REO_RANGE_SIZE)
+
+        # Other connections can't see anything uncommitted in this one, so inside a transaction (e.g., in tests)
+        # the ranges are loaded on this connection one at a time.
+        if connection.in_atomic_block or len(id_ranges) <= 1:
+            row_counts = [denormalize_reo_id_range(analysis_accession, *id_range) for id_range in id_ranges]
+        else:
+            with ThreadPoolExecutor(max_workers=min(len(id_ranges), settings.DENORMALIZE_WORKERS)) as executor:
+                row_counts = list(
+                    executor.map(
+                        lambda id_range: denormalize_reo_id_range_in_thread(analysis_accession, *id_range), id_ranges
+                    )
+                )
+
+        row_count = sum(all_rows for all_rows, _ in row_counts)
+        sig_row_count = sum(sig_rows for _, sig_rows in row_counts)
+
+        # Autovacuum analyzes the partitions, but never the partitioned tables themselves, so after a large load
+        # the tables are analyzed here. Analyzing a partitioned table analyzes its partitions too.
+        if row_count >= settings.UPLOAD_ANALYZE_ROWS:
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE get_expr_data_reo_sources_targets")
+                cursor.execute("ANALYZE get_expr_data_reo_sources_targets_sig_only")
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"{analysis_accession}: Denormalized {row_count:,} rows ({sig_row_count:,} significant) from "
+            f"{len(id_ranges)} REO id range(s) in {elapsed:.2f}s ({row_count / elapsed:,.0f} rows/sec)"
+        )
+        return row_count
+
     def __str__(self):
         return f"{self.reo_analysis}: {self.source_accession} -> {self.target_accession}: {self.reo_facets}"
 
 
 class ReoSourcesTargetsSigOnly(models.Model):
+    # The table is list partitioned by genome_assembly and then by source_chrom (see migration 0024), so its
+    # primary key in the database is (id, genome_assembly, source_chrom).
     class Meta:
         db_table = "get_expr_data_reo_sources_targets_sig_only"
         indexes = [
@@ -120,10 +265,9 @@ class ReoSourcesTargetsSigOnly(models.Model):
             GistIndex(fields=["source_loc"], name="idx_rstsom_source_loc"),
             GistIndex(fields=["target_loc"], name="idx_rstsom_target_loc"),
             GinIndex(fields=["cat_facets"], name="idx_rstsom_cat_facet"),
-            models.Index(
-                RawSQL("((reo_facets->>'Raw p value')::numeric)", []),
-                name="idx_rstsom_pval_asc",
-            ),
+            models.Index(fields=["raw_p_value"], name="idx_rstsom_raw_p_value"),
+            models.Index(fields=["effect_size"], name="idx_rstsom_effect_size"),
+            models.Index(fields=["log_significance"], name="idx_rstsom_log_significance"),
         ]
 
     reo_id = models.BigIntegerField()
@@ -133,6 +277,12 @@ class ReoSourcesTargetsSigOnly(models.Model):
     reo_experiment = models.CharField(max_length=17, validators=[validate_accession_id])
     reo_analysis = models.CharField(max_length=17, validators=[validate_accession_id])
     reo_facets = models.JSONField(null=True, blank=True)
+    # Typed copies of the numeric values in reo_facets, so they can be filtered and sorted on without
+    # extracting them from JSON for every row
+    effect_size = models.FloatField(null=True, blank=True)
+    raw_p_value = models.FloatField(null=True, blank=True)
+    adj_p_value = models.FloatField(null=True, blank=True)
+    log_significance = models.FloatField(null=True, blank=True)
     source_id = models.BigIntegerField()
     source_accession = models.CharField(max_length=17, validators=[validate_accession_id])
     source_chrom = models.CharField(max_length=10)
@@ -146,48 +296,5 @@ class ReoSourcesTargetsSigOnly(models.Model):
     genome_assembly = models.CharField(max_length=20)
     cat_facets = ArrayField(models.BigIntegerField())
 
-    @classmethod
-    def load_analysis(cls, analysis_accession):
-        with connection.cursor() as cursor:
-            cursor.execute(
-                """INSERT INTO get_expr_data_reo_sources_targets_sig_only
-                    (reo_id, archived, public, reo_accession, reo_experiment, reo_analysis, reo_facets,
-                    source_id, source_accession, source_chrom, source_loc,
-                    target_id, target_accession, target_chrom, target_loc,
-                    target_gene_symbol, target_ensembl_id, genome_assembly, cat_facets) SELECT
-                    sr.id AS reo_id,
-                    sr.archived as archived,
-                    sr.public as public,
-                    sr.accession_id AS reo_accession,
-                    sr.experiment_accession_id AS reo_experiment,
-                    sr.analysis_accession_id AS reo_analysis,
-                    sr.facet_num_values AS reo_facets,
-                    sds.id AS source_id,
-                    sds.accession_id AS source_accession,
-                    sds.chrom_name AS source_chrom,
-                    sds.location AS source_loc,
-                    sdt.id AS target_id,
-                    sdt.accession_id AS target_accession,
-                    sdt.chrom_name AS target_chrom,
-                    sdt.location AS target_loc,
-                    sdt.name AS target_gene_symbol,
-                    sdt.ensembl_id AS target_ensembl_id,
-                    sa.genome_assembly AS genome_assembly,
-                    array_remove(ARRAY_AGG(DISTINCT(srfv.facetvalue_id)) || ARRAY_AGG(DISTINCT(sdsfv.facetvalue_id)) || ARRAY_AGG(DISTINCT(sdtfv.facetvalue_id)), NULL) AS cat_facets
-                FROM search_regulatoryeffectobservation AS sr
-                LEFT JOIN search_regulatoryeffectobservation_facet_values as srfv on sr.id = srfv.regulatoryeffectobservation_id
-                LEFT JOIN search_regulatoryeffectobservation_sources AS srs ON sr.id = srs.regulatoryeffectobservation_id
-                LEFT JOIN search_regulatoryeffectobservation_targets AS srt ON sr.id = srt.regulatoryeffectobservation_id
-                LEFT JOIN search_dnafeature AS sds ON sds.id = srs.dnafeature_id
-                LEFT JOIN search_dnafeature_facet_values as sdsfv on sds.id = sdsfv.dnafeature_id
-                LEFT JOIN search_dnafeature AS sdt ON sdt.id = srt.dnafeature_id
-                LEFT JOIN search_dnafeature_facet_values as sdtfv on sdt.id = sdtfv.dnafeature_id
-                LEFT JOIN search_analysis AS sa ON sr.analysis_accession_id = sa.accession_id
-                LEFT JOIN search_file AS sf ON sa.id = sf.analysis_id
-                WHERE sr.analysis_accession_id = %s AND srfv.facetvalue_id != (SELECT id FROM search_facetvalue where value = 'Non-significant')
-                GROUP BY sr.id, sds.id, sdt.id, sa.genome_assembly""",
-                [analysis_accession],
-            )
-
     def __str__(self):
         return f"{self.reo_analysis}: {self.source_accession} -> {self.target_accession}: {self.reo_facets}"
@@ -1,23 +1,29 @@
+import importlib
 from io import StringIO
 from time import sleep
 
 import pytest
 from django.core.exceptions import BadRequest
+from django.db import connection
 from django.http import Http404
 
 from cegs_portal.conftest import RequestBuilder
+from cegs_portal.get_expr_data.models import ReoSourcesTargets, ReoSourcesTargetsSigOnly
 from cegs_portal.get_expr_data.view_models import (
     Facets,
     ReoDataSource,
+    _range_filter,
     gen_output_filename,
     output_experiment_data_list,
     parse_source_locs,
     parse_target_info,
     retrieve_experiment_data,
     sig_reo_loc_search,
+    stream_experiment_data,
     validate_expr,
     validate_filename,
     write_experiment_data_csv,
+    write_experiment_data_csv_chunks,
 )
 from cegs_portal.get_expr_data.views import (
     ExperimentDataProgressView,
@@ -25,6 +31,7 @@ from cegs_portal.get_expr_data.views import (
     LocationExperimentDataView,
     RequestExperimentDataView,
 )
+from cegs_portal.search.models import RegulatoryEffectObservation
 
 pytestmark = pytest.mark.django_db
 
@@ -137,6 +144,26 @@ def test_retrieve_both_experiment_data():
     assert len(result) == 2
 
 
+@pytest.mark.usefixtures("reg_effects")
+def test_retrieve_overlapping_regions_experiment_data():
+    result = retrieve_experiment_data(
+        [],
+        [("chr1", 1, 1_000_000), ("chr1", 1, 500_000), ("chr2", 1, 1_000_000), ("chr2", 1, 1_000_000)],
+        ["DCPEXPR0000000002"],
+        [],
+        Facets(),
+        ReoDataSource.BOTH,
+    )
+
+    assert len(result) == 2
+    assert len(set(result)) == 2
+
+
+@pytest.mark.usefixtures("reg_effects")
+def test_retrieve_no_regions_experiment_data():
+    assert retrieve_experiment_data([], [], ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH) == []
+
+
 @pytest.mark.usefixtures("private_reg_effects")
 def test_retrieve_private_experiment_data_no_exprs():
     result = retrieve_experiment_data(
@@ -201,6 +228,98 @@ def test_retrieve_num_facet_experiment_data(cat_facets, effect_size, sig, result
     assert len(result) == result_count
 
 
+NUMERIC_FACET_COLUMNS = {
+    "effect_size": RegulatoryEffectObservation.Facet.EFFECT_SIZE.value,
+    "raw_p_value": RegulatoryEffectObservation.Facet.RAW_P_VALUE.value,
+    "adj_p_value": RegulatoryEffectObservation.Facet.SIGNIFICANCE.value,
+    "log_significance": RegulatoryEffectObservation.Facet.LOG_SIGNIFICANCE.value,
+}
+
+
+def assert_typed_numeric_facets(model):
+    rows = list(model.objects.all())
+    assert len(rows) > 0
+    for row in rows:
+        for column, facet in NUMERIC_FACET_COLUMNS.items():
+            assert getattr(row, column) == row.reo_facets.get(facet)
+
+
+@pytest.mark.usefixtures("reg_effects")
+def test_load_analysis_typed_numeric_facets():
+    assert_typed_numeric_facets(ReoSourcesTargets)
+    assert_typed_numeric_facets(ReoSourcesTargetsSigOnly)
+
+
+@pytest.mark.usefixtures("reg_effects")
+def test_typed_numeric_facets_backfill():
+    migration = importlib.import_module(
+        "cegs_portal.get_expr_data.migrations.0023_reosourcestargets_typed_numeric_facets"
+    )
+    no_values = {column: None for column in NUMERIC_FACET_COLUMNS}
+    for model in [ReoSourcesTargets, ReoSourcesTargetsSigOnly]:
+        model.objects.update(**no_values)
+        with connection.cursor() as cursor:
+            cursor.execute(migration.BACKFILL.format(table=model._meta.db_table))
+        assert_typed_numeric_facets(model)
+
+
+@pytest.mark.parametrize(
+    "interval,where,params",
+    [
+        ((None, None), " AND get_expr_data_reo_sources_targets.effect_size IS NOT NULL", []),
+        (
+            (-1.0, None),
+            " AND get_expr_data_reo_sources_targets.effect_size IS NOT NULL"
+            " AND get_expr_data_reo_sources_targets.effect_size >= %s",
+            [-1.0],
+        ),
+        (
+            (None, 1.0),
+            " AND get_expr_data_reo_sources_targets.effect_size IS NOT NULL"
+            " AND get_expr_data_reo_sources_targets.effect_size < %s",
+            [1.0],
+        ),
+        (
+            (-1.0, 1.0),
+            " AND get_expr_data_reo_sources_targets.effect_size IS NOT NULL"
+            " AND get_expr_data_reo_sources_targets.effect_size >= %s"
+            " AND get_expr_data_reo_sources_targets.effect_size < %s",
+            [-1.0, 1.0],
+        ),
+    ],
+)
+def test_range_filter(interval, where, params):
+    assert _range_filter("effect_size", interval) == (where, params)
+
+
+def test_retrieve_missing_num_facet_experiment_data(reg_effects):
+    effect_source, effect_both, *_ = reg_effects
+    # effect_source has no effect size and a null significance
+    effect_source.facet_num_values = {
+        RegulatoryEffectObservation.Facet.RAW_P_VALUE.value: 0.5,
+        RegulatoryEffectObservation.Facet.SIGNIFICANCE.value: None,
+        RegulatoryEffectObservation.Facet.LOG_SIGNIFICANCE.value: None,
+    }
+    effect_source.save()
+    ReoSourcesTargets.load_analysis(effect_source.analysis.accession_id)
+    assert_typed_numeric_facets(ReoSourcesTargets)
+
+    def matching_reos(effect_size_range=None, sig_range=None):
+        facets = Facets(categorical_facets=[], effect_size_range=effect_size_range, sig_range=sig_range)
+        result = retrieve_experiment_data(
+            [], [("chr1", 1, 1_000_000), ("chr2", 1, 1_000_000)], ["DCPEXPR0000000002"], [], facets, ReoDataSource.BOTH
+        )
+        return {row[2] for row in result}
+
+    assert matching_reos() == {effect_source.accession_id, effect_both.accession_id}
+    # Observations without a value never match a range, even an unbounded one
+    assert matching_reos(effect_size_range=(None, None)) == {effect_both.accession_id}
+    assert matching_reos(effect_size_range=(-10, 0)) == {effect_both.accession_id}
+    assert matching_reos(effect_size_range=(None, 0)) == {effect_both.accession_id}
+    assert matching_reos(sig_range=(0, None)) == {effect_both.accession_id}
+    assert matching_reos(sig_range=(10, None)) == set()
+
+
 def test_retrieve_cat_facet_experiment_data(reg_effects):
     _, _, enriched, depleted, nonsig, _ = reg_effects
     facets = Facets(categorical_facets=[])
@@ -466,6 +585,52 @@ def test_write_analysis_data(reg_effects):
     )
 
 
+def test_stream_experiment_data(reg_effects):
+    regions = [("chr1", 1, 1_000_000), ("chr2", 1, 1_000_000)]
+    experiment_data = retrieve_experiment_data([], regions, ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH)
+    chunks = list(
+        stream_experiment_data([], regions, ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH, chunk_size=1)
+    )
+
+    assert len(chunks) == len(experiment_data)
+    assert all(len(chunk) == 1 for chunk in chunks)
+    assert sorted(row for chunk in chunks for row in chunk) == sorted(experiment_data)
+
+
+def test_experiment_data_order(reg_effects):
+    effect_source, effect_both, _, _, _, experiment = reg_effects
+    # Accession ids in the opposite order of the source locations
+    effect_source.accession_id = "DCPREOFFFFFFFFFF"
+    effect_source.save()
+    effect_both.accession_id = "DCPREO0000000000"
+    effect_both.save()
+    ReoSourcesTargets.load_analysis(experiment.analyses.first().accession_id)
+
+    regions = [("chr1", 1, 1_000_000), ("chr2", 1, 1_000_000)]
+    experiment_data = retrieve_experiment_data([], regions, ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH)
+    chunks = stream_experiment_data([], regions, ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH, chunk_size=1)
+
+    assert [row[2] for row in experiment_data] == ["DCPREOFFFFFFFFFF", "DCPREO0000000000"]
+    assert [row for chunk in chunks for row in chunk] == experiment_data
+
+
+@pytest.mark.usefixtures("reg_effects")
+def test_stream_experiment_data_no_regions():
+    assert list(stream_experiment_data([], [], ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH)) == []
+
+
+def test_write_experiment_data_chunks(reg_effects):
+    regions = [("chr1", 1, 1_000_000), ("chr2", 1, 1_000_000)]
+    experiment_data = sorted(
+        retrieve_experiment_data([], regions, ["DCPEXPR0000000002"], [], Facets(), ReoDataSource.BOTH)
+    )
+    output_file = StringIO()
+    write_experiment_data_csv(experiment_data, output_file)
+    chunked_output_file = StringIO()
+    write_experiment_data_csv_chunks([[row] for row in experiment_data], chunked_output_file)
+    assert chunked_output_file.getvalue() == output_file.getvalue()
+
+
 @pytest.mark.usefixtures("reg_effects")
 def test_request_experiment_data(login_test_client: RequestBuilder, file_view, req_view, status_view):
     bed_file = StringIO("chr1\t1\t1000000\nchr2\t1\t1000000")
@@ -556,6 +721,34 @@ def test_download_experiment_data_invalid_filename(login_test_client: RequestBui
         )
 
 
+def test_load_analysis(reg_effects):
+    effect_source, effect_both, _, _, nonsig_facet, _ = reg_effects
+    analysis_accession = effect_source.analysis_accession_id
+    rows = ReoSourcesTargets.objects.filter(reo_analysis=analysis_accession)
+    sig_rows = ReoSourcesTargetsSigOnly.objects.filter(reo_analysis=analysis_accession)
+    row_count = rows.count()
+
+    # 3 rows for the 3 sources of effect_source, 2 for the 2 source/target pairs of effect_both
+    assert row_count == 5
+    assert set(sig_rows.values_list("reo_id", flat=True)) == {effect_source.id}
+    assert all(nonsig_facet.id not in row.cat_facets for row in sig_rows)
+
+    # Loading an analysis again replaces its rows
+    assert ReoSourcesTargets.load_analysis(analysis_accession) == row_count
+    assert rows.count() == row_count
+    assert sig_rows.count() == 3
+
+
+@pytest.mark.usefixtures("reg_effects")
+def test_reo_sources_targets_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT tableoid::regclass::text, source_chrom FROM get_expr_data_reo_sources_targets")
+        partitions = cursor.fetchall()
+
+    assert len(partitions) == 5
+    assert all(partition == f"get_expr_data_reo_sources_targets_hg38_{chrom}" for partition, chrom in partitions)
+
+
 @pytest.mark.usefixtures("reg_effects")
 def test_sig_reo_loc_search():
     result = sig_reo_loc_search(("chr1", 1, 1000000))
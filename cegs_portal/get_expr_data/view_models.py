@@ -11,12 +11,13 @@ from uuid import UUID, uuid4
 from django.core.files.storage import default_storage
 from django.db import connection
 from huey.contrib.djhuey import db_task
-from psycopg.types.range import Int4Range, NumericRange
+from psycopg.types.range import Int4Range
 
 from cegs_portal.get_expr_data.models import ExperimentData, expr_data_base_path
 from cegs_portal.search.models import ExperimentCollection
 
 MAX_FILENAME_LENGTH = 255  # This comes from the ExperimentData.filename field/maximum macos filename length
+EXPORT_CHUNK_SIZE = 10_000  # Number of rows read from the database (and written to the output file) at a time
 
 TargetJson = TypedDict(
     "TargetJson",
@@ -175,6 +176,10 @@ def gen_output_rows(experiment_data):
 
 
 def write_experiment_data_csv(experiment_data, output_file):
+    write_experiment_data_csv_chunks([experiment_data], output_file)
+
+
+def write_experiment_data_csv_chunks(experiment_data_chunks, output_file):
     csv_writer = csv.writer(output_file, delimiter="\t", lineterminator="\n")
     csv_writer.writerow(
         [
@@ -187,10 +192,13 @@ def write_experiment_data_csv(experiment_data, output_file):
             "Analysis Accession Id",
         ]
     )
-    for row in gen_output_rows(experiment_data):
-        row[0] = ",".join(row[0])
-        row[1] = ",".join(row[1])
-        csv_writer.writerow(row)
+    for experiment_data in experiment_data_chunks:
+        rows = []
+        for row in gen_output_rows(experiment_data):
+            row[0] = ",".join(row[0])
+            row[1] = ",".join(row[1])
+            rows.append(row)
+        csv_writer.writerows(rows)
 
 
 def output_experiment_data_list(
@@ -227,8 +235,8 @@ def output_experiment_data_list(
                 "analysis id": row[6],
             }
         )
-    # Sort so the output is always in the same order. This isn't otherwise guaranteed because the
-    # output of retrieve_experiment_data is a set, which is unordered.
+    # Sort so the output is ordered by source location. retrieve_experiment_data orders its output by
+    # accession ids, which doesn't group REOs from the same locations together.
     exp_data_list.sort(key=itemgetter("source locs", "expr id", "analysis id"))
     return exp_data_list
 
@@ -254,95 +262,164 @@ def output_experiment_data_csv(
 
     experiment_data_info = ExperimentData(user=user, filename=output_filename)
     experiment_data_info.save()
-    experiment_data = retrieve_experiment_data(
+    experiment_data_chunks = stream_experiment_data(
         user.all_experiments(), regions, experiments, analyses, facets, data_source
     )
     full_output_path = os.path.join(expr_data_base_path(), output_filename)
     with open(full_output_path, "w", encoding="utf-8") as output_file:
-        write_experiment_data_csv(experiment_data, output_file)
+        write_experiment_data_csv_chunks(experiment_data_chunks, output_file)
         experiment_data_info.file = output_file
         experiment_data_info.state = ExperimentData.DataState.READY
         experiment_data_info.save()
 
 
-def retrieve_experiment_data(
-    user_experiments,
-    regions: Optional[list[tuple[str, int, int]]],
-    experiments: Optional[list[str]],
-    analyses: Optional[list[str]],
-    facets: Facets,
-    data_source: ReoDataSource,
-    assembly: Optional[str] = None,
-):
-    where = r"""WHERE (get_expr_data_reo_sources_targets.archived = false AND (get_expr_data_reo_sources_targets.public = true OR
-    get_expr_data_reo_sources_targets.reo_experiment = ANY(%s)))"""
-    match data_source:
-        case ReoDataSource.EVERYTHING:
-            inputs = [[user_experiments]]
-        case ReoDataSource.SOURCES | ReoDataSource.TARGETS | ReoDataSource.BOTH:
-            inputs = [[user_experiments] for _ in regions]
-        case _:
-            raise InvalidDataSource()
-
+def _region_join(data_source: ReoDataSource) -> str:
+    """
+    Returns a JOIN against the list of regions (passed in as three arrays: chromosome names, start positions,
+    and end positions) that matches rows overlapping any of the regions for the data source.
+    """
+    regions = "unnest(%s::text[], %s::integer[], %s::integer[]) AS regions(chrom, start_pos, end_pos)"
+    source_match = """(get_expr_data_reo_sources_targets.source_chrom = regions.chrom
+                    AND get_expr_data_reo_sources_targets.source_loc && int4range(regions.start_pos, regions.end_pos))"""
+    target_match = """(get_expr_data_reo_sources_targets.target_chrom = regions.chrom
+                    AND get_expr_data_reo_sources_targets.target_loc && int4range(regions.start_pos, regions.end_pos))"""
     match data_source:
         case ReoDataSource.SOURCES:
-            where = f"""{where} AND (get_expr_data_reo_sources_targets.source_chrom = %s
-                            AND get_expr_data_reo_sources_targets.source_loc && %s)"""
-            for i, (chrom, start, end) in zip(inputs, regions):
-                i.append(chrom)
-                i.append(Int4Range(start, end))
+            return f"JOIN {regions} ON {source_match}"
         case ReoDataSource.TARGETS:
-            where = f"""{where} AND (get_expr_data_reo_sources_targets.target_chrom = %s
-                            AND get_expr_data_reo_sources_targets.target_loc && %s)"""
-            for i, (chrom, start, end) in zip(inputs, regions):
-                i.append(chrom)
-                i.append(Int4Range(start, end))
-        case ReoDataSource.BOTH:
-            where = f"""{where} AND ((get_expr_data_reo_sources_targets.source_chrom = %s AND get_expr_data_reo_sources_targets.source_loc && %s)
-                            OR (get_expr_data_reo_sources_targets.target_chrom = %s AND get_expr_data_reo_sources_targets.target_loc && %s))"""
-            for i, (chrom, start, end) in zip(inputs, regions):
-                i.append(chrom)
-                i.append(Int4Range(start, end))
-                i.append(chrom)
-                i.append(Int4Range(start, end))
-        case ReoDataSource.EVERYTHING:
-            pass
+            return f"JOIN {regions} ON {target_match}"
         case _:
             raise InvalidDataSource()
 
+
+def _region_join_params(regions: list[tuple[str, int, int]]) -> list[list]:
+    chroms, starts, ends = [], [], []
+    for chrom, start, end in regions:
+        chroms.append(chrom)
+        starts.append(start)
+        ends.append(end)
+    return [chroms, starts, ends]
+
+
+def _range_filter(column: str, interval: tuple[Optional[float], Optional[float]]) -> tuple[str, list]:
+    """
+    Matches rows where column is in the interval. The lower bound is inclusive and the upper bound is
+    exclusive. A missing (None) bound is unbounded. Rows without a value never match.
+    """
+    lower, upper = interval
+    column = f"get_expr_data_reo_sources_targets.{column}"
+    where = f" AND {column} IS NOT NULL"
+    params = []
+    if lower is not None:
+        where = f"{where} AND {column} >= %s"
+        params.append(lower)
+    if upper is not None:
+        where = f"{where} AND {column} < %s"
+        params.append(upper)
+    return where, params
+
+
+def _experiment_data_filters(
+    experiments: Optional[list[str]],
+    analyses: Optional[list[str]],
+    facets: Facets,
+    assembly: Optional[str],
+) -> tuple[str, list]:
+    where = ""
+    params: list = []
+
     if experiments is not None and analyses is not None:
         where = f"""{where} AND (get_expr_data_reo_sources_targets.reo_experiment = ANY(%s) OR
         get_expr_data_reo_sources_targets.reo_analysis = ANY(%s))"""
-        for i in inputs:
-            i.append(experiments)
-            i.append(analyses)
+        params.append(experiments)
+        params.append(analyses)
     elif experiments is not None:
         where = f"{where} AND get_expr_data_reo_sources_targets.reo_experiment = ANY(%s)"
-        for i in inputs:
-            i.append(experiments)
+        params.append(experiments)
     elif analyses is not None:
         where = f"{where} AND get_expr_data_reo_sources_targets.reo_analysis = ANY(%s)"
-        for i in inputs:
-            i.append(analyses)
+        params.append(analyses)
 
     if len(facets.categorical_facets) > 0:
         where = f"{where} AND %s::bigint[] && get_expr_data_reo_sources_targets.cat_facets"
-        for i in inputs:
-            i.append(facets.categorical_facets)
+        params.append(facets.categorical_facets)
     if facets.effect_size_range is not None:
-        where = f"{where} AND %s::numrange @> (get_expr_data_reo_sources_targets.reo_facets ->> 'Effect Size')::numeric"
-        for i in inputs:
-            i.append(NumericRange(*facets.effect_size_range))
+        range_where, range_params = _range_filter("effect_size", facets.effect_size_range)
+        where = f"{where}{range_where}"
+        params.extend(range_params)
     if facets.sig_range is not None:
-        where = f"{where} AND %s::numrange @> (get_expr_data_reo_sources_targets.reo_facets ->> '-log10 Significance')::numeric"
-        for i in inputs:
-            i.append(NumericRange(*facets.sig_range))
+        range_where, range_params = _range_filter("log_significance", facets.sig_range)
+        where = f"{where}{range_where}"
+        params.extend(range_params)
 
     if assembly is not None:
         where = f"{where} AND genome_assembly = %s"
-        for i in inputs:
-            i.append(assembly)
+        params.append(assembly)
+
+    return where, params
+
+
+def _experiment_data_query(
+    user_experiments,
+    regions: Optional[list[tuple[str, int, int]]],
+    experiments: Optional[list[str]],
+    analyses: Optional[list[str]],
+    facets: Facets,
+    data_source: ReoDataSource,
+    assembly: Optional[str] = None,
+) -> Optional[tuple[str, list]]:
+    """
+    Builds a single statement that finds all the matching REOs, in every region, at once. The regions are
+    joined against as an array, so the database takes care of removing duplicate rows (e.g., REOs in
+    overlapping regions) and ordering the results.
+
+    Returns None if the query can't match anything.
+    """
+    where = r"""WHERE (get_expr_data_reo_sources_targets.archived = false AND (get_expr_data_reo_sources_targets.public = true OR
+    get_expr_data_reo_sources_targets.reo_experiment = ANY(%s)))"""
+    where_params = [user_experiments]
+
+    filter_where, filter_params = _experiment_data_filters(experiments, analyses, facets, assembly)
+    where = f"{where}{filter_where}"
+    where_params.extend(filter_params)
+
+    match data_source:
+        case ReoDataSource.EVERYTHING:
+            matches = (
+                f"SELECT get_expr_data_reo_sources_targets.reo_accession FROM get_expr_data_reo_sources_targets {where}"
+            )
+            params = where_params
+        case ReoDataSource.SOURCES | ReoDataSource.TARGETS:
+            if not regions:
+                return None
+
+            matches = f"""SELECT get_expr_data_reo_sources_targets.reo_accession
+                FROM get_expr_data_reo_sources_targets
+                {_region_join(data_source)}
+                {where}"""
+            params = _region_join_params(regions) + where_params
+        case ReoDataSource.BOTH:
+            if not regions:
+                return None
+
+            # The table is partitioned by source chromosome. Matching sources and targets separately, instead
+            # of with an OR, lets the sources match only read the partitions of the regions' chromosomes.
+            matches = f"""SELECT get_expr_data_reo_sources_targets.reo_accession
+                FROM get_expr_data_reo_sources_targets
+                {_region_join(ReoDataSource.SOURCES)}
+                {where}
+                UNION
+                SELECT get_expr_data_reo_sources_targets.reo_accession
+                FROM get_expr_data_reo_sources_targets
+                {_region_join(ReoDataSource.TARGETS)}
+                {where}"""
+            region_params = _region_join_params(regions)
+            params = region_params + where_params + region_params + where_params
+        case _:
+            raise InvalidDataSource()
 
+    # Rows are unique per REO accession id because of the GROUP BY. They're ordered by source locations, then
+    # target info, then accession id, the same order as the export had when its rows were sorted in Python.
     query = f"""SELECT ARRAY_AGG(DISTINCT
                             (get_expr_data_reo_sources_targets.source_chrom,
                              get_expr_data_reo_sources_targets.source_loc)) AS sources,
@@ -358,18 +435,55 @@ def retrieve_experiment_data(
                         get_expr_data_reo_sources_targets.reo_experiment as eai, -- eai = experiment accession id
                         get_expr_data_reo_sources_targets.reo_analysis as aai -- aai = analysis accession id
                     FROM get_expr_data_reo_sources_targets
-                    WHERE get_expr_data_reo_sources_targets.reo_accession = ANY(SELECT DISTINCT get_expr_data_reo_sources_targets.reo_accession
-                                                                  FROM get_expr_data_reo_sources_targets
-                                                                  {where})
-                    GROUP BY ai, get_expr_data_reo_sources_targets.reo_facets, eai, aai"""
+                    WHERE get_expr_data_reo_sources_targets.reo_accession = ANY({matches})
+                    GROUP BY ai, get_expr_data_reo_sources_targets.reo_facets, eai, aai
+                    ORDER BY sources, targets, ai"""
 
+    return query, params
+
+
+def retrieve_experiment_data(
+    user_experiments,
+    regions: Optional[list[tuple[str, int, int]]],
+    experiments: Optional[list[str]],
+    analyses: Optional[list[str]],
+    facets: Facets,
+    data_source: ReoDataSource,
+    assembly: Optional[str] = None,
+):
+    statement = _experiment_data_query(user_experiments, regions, experiments, analyses, facets, data_source, assembly)
+    if statement is None:
+        return []
+
+    query, params = statement
     with connection.cursor() as cursor:
-        experiment_data = []
-        for where_params in inputs:
-            cursor.execute(query, where_params)
-            experiment_data.extend(cursor.fetchall())
-        experiment_data.sort()
-    return list(map(itemgetter(0), groupby(experiment_data)))
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+
+def stream_experiment_data(
+    user_experiments,
+    regions: Optional[list[tuple[str, int, int]]],
+    experiments: Optional[list[str]],
+    analyses: Optional[list[str]],
+    facets: Facets,
+    data_source: ReoDataSource,
+    assembly: Optional[str] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+):
+    """
+    Like retrieve_experiment_data, but yields the results in lists of at most chunk_size rows read from a
+    server-side cursor.
+    """
+    statement = _experiment_data_query(user_experiments, regions, experiments, analyses, facets, data_source, assembly)
+    if statement is None:
+        return
+
+    query, params = statement
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(query, params)
+        while experiment_data := cursor.fetchmany(chunk_size):
+            yield experiment_data
 
 
 def sig_reo_loc_search(
@@ -389,24 +503,41 @@ def sig_reo_loc_search(
         where = f"{where} (get_expr_data_reo_sources_targets_sig_only.public = true OR"
 
     where = f"""{where}
-                    get_expr_data_reo_sources_targets_sig_only.reo_experiment = ANY(%s)) AND
-                    ((get_expr_data_reo_sources_targets_sig_only.source_chrom = %s AND
-                    get_expr_data_reo_sources_targets_sig_only.source_loc && %s) OR
-                    (get_expr_data_reo_sources_targets_sig_only.target_chrom = %s AND
-                    get_expr_data_reo_sources_targets_sig_only.target_loc && %s))"""
-    inputs = [
-        experiments,
-        location[0],
-        Int4Range(location[1], location[2]),
-        location[0],
-        Int4Range(location[1], location[2]),
-    ]
+                    get_expr_data_reo_sources_targets_sig_only.reo_experiment = ANY(%s))"""
+    where_inputs = [experiments]
 
     if assembly is not None:
         where = f"{where} AND genome_assembly = %s"
-        inputs.append(assembly)
-
-    inputs.append(count)
+        where_inputs.append(assembly)
+
+    source_match = """(get_expr_data_reo_sources_targets_sig_only.source_chrom = %s AND
+                    get_expr_data_reo_sources_targets_sig_only.source_loc && %s)"""
+    target_match = """(get_expr_data_reo_sources_targets_sig_only.target_chrom = %s AND
+                    get_expr_data_reo_sources_targets_sig_only.target_loc && %s)"""
+    location_inputs = [location[0], Int4Range(location[1], location[2])]
+
+    # The table is partitioned by source chromosome. Matching sources and targets separately, instead of with
+    # an OR, lets the sources match only read the location's partition. Rows matching both are only included
+    # by the sources match.
+    columns = """get_expr_data_reo_sources_targets_sig_only.reo_accession,
+                                        get_expr_data_reo_sources_targets_sig_only.reo_experiment as eai,
+                                        get_expr_data_reo_sources_targets_sig_only.reo_analysis as aai,
+                                        get_expr_data_reo_sources_targets_sig_only.raw_p_value as pval"""
+    matches = f"""SELECT {columns}
+                                    FROM get_expr_data_reo_sources_targets_sig_only
+                                    {where} AND {source_match}
+                                UNION ALL
+                                SELECT {columns}
+                                    FROM get_expr_data_reo_sources_targets_sig_only
+                                    {where} AND {target_match} AND NOT {source_match}"""
+    inputs = [
+        *where_inputs,
+        *location_inputs,
+        *where_inputs,
+        *location_inputs,
+        *location_inputs,
+        count,
+    ]
 
     query = f"""SELECT ARRAY_AGG(DISTINCT
                             (get_expr_data_reo_sources_targets_sig_only.source_chrom,
@@ -430,19 +561,14 @@ def sig_reo_loc_search(
                         WITH s AS (
                             SELECT *, ROW_NUMBER()
                             OVER (PARTITION BY aai ORDER BY pval ASC)
-                            FROM(SELECT get_expr_data_reo_sources_targets_sig_only.reo_accession,
-                                        get_expr_data_reo_sources_targets_sig_only.reo_experiment as eai,
-                                        get_expr_data_reo_sources_targets_sig_only.reo_analysis as aai,
-                                        (get_expr_data_reo_sources_targets_sig_only.reo_facets->>'Raw p value')::numeric as pval
-                                    FROM get_expr_data_reo_sources_targets_sig_only
-                                    {where}
-                                ) as s2)
+                            FROM({matches}) as s2)
                         SELECT reo_accession
                             FROM s
                             WHERE ROW_NUMBER <= %s
                     )
-                    GROUP BY ai, get_expr_data_reo_sources_targets_sig_only.reo_facets, eai, se.name, aai
-                    ORDER BY eai, aai, raw_p_value
+                    GROUP BY ai, get_expr_data_reo_sources_targets_sig_only.reo_facets,
+                        get_expr_data_reo_sources_targets_sig_only.raw_p_value, eai, se.name, aai
+                    ORDER BY eai, aai, get_expr_data_reo_sources_targets_sig_only.raw_p_value
                     """
 
     with connection.cursor() as cursor:
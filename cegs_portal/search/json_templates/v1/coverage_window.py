@@ -0,0 +1,2 @@
+def coverage_window(coverage_window_obj, _options):
+    return coverage_window_obj
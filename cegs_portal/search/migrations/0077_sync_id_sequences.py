@@ -0,0 +1,24 @@
+from django.db import migrations
+
+# FeatureIds and ReoIds used to hand out ids above max(id) and then restart the id sequences, which could
+# leave the sequences behind the ids in use. They now reserve ids from the sequences, so make sure the
+# sequences are past every existing id.
+SYNC_SEQUENCE = """SELECT setval(
+    pg_get_serial_sequence('{table}', 'id'),
+    COALESCE((SELECT max(id) FROM {table}), 0) + 1,
+    false
+)"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("search", "0076_auto_20250314_1418"),
+    ]
+
+    operations = [
+        migrations.RunSQL(SYNC_SEQUENCE.format(table="search_dnafeature"), reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(
+            SYNC_SEQUENCE.format(table="search_regulatoryeffectobservation"), reverse_sql=migrations.RunSQL.noop
+        ),
+    ]
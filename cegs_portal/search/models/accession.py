@@ -1,6 +1,6 @@
 from datetime import datetime, timezone
 
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, connections, models
 
 from cegs_portal.search.models.utils import AccessionId, AccessionType
 from cegs_portal.search.models.validators import validate_accession_id
@@ -50,29 +50,71 @@ class AccessionIdLog(models.Model):
         return AccessionIdLog.objects.filter(accession_type=atype).order_by("-created_at").first()
 
 
+# The most accession ids of one type reserved at a time. Blocks start at one id and double up to this, so types
+# that only need a few ids per upload (e.g., analyses) don't leave gaps.
+ACCESSION_ID_BLOCK_SIZE = 10_000
+
+
 class AccessionIds:
-    def __init__(self, message: str = ""):
+    """
+    Hands out accession ids, counting up from each accession type's latest AccessionIdLog entry.
+
+    Ids are reserved in blocks. Each block is reserved in a short transaction of its own, on a separate
+    connection: an advisory lock on the type is taken, the latest log entry is read, and the id after the block
+    is logged and committed. Concurrent uploads can load data at the same time without handing out the same ids,
+    and reserved ids stay reserved even if the caller's transaction is rolled back. Ids that are reserved but not
+    used (at the end of the last block) are skipped.
+    """
+
+    def __init__(self, message: str = "", max_block_size: int = ACCESSION_ID_BLOCK_SIZE):
         self.id_dict: dict[AccessionType, AccessionId] = {}
-        self.modified_dict: dict[AccessionType, bool] = {}
+        self.remaining_dict: dict[AccessionType, int] = {}
+        self.block_size_dict: dict[AccessionType, int] = {}
         self.message = message
+        self.max_block_size = max_block_size
+        self.reservation_connection = None
 
     def _load(self, atype: AccessionType):
-        if atype in self.id_dict:
-            return self.id_dict[atype]
-
-        entry = AccessionIdLog.latest(atype)
-        if entry is not None:
-            result = AccessionId(entry.accession_id)
-        else:
-            result = AccessionId.start_id(atype)
-        self.id_dict[atype] = result
-        self.modified_dict[atype] = False
-        return result
+        if self.remaining_dict.get(atype, 0) == 0:
+            block_size = min(self.block_size_dict.get(atype, 0) * 2 or 1, self.max_block_size)
+            self.id_dict[atype] = self._reserve_block(atype, block_size)
+            self.remaining_dict[atype] = block_size
+            self.block_size_dict[atype] = block_size
+        return self.id_dict[atype]
+
+    def _reserve_block(self, atype: AccessionType, block_size: int) -> AccessionId:
+        if self.reservation_connection is None:
+            self.reservation_connection = connections.create_connection(DEFAULT_DB_ALIAS)
+            self.reservation_connection.set_autocommit(False)
+
+        try:
+            with self.reservation_connection.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", [f"accession_id_log:{atype}"])
+                cursor.execute(
+                    f"""SELECT accession_id FROM {AccessionIdLog._meta.db_table}
+                    WHERE accession_type = %s ORDER BY created_at DESC LIMIT 1""",
+                    [str(atype)],
+                )
+                entry = cursor.fetchone()
+                first_id = AccessionId(entry[0]) if entry is not None else AccessionId.start_id(atype)
+
+                next_id = AccessionId(str(first_id))
+                next_id.id_num += block_size
+                cursor.execute(
+                    f"""INSERT INTO {AccessionIdLog._meta.db_table} (created_at, accession_type, accession_id, message)
+                    VALUES (%s, %s, %s, %s)""",
+                    [datetime.now(timezone.utc), str(atype), str(next_id), self.message],
+                )
+            self.reservation_connection.commit()
+        except Exception:
+            self.reservation_connection.rollback()
+            raise
+        return first_id
 
     def incr(self, key: AccessionType):
         old_value = str(self._load(key))
         self.id_dict[key].incr()
-        self.modified_dict[key] = True
+        self.remaining_dict[key] -= 1
         return old_value
 
     def __setitem__(self, key: AccessionType, accession_id: AccessionId):
@@ -85,13 +127,6 @@ class AccessionIds:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        now = datetime.now(timezone.utc)
-        log_items = []
-        for atype, accession_id in self.id_dict.items():
-            if self.modified_dict[atype]:
-                log_items.append(
-                    AccessionIdLog(
-                        created_at=now, accession_type=str(atype), accession_id=str(accession_id), message=self.message
-                    )
-                )
-        AccessionIdLog.objects.bulk_create(log_items)
+        if self.reservation_connection is not None:
+            self.reservation_connection.close()
+            self.reservation_connection = None
@@ -1,4 +1,9 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
+from django.db import connection
 
 from cegs_portal.search.models import (
     AccessionId,
@@ -8,29 +13,34 @@ from cegs_portal.search.models import (
 )
 
 
+# Accession ids are reserved and logged on a separate connection, so the log isn't rolled back between tests
+def next_accession_id(atype):
+    entry = AccessionIdLog.latest(atype)
+    return AccessionId(entry.accession_id) if entry is not None else AccessionId.start_id(atype)
+
+
 @pytest.mark.django_db()
 def test_accession_creation():
+    expected_id = next_accession_id(AccessionType.GENE)
     with AccessionIds(message="Test") as accession_ids:
         old = accession_ids.incr(AccessionType.GENE)
-        start_id = AccessionId.start_id(AccessionType.GENE)
-        assert old == str(start_id)
+        assert old == str(expected_id)
 
 
 @pytest.mark.django_db()
 def test_accession_incr():
     with AccessionIds(message="Test") as accession_ids:
-        accession_ids.incr(AccessionType.GENE)
-        start_id = AccessionId.start_id(AccessionType.GENE)
+        first = AccessionId(accession_ids.incr(AccessionType.GENE))
         new = accession_ids.incr(AccessionType.GENE)
-        start_id.incr()
-        assert new == str(start_id)
+        first.incr()
+        assert new == str(first)
 
 
 @pytest.mark.django_db()
 def test_accession_save():
     with AccessionIds(message="Test") as accession_ids:
         accession_ids.incr(AccessionType.GENE)
-    log_entry = AccessionIdLog.objects.get(accession_type=AccessionType.GENE)
+    log_entry = AccessionIdLog.latest(AccessionType.GENE)
     assert log_entry.message == "Test"
 
 
@@ -57,3 +67,63 @@ def test_accession_latest():
     log_entry1 = AccessionIdLog.latest(AccessionType.GENE)
     log_entry2 = AccessionIdLog.objects.filter(accession_type=AccessionType.GENE).order_by("-created_at").first()
     assert log_entry1 == log_entry2
+
+
+@pytest.mark.django_db()
+def test_accession_blocks():
+    message = f"Blocks {uuid.uuid4()}"
+    first_id = next_accession_id(AccessionType.GENE)
+    with AccessionIds(message=message, max_block_size=4) as accession_ids:
+        ids = [accession_ids.incr(AccessionType.GENE) for _ in range(10)]
+
+    # Blocks of 1, 2, 4, and 4 ids. The last 1 is reserved but not used.
+    expected_ids = []
+    for _ in range(10):
+        expected_ids.append(str(first_id))
+        first_id.incr()
+    assert ids == expected_ids
+    assert AccessionIdLog.objects.filter(accession_type=AccessionType.GENE, message=message).count() == 4
+    first_id.incr()
+    assert AccessionIdLog.latest(AccessionType.GENE).accession_id == str(first_id)
+
+
+LOADER_COUNT = 4
+IDS_PER_LOADER = 20
+
+
+def allocate_ids(loader):
+    # Each loader runs on its own connection, like an upload running in a separate huey worker
+    try:
+        with AccessionIds(message=f"Loader {loader}") as accession_ids:
+            ids = [accession_ids.incr(AccessionType.GENE)]
+            # Give the other loaders a chance to reserve ids before this one reserves more
+            time.sleep(0.1)
+            ids.extend(accession_ids.incr(AccessionType.GENE) for _ in range(IDS_PER_LOADER - 1))
+        return ids
+    finally:
+        connection.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_accession_ids():
+    with ThreadPoolExecutor(max_workers=LOADER_COUNT) as executor:
+        allocated_ids = list(executor.map(allocate_ids, range(LOADER_COUNT)))
+
+    all_ids = [AccessionId(accession_id) for ids in allocated_ids for accession_id in ids]
+    assert len({accession_id.id_num for accession_id in all_ids}) == LOADER_COUNT * IDS_PER_LOADER
+
+    # Every id handed out is before the next id in the log
+    next_id = next_accession_id(AccessionType.GENE)
+    assert max(accession_id.id_num for accession_id in all_ids) < next_id.id_num
+
+
+@pytest.mark.django_db
+def test_accession_reserved_after_error():
+    with pytest.raises(ValueError):
+        with AccessionIds(message="Test") as accession_ids:
+            used_id = AccessionId(accession_ids.incr(AccessionType.GENE))
+            raise ValueError()
+
+    # The id stays reserved, so it isn't handed out again
+    used_id.incr()
+    assert next_accession_id(AccessionType.GENE).id_num >= used_id.id_num
@@ -55,6 +55,11 @@ urlpatterns = [
         csrf_exempt(views.v1.ExperimentCoverageView.as_view()),
         name="experiment_coverage",
     ),
+    path(
+        "experiment_coverage_window",
+        csrf_exempt(views.v1.CoverageWindowView.as_view()),
+        name="experiment_coverage_window",
+    ),
     path(
         "combined_experiment_coverage",
         csrf_exempt(views.v1.CombinedExperimentView.as_view()),
@@ -105,6 +110,10 @@ urlpatterns = [
         "v1/experiment_coverage",
         csrf_exempt(views.v1.ExperimentCoverageView.as_view()),
     ),
+    path(
+        "v1/experiment_coverage_window",
+        csrf_exempt(views.v1.CoverageWindowView.as_view()),
+    ),
     path(
         "v1/combined_experiment_coverage",
         csrf_exempt(views.v1.CombinedExperimentView.as_view()),
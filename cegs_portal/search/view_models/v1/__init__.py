@@ -1,6 +1,7 @@
 from .dna_features import DNAFeatureSearch, IdType, LocSearchType
 from .experiment import ExperimentSearch
 from .experiment_collection import ExperimentCollectionSearch
+from .experiment_coverage import CoverageCache
 from .non_targeting_reos import DNAFeatureNonTargetSearch
 from .reg_effects import RegEffectSearch
 from .search import Search
@@ -0,0 +1,198 @@
+import math
+from typing import Any, Optional
+
+import numpy as np
+
+# Bucket sizes of each level of the pyramid, from coarsest to finest
+PYRAMID_RESOLUTIONS = [2_000_000, 500_000, 100_000, 20_000, 5_000]
+PYRAMID_FILENAME = "coverage_pyramid.npz"
+FEATURE_KINDS = ["source", "target"]
+# Pads rows of 2-d arrays of categorical facet value ids
+NO_FACET = 0
+
+
+def _key(kind: str, chrom: str, name: str) -> str:
+    return f"{kind}__{chrom}__{name}"
+
+
+def _in_interval(values: np.ndarray, interval: tuple[Optional[float], Optional[float]]) -> np.ndarray:
+    """Which values are in [lower, upper). Missing (NaN) values are never in the interval."""
+    lower, upper = interval
+    in_interval = ~np.isnan(values)
+    if lower is not None:
+        in_interval &= values >= lower
+    if upper is not None:
+        in_interval &= values < upper
+    return in_interval
+
+
+class CoveragePyramid:
+    """
+    Coverage data for an analysis at several resolutions.
+
+    For each chromosome and each kind of feature (sources and targets) the pyramid stores, sorted by
+    position, the midpoint of every feature along with its observation's effect size, significance,
+    and categorical facet values. Each level of the pyramid is an array of offsets into that sorted data,
+    one per bucket, so the observations in any bucket are a contiguous slice and filtered bucket counts
+    for a window can be calculated without searching.
+    """
+
+    def __init__(self, arrays: dict[str, np.ndarray]):
+        self.arrays = arrays
+        self.resolutions = [int(r) for r in arrays["resolutions"]]
+        self.chroms = set(str(c) for c in arrays["chroms"])
+
+    @classmethod
+    def build(cls, features: dict[str, dict[str, dict[str, np.ndarray]]]) -> "CoveragePyramid":
+        """
+        features is keyed by feature kind, then chromosome. Each chromosome has "pos", "effect", "sig", and
+        "facets" arrays. "facets" is either an object array of each feature's categorical facet value ids or a
+        2-d array of them, with each row padded with NO_FACET.
+        """
+        arrays = {"resolutions": np.array(PYRAMID_RESOLUTIONS, dtype=np.int64)}
+        chroms = set()
+        for kind in FEATURE_KINDS:
+            for chrom, columns in features.get(kind, {}).items():
+                chroms.add(chrom)
+                order = np.argsort(columns["pos"], kind="stable")
+                pos = columns["pos"][order]
+                facets = columns["facets"][order]
+                if facets.dtype == object:
+                    facet_counts = np.array([len(f) for f in facets], dtype=np.int64)
+                    facets = (
+                        np.concatenate([np.asarray(f, dtype=np.int64) for f in facets])
+                        if len(facets) > 0
+                        else np.array([], dtype=np.int64)
+                    )
+                else:
+                    has_facet = facets != NO_FACET
+                    facet_counts = has_facet.sum(axis=1, dtype=np.int64)
+                    facets = facets[has_facet].astype(np.int64)
+
+                arrays[_key(kind, chrom, "pos")] = pos
+                arrays[_key(kind, chrom, "effect")] = columns["effect"][order].astype(np.float32)
+                arrays[_key(kind, chrom, "sig")] = columns["sig"][order].astype(np.float32)
+                arrays[_key(kind, chrom, "facet_offsets")] = np.concatenate(([0], np.cumsum(facet_counts)))
+                arrays[_key(kind, chrom, "facets")] = facets
+
+                chrom_end = int(pos[-1]) + 1 if len(pos) > 0 else 0
+                for resolution in PYRAMID_RESOLUTIONS:
+                    bucket_starts = np.arange(0, chrom_end + resolution, resolution, dtype=np.int64)
+                    arrays[_key(kind, chrom, str(resolution))] = np.searchsorted(pos, bucket_starts, side="left")
+
+        arrays["chroms"] = np.array(sorted(chroms))
+        return cls(arrays)
+
+    def save(self, filename: str):
+        # Uncompressed, so the file size is a reasonable estimate of the loaded size
+        np.savez(filename, **self.arrays)
+
+    @classmethod
+    def load(cls, filename: str) -> "CoveragePyramid":
+        with np.load(filename, allow_pickle=False) as pyramid_file:
+            return cls({key: pyramid_file[key] for key in pyramid_file.files})
+
+    def resolution_for(self, start: int, end: int, width: int) -> int:
+        """The finest resolution that has at most `width` buckets in the window"""
+        for resolution in reversed(self.resolutions):
+            if math.ceil((end - start) / resolution) <= width:
+                return resolution
+        return self.resolutions[0]
+
+    def window(
+        self,
+        chrom: str,
+        start: int,
+        end: int,
+        width: int,
+        facet_groups: Optional[list[set[int]]] = None,
+        effect_interval: Optional[tuple[Optional[float], Optional[float]]] = None,
+        sig_interval: Optional[tuple[Optional[float], Optional[float]]] = None,
+    ) -> dict[str, Any]:
+        """
+        Filtered bucket data for the window chrom:start-end, at the resolution that best fits `width` pixels.
+
+        facet_groups holds the selected categorical facet values grouped by facet. An observation passes the
+        categorical filter if, for every group, it has at least one of the group's values.
+
+        effect_interval and sig_interval filter on the same terms as the experiment data export (see
+        get_expr_data.view_models._range_filter): the lower bound is inclusive, the upper bound is exclusive,
+        and a missing (None) bound is unbounded. Observations without a value never pass a numeric filter.
+        """
+        resolution = self.resolution_for(start, end, width)
+        first_bucket = start // resolution
+        last_bucket = (end - 1) // resolution
+        bucket_starts = np.arange(first_bucket, last_bucket + 1, dtype=np.int64) * resolution
+
+        result = {
+            "chrom": chrom,
+            "start": start,
+            "end": end,
+            "bucket_size": resolution,
+            "buckets": [
+                {"start": int(bucket_start), "end": int(bucket_start) + resolution} for bucket_start in bucket_starts
+            ],
+        }
+
+        for kind in FEATURE_KINDS:
+            counts, max_sigs, max_effects = self._bucket_values(
+                kind, chrom, resolution, first_bucket, last_bucket, facet_groups, effect_interval, sig_interval
+            )
+            for bucket, count, max_sig, max_effect in zip(result["buckets"], counts, max_sigs, max_effects):
+                bucket[f"{kind}_count"] = int(count)
+                bucket[f"{kind}_max_log_significance"] = float(max_sig) if np.isfinite(max_sig) else None
+                bucket[f"{kind}_max_abs_effect_size"] = float(max_effect) if np.isfinite(max_effect) else None
+
+        return result
+
+    def _bucket_values(
+        self, kind, chrom, resolution, first_bucket, last_bucket, facet_groups, effect_interval, sig_interval
+    ):
+        bucket_count = last_bucket - first_bucket + 1
+        if (offsets := self.arrays.get(_key(kind, chrom, str(resolution)))) is None:
+            return np.zeros(bucket_count), np.full(bucket_count, -np.inf), np.full(bucket_count, -np.inf)
+
+        # Buckets past the last feature on the chromosome are empty, so clamp to the end of the data
+        bounds = np.arange(first_bucket, last_bucket + 2)
+        bounds = offsets[np.minimum(bounds, len(offsets) - 1)]
+        lo, hi = int(bounds[0]), int(bounds[-1])
+
+        effect = self.arrays[_key(kind, chrom, "effect")][lo:hi]
+        sig = self.arrays[_key(kind, chrom, "sig")][lo:hi]
+        mask = self._facet_mask(kind, chrom, lo, hi, facet_groups)
+
+        if effect_interval is not None:
+            mask &= _in_interval(effect, effect_interval)
+        if sig_interval is not None:
+            mask &= _in_interval(sig, sig_interval)
+
+        cumulative = np.concatenate(([0], np.cumsum(mask)))
+        local_bounds = bounds - lo
+        counts = cumulative[local_bounds[1:]] - cumulative[local_bounds[:-1]]
+
+        max_sigs = self._bucket_max(np.where(mask, np.nan_to_num(sig, nan=-np.inf), -np.inf), local_bounds)
+        max_effects = self._bucket_max(
+            np.where(mask, np.nan_to_num(np.abs(effect), nan=-np.inf), -np.inf), local_bounds
+        )
+        return counts, max_sigs, max_effects
+
+    def _facet_mask(self, kind, chrom, lo, hi, facet_groups):
+        mask = np.ones(hi - lo, dtype=bool)
+        if not facet_groups:
+            return mask
+
+        facet_offsets = self.arrays[_key(kind, chrom, "facet_offsets")][lo : hi + 1]
+        facets = self.arrays[_key(kind, chrom, "facets")][facet_offsets[0] : facet_offsets[-1]]
+        owners = np.repeat(np.arange(hi - lo), np.diff(facet_offsets))
+        for group in facet_groups:
+            in_group = np.isin(facets, np.fromiter(group, dtype=np.int64))
+            mask &= np.bincount(owners[in_group], minlength=hi - lo) > 0
+        return mask
+
+    @staticmethod
+    def _bucket_max(values, bounds):
+        maxes = np.full(len(bounds) - 1, -np.inf)
+        non_empty = bounds[1:] > bounds[:-1]
+        if len(values) > 0 and non_empty.any():
+            maxes[non_empty] = np.maximum.reduceat(values, bounds[:-1][non_empty])
+        return maxes
@@ -0,0 +1,68 @@
+import hashlib
+import json
+from typing import Any, Optional
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+class CoverageCache:
+    """
+    Caches filtered, JSON-serialized coverage data. Entries are keyed by analysis, zoomed chromosome,
+    coverage type, and the filter values, so identical requests (e.g., returning a facet slider to a previous
+    position) don't have to re-filter the coverage data.
+
+    Each analysis has a "generation" that is part of every key. Regenerating the analysis's coverage files
+    replaces the generation, which makes all the previously cached entries unreachable. They are left to
+    expire or be evicted.
+    """
+
+    @classmethod
+    def canonical_filters(cls, filters: list[Any]) -> list[Any]:
+        # Categorical facet order doesn't matter and numeric interval values may come in as ints or floats,
+        # so normalize both to make sure equivalent filters share a cache entry.
+        canonical = [sorted(int(f) for f in filters[0])]
+        if len(filters) > 1:
+            canonical.append([[float(value) for value in interval] for interval in filters[1]])
+        return canonical
+
+    @classmethod
+    def filter_hash(cls, filters: list[Any]) -> str:
+        filter_json = json.dumps(cls.canonical_filters(filters), separators=(",", ":"))
+        return hashlib.sha256(filter_json.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def _generation_key(cls, analysis_accession_id: str) -> str:
+        return f"coverage_generation:{analysis_accession_id}"
+
+    @classmethod
+    def _generation(cls, analysis_accession_id: str) -> str:
+        generation_key = cls._generation_key(analysis_accession_id)
+        generation = cache.get(generation_key)
+        if generation is None:
+            # Never expire the generation; if it were evicted then entries from an old generation could
+            # be used again.
+            cache.add(generation_key, uuid4().hex, timeout=None)
+            generation = cache.get(generation_key)
+        return generation
+
+    @classmethod
+    def key(
+        cls, analysis_accession_id: str, zoom_chr: Optional[str], coverage_type: Optional[str], filters: list[Any]
+    ) -> str:
+        generation = cls._generation(analysis_accession_id)
+        return f"coverage:{analysis_accession_id}:{generation}:{zoom_chr}:{coverage_type}:{cls.filter_hash(filters)}"
+
+    @classmethod
+    def get(cls, key: str) -> Optional[str]:
+        return cache.get(key)
+
+    @classmethod
+    def set(cls, key: str, coverage_json: str):
+        # Entries must have a timeout so that redis' volatile-lru eviction policy can remove them.
+        cache.set(key, coverage_json, timeout=settings.COVERAGE_CACHE_TIMEOUT)
+
+    @classmethod
+    def invalidate(cls, analysis_accession_id: str):
+        cache.set(cls._generation_key(analysis_accession_id), uuid4().hex, timeout=None)
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+from django.db import connection
+
+from cegs_portal.get_expr_data.view_models import _range_filter
+from cegs_portal.search.view_models.v1.coverage_pyramid import CoveragePyramid
+
+
+def object_array(values):
+    array = np.empty(len(values), dtype=object)
+    array[:] = values
+    return array
+
+
+@pytest.fixture
+def pyramid(tmp_path):
+    pyramid = CoveragePyramid.build(
+        {
+            "source": {
+                "chr1": {
+                    "pos": np.array([30_000, 10, 6_000, 2_100_000]),
+                    "effect": np.array([1.0, -2.0, np.nan, 0.5]),
+                    "sig": np.array([1.0, 3.0, 2.0, np.nan]),
+                    "facets": object_array([[1], [2], [1, 3], []]),
+                }
+            },
+            "target": {
+                "chr1": {
+                    "pos": np.array([40_000]),
+                    "effect": np.array([1.0]),
+                    "sig": np.array([1.0]),
+                    "facets": object_array([[1]]),
+                }
+            },
+        }
+    )
+    filename = tmp_path / "coverage_pyramid.npz"
+    pyramid.save(filename)
+    return CoveragePyramid.load(filename)
+
+
+def test_resolution_for(pyramid):
+    assert pyramid.resolution_for(0, 50_000, 10) == 5_000
+    assert pyramid.resolution_for(0, 50_000, 5) == 20_000
+    assert pyramid.resolution_for(0, 100_000_000, 10) == 2_000_000
+
+
+def test_window(pyramid):
+    window = pyramid.window("chr1", 0, 50_000, 10)
+
+    assert window["bucket_size"] == 5_000
+    assert len(window["buckets"]) == 10
+    assert [b["source_count"] for b in window["buckets"]] == [1, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+    assert [b["target_count"] for b in window["buckets"]] == [0, 0, 0, 0, 0, 0, 0, 0, 1, 0]
+    assert window["buckets"][0]["source_max_log_significance"] == 3.0
+    assert window["buckets"][0]["source_max_abs_effect_size"] == 2.0
+    assert window["buckets"][1]["source_max_abs_effect_size"] is None
+    assert window["buckets"][2]["source_max_log_significance"] is None
+
+
+def test_window_filters(pyramid):
+    window = pyramid.window("chr1", 0, 50_000, 10, facet_groups=[{1}])
+    assert [b["source_count"] for b in window["buckets"]] == [0, 1, 0, 0, 0, 0, 1, 0, 0, 0]
+
+    window = pyramid.window("chr1", 0, 50_000, 10, facet_groups=[{1}, {3}])
+    assert [b["source_count"] for b in window["buckets"]] == [0, 1, 0, 0, 0, 0, 0, 0, 0, 0]
+
+    window = pyramid.window("chr1", 0, 4_000_000, 3, effect_interval=(-1, 1))
+    assert window["bucket_size"] == 2_000_000
+    assert [b["source_count"] for b in window["buckets"]] == [0, 1]
+
+    window = pyramid.window("chr1", 0, 4_000_000, 3, effect_interval=(-2, None))
+    assert [b["source_count"] for b in window["buckets"]] == [2, 1]
+
+    window = pyramid.window("chr1", 0, 50_000, 10, sig_interval=(2.5, 5))
+    assert [b["source_count"] for b in window["buckets"]] == [1, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+
+
+def test_window_past_data(pyramid):
+    window = pyramid.window("chr1", 10_000_000, 10_050_000, 10)
+    assert [b["source_count"] for b in window["buckets"]] == [0] * 10
+
+    window = pyramid.window("chr2", 0, 50_000, 10)
+    assert [b["source_count"] for b in window["buckets"]] == [0] * 10
+
+
+INTERVAL_VALUES = [-2.0, -1.0, -0.5, 0.0, 0.5, 1.0, 2.0, None]
+
+
+@pytest.mark.parametrize(
+    "interval",
+    [
+        (None, None),
+        (-1.0, 1.0),
+        (-1.0, None),
+        (None, 1.0),
+        (0.5, 0.5),
+        (0.5, 2.0),
+        (-3.0, 3.0),
+    ],
+)
+@pytest.mark.django_db
+def test_window_matches_export_range_filter(tmp_path, interval):
+    effects = np.array([np.nan if value is None else value for value in INTERVAL_VALUES])
+    pyramid = CoveragePyramid.build(
+        {
+            "source": {
+                "chr1": {
+                    "pos": np.full(len(effects), 10),
+                    "effect": effects,
+                    "sig": effects,
+                    "facets": object_array([[] for _ in effects]),
+                }
+            },
+            "target": {},
+        }
+    )
+    filename = tmp_path / "coverage_pyramid.npz"
+    pyramid.save(filename)
+    pyramid = CoveragePyramid.load(filename)
+
+    where, params = _range_filter("effect_size", interval)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""SELECT count(*) FROM unnest(%s::float8[]) AS get_expr_data_reo_sources_targets(effect_size)
+            WHERE true{where}""",
+            [INTERVAL_VALUES] + params,
+        )
+        (export_count,) = cursor.fetchone()
+
+    effect_window = pyramid.window("chr1", 0, 50_000, 10, effect_interval=interval)
+    sig_window = pyramid.window("chr1", 0, 50_000, 10, sig_interval=interval)
+    assert effect_window["buckets"][0]["source_count"] == export_count
+    assert sig_window["buckets"][0]["source_count"] == export_count
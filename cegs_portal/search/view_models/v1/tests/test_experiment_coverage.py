@@ -0,0 +1,46 @@
+import pytest
+from django.core.cache import cache
+
+from cegs_portal.search.view_models.v1.experiment_coverage import CoverageCache
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
+def test_equivalent_filters_same_hash():
+    assert CoverageCache.filter_hash([[2, 1], [[-5, 5], [0, 1]]]) == CoverageCache.filter_hash(
+        [[1, 2], [[-5.0, 5.0], [0.0, 1.0]]]
+    )
+    assert CoverageCache.filter_hash([[1]]) != CoverageCache.filter_hash([[2]])
+    assert CoverageCache.filter_hash([[], [[-5, 5], [0, 1]]]) != CoverageCache.filter_hash([[], [[-5, 5], [0, 2]]])
+
+
+def test_key_includes_request_options():
+    filters = [[], [[-5, 5], [0, 1]]]
+    key = CoverageCache.key("DCPAN00000000", None, None, filters)
+
+    assert key == CoverageCache.key("DCPAN00000000", None, None, filters)
+    assert key != CoverageCache.key("DCPAN00000001", None, None, filters)
+    assert key != CoverageCache.key("DCPAN00000000", "1", None, filters)
+    assert key != CoverageCache.key("DCPAN00000000", None, "count", filters)
+
+
+def test_invalidate():
+    filters = [[], [[-5, 5], [0, 1]]]
+    key = CoverageCache.key("DCPAN00000000", None, None, filters)
+    other_key = CoverageCache.key("DCPAN00000001", None, None, filters)
+    CoverageCache.set(key, "{}")
+    CoverageCache.set(other_key, "{}")
+
+    assert CoverageCache.get(key) == "{}"
+
+    CoverageCache.invalidate("DCPAN00000000")
+
+    new_key = CoverageCache.key("DCPAN00000000", None, None, filters)
+    assert new_key != key
+    assert CoverageCache.get(new_key) is None
+    assert CoverageCache.get(CoverageCache.key("DCPAN00000001", None, None, filters)) == "{}"
@@ -1,7 +1,11 @@
 from .dna_features import DNAFeatureClosestFeatures, DNAFeatureId, DNAFeatureLoc
 from .experiment import ExperimentListView, ExperimentsView, ExperimentView
 from .experiment_collection import ExperimentCollectionView
-from .experiment_coverage import CombinedExperimentView, ExperimentCoverageView
+from .experiment_coverage import (
+    CombinedExperimentView,
+    CoverageWindowView,
+    ExperimentCoverageView,
+)
 from .facets import facets
 from .non_targeting_reos import NonTargetRegEffectsView
 from .reg_effects import (
@@ -1,8 +1,10 @@
 import json
+import re
 from concurrent.futures import ALL_COMPLETED, ThreadPoolExecutor, wait
-from functools import lru_cache
+from functools import cache, partial
 from os.path import join
 
+from django.conf import settings
 from django.contrib.staticfiles import finders
 from django.http import HttpResponse
 from exp_viz import (
@@ -10,6 +12,7 @@ from exp_viz import (
     Filter,
     FilterIntervals,
     SetOpFeature,
+    calc_feature_set_allow_threads,
     filter_coverage_data_allow_threads,
     load_coverage_data_allow_threads,
     load_feature_data_allow_threads,
@@ -19,10 +22,18 @@ from exp_viz import (
 from cegs_portal.search.json_templates.v1.combined_experiments import (
     combined_experiments,
 )
+from cegs_portal.search.json_templates.v1.coverage_window import coverage_window
 from cegs_portal.search.json_templates.v1.experiment_coverage import experiment_coverage
+from cegs_portal.search.models import Analysis, FacetValue
 from cegs_portal.search.models.validators import validate_accession_id
+from cegs_portal.search.view_models.v1 import CoverageCache
+from cegs_portal.search.view_models.v1.coverage_pyramid import (
+    PYRAMID_FILENAME,
+    CoveragePyramid,
+)
 from cegs_portal.search.views.custom_views import MultiResponseFormatView
 from cegs_portal.search.views.view_utils import JSON_MIME
+from cegs_portal.utils.file_cache import FileCache
 from cegs_portal.utils.http_exceptions import Http400
 
 CHROM_NAMES = [
@@ -55,6 +66,12 @@ CHROM_NAMES = [
 
 SET_OPS = ["i", "u"]
 
+# The genome data files used by the visualizations, by genome assembly
+GENOME_DATA_FILES = {"hg19": "grch37.json", "grch37": "grch37.json", "hg38": "grch38.json", "grch38": "grch38.json"}
+
+# Shared by coverage (.ecd) and feature (.fd) data
+coverage_file_cache = FileCache(max_bytes=settings.COVERAGE_FILE_CACHE_MAX_BYTES)
+
 
 def coverage_path(acc_id, chrom):
     exp_acc_id, analysis_acc_id = acc_id.split("/")
@@ -64,13 +81,14 @@ def coverage_path(acc_id, chrom):
         return join("search", "experiments", exp_acc_id, analysis_acc_id, f"level2_{chrom}.ecd")
 
 
-@lru_cache(maxsize=100)
 def load_coverage(acc_id, chrom):
     coverage_file = coverage_path(acc_id, chrom)
     filename = finders.find(coverage_file)
     if filename is None:
         raise Http400(f"Coverage file {coverage_file} not found")
-    return load_coverage_data_allow_threads(filename)
+    return coverage_file_cache.get(
+        filename, partial(load_coverage_data_allow_threads, mapped=settings.COVERAGE_MAP_FILES)
+    )
 
 
 def features_path(acc_id, chrom):
@@ -87,29 +105,51 @@ def load_features(acc_id, chrom):
     if filename is None:
         raise Http400(f"Feature file {feature_file} not found")
 
-    return acc_id, load_feature_data_allow_threads(filename)
+    return acc_id, coverage_file_cache.get(
+        filename, partial(load_feature_data_allow_threads, mapped=settings.COVERAGE_MAP_FILES)
+    )
+
+
+def pyramid_path(acc_id):
+    exp_acc_id, analysis_acc_id = acc_id.split("/")
+    return join("search", "experiments", exp_acc_id, analysis_acc_id, PYRAMID_FILENAME)
+
+
+def load_pyramid(acc_id):
+    pyramid_file = pyramid_path(acc_id)
+    filename = finders.find(pyramid_file)
+    if filename is None:
+        raise Http400(f"Coverage pyramid {pyramid_file} not found")
+    return coverage_file_cache.get(filename, CoveragePyramid.load)
+
+
+@cache
+def chromosome_sizes(genome_assembly):
+    """Chromosome sizes from the genome assembly's genome data file, keyed by chromosome name (e.g., "chr1")"""
+    filename = finders.find(join("genome_data", GENOME_DATA_FILES[genome_assembly.lower()]))
+    with open(filename) as genome_file:
+        return {
+            "chrM" if chrom["chrom"] == "MT" else f"chr{chrom['chrom']}": chrom["size"]
+            for chrom in json.load(genome_file)
+        }
+
+
+def chromosome_size(acc_id, chrom):
+    """The size of a chromosome in the analysis's genome assembly, or None if it isn't known"""
+    _, analysis_acc_id = acc_id.split("/")
+    genome_assembly = (
+        Analysis.objects.filter(accession_id=analysis_acc_id).values_list("genome_assembly", flat=True).first()
+    )
+    if genome_assembly is None or genome_assembly.lower() not in GENOME_DATA_FILES:
+        return None
+    return chromosome_sizes(genome_assembly).get(chrom)
 
 
 def calc_set(combinations, features):
-    stack = []
     try:
-        for item in combinations:
-            if item == "i":
-                x, y = stack[-2:]
-                x.intersection(y)  # mutates x
-                stack.pop()  # drops y
-            elif item == "u":
-                x, y = stack[-2:]
-                x.union(y)  # mutates x
-                stack.pop()  # drops y
-            else:
-                stack.append(features[item])
-    except IndexError:
-        raise Http400(f"Invalid set operations: [{', '.join(combinations)}]")
-
-    if len(stack) != 1:
-        raise Http400(f"Invalid set operations: [{', '.join(combinations)}]")
-    return stack[0]
+        return calc_feature_set_allow_threads(combinations, features)
+    except ValueError as e:
+        raise Http400(f"Invalid set operations: [{', '.join(combinations)}]") from e
 
 
 def get_analyses(combinations):
@@ -224,13 +264,22 @@ class ExperimentCoverageView(MultiResponseFormatView):
         )
 
     def post_json(self, _request, options, data, *args, **kwargs):
-        return HttpResponse(data.to_json(), content_type=JSON_MIME)
+        return HttpResponse(data, content_type=JSON_MIME)
 
     def post_data(self, options):
+        _, analysis_acc_id = options["exp_acc_id"].split("/")
+        cache_key = CoverageCache.key(
+            analysis_acc_id, options["zoom_chr"], options["coverage_type"], options["filters"]
+        )
+        if (coverage_json := CoverageCache.get(cache_key)) is not None:
+            return coverage_json
+
         data_filter = get_filter(options["filters"], options["zoom_chr"], options["coverage_type"])
         loaded_data = load_coverage(options["exp_acc_id"], options["zoom_chr"])
         filtered_data = filter_coverage_data_allow_threads(data_filter, loaded_data, None)
-        return filtered_data
+        coverage_json = filtered_data.to_json()
+        CoverageCache.set(cache_key, coverage_json)
+        return coverage_json
 
 
 class CombinedExperimentView(MultiResponseFormatView):
@@ -320,3 +369,93 @@ class CombinedExperimentView(MultiResponseFormatView):
             filtered_data = wait(filter_to_acc_id, return_when=ALL_COMPLETED)
 
         return merge_filtered_data([d.result() for d in filtered_data.done], options["chromosomes"])
+
+
+class CoverageWindowView(MultiResponseFormatView):
+    json_renderer = coverage_window
+    max_width = 10_000
+
+    def request_options(self, request):
+        """
+        GET queries used:
+            exp
+                * Experiment Accession ID
+            region
+                * The window to return, in the form chrom:start-end
+            width
+                * The width of the window in pixels. Used to pick the bucket size.
+        POST body:
+            filters:
+                * object - the filter values
+        """
+        options = super().request_options(request)
+        options["exp_acc_id"] = request.GET.get("exp", None)
+
+        if options["exp_acc_id"] is None:
+            raise Http400("Must query an experiment")
+        if not validate_accession_string(options["exp_acc_id"]):
+            raise Http400(f"Invalid experiment id {options['exp_acc_id']}")
+
+        region = request.GET.get("region", "")
+        if (match := re.match(r"^(chr\w+):(\d+)-(\d+)$", region)) is None:
+            raise Http400(f"Invalid region {region}")
+        options["chrom"], options["start"], options["end"] = match[1], int(match[2]), int(match[3])
+        if options["start"] >= options["end"]:
+            raise Http400(f"The start of the region must be before the end: {region}")
+
+        # The number of buckets, and so the size of the response, grows with the size of the region
+        if (chrom_size := chromosome_size(options["exp_acc_id"], options["chrom"])) is not None:
+            if options["start"] >= chrom_size:
+                raise Http400(f"The region starts past the end of {options['chrom']} ({chrom_size}): {region}")
+            options["end"] = min(options["end"], chrom_size)
+        if options["end"] - options["start"] > settings.COVERAGE_WINDOW_MAX_SPAN:
+            raise Http400(f"The region can't be more than {settings.COVERAGE_WINDOW_MAX_SPAN} bases: {region}")
+
+        try:
+            options["width"] = int(request.GET.get("width", 1000))
+        except ValueError as e:
+            raise Http400(f"Invalid width {request.GET.get('width')}") from e
+        if not 0 < options["width"] <= self.max_width:
+            raise Http400(f"Width must be between 1 and {self.max_width}")
+
+        try:
+            body = json.loads(request.body)
+        except Exception as e:
+            raise Http400(f"Invalid request body:\n{request.body}") from e
+
+        try:
+            options["filters"] = body["filters"]
+        except Exception as e:
+            raise Http400(f'Invalid request body, no "filters" object:\n{request.body}') from e
+
+        return options
+
+    def post(self, request, options, data):
+        raise Http400(
+            (
+                f'This is a JSON-only API. Please request using "Accept: {JSON_MIME}" header or '
+                f'pass "{JSON_MIME}" as the "accept" GET parameter.'
+            )
+        )
+
+    def post_data(self, options):
+        filters = options["filters"]
+
+        facet_groups = {}
+        for facet_id, value_id in FacetValue.objects.filter(id__in=[int(f) for f in filters[0]]).values_list(
+            "facet_id", "id"
+        ):
+            facet_groups.setdefault(facet_id, set()).add(value_id)
+
+        effect_interval, sig_interval = filters[1] if len(filters) > 1 else (None, None)
+
+        pyramid = load_pyramid(options["exp_acc_id"])
+        return pyramid.window(
+            options["chrom"],
+            options["start"],
+            options["end"],
+            options["width"],
+            facet_groups=list(facet_groups.values()),
+            effect_interval=effect_interval,
+            sig_interval=sig_interval,
+        )
@@ -1,4 +1,6 @@
+import numpy as np
 import pytest
+from django.core.cache import cache
 from django.core.exceptions import BadRequest
 from django.test import Client
 from pytest import MonkeyPatch
@@ -6,10 +8,19 @@ from pytest import MonkeyPatch
 import cegs_portal.search.views.v1.experiment_coverage as exp_cov
 from cegs_portal.conftest import RequestBuilder
 from cegs_portal.search.models import Experiment
+from cegs_portal.search.view_models.v1.coverage_pyramid import CoveragePyramid
+from cegs_portal.utils.file_cache import FileCache
 
 pytestmark = pytest.mark.django_db
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+    yield
+    cache.clear()
+
+
 @pytest.fixture
 def view():
     return exp_cov.ExperimentCoverageView.as_view()
@@ -73,6 +84,49 @@ def test_coverage_filter_nothing_json(
     assert response.status_code == 200
 
 
+def test_coverage_cached_json(
+    public_test_client: RequestBuilder, experiment: Experiment, view, monkeypatch: MonkeyPatch
+):
+    monkeypatch.setattr(exp_cov, "coverage_path", mock_coverage_path)
+    url = f"/search/experiment_coverage?exp={experiment.accession_id}/{experiment.default_analysis.accession_id}&accept=application/json"
+    response = public_test_client.post(url, {"filters": filter_nothing()}, content_type="application/json").request(
+        view
+    )
+    assert response.status_code == 200
+
+    def fail_load_coverage(acc_id, chrom):
+        raise AssertionError("Coverage should have been cached")
+
+    monkeypatch.setattr(exp_cov, "load_coverage", fail_load_coverage)
+    cached_response = public_test_client.post(
+        url, {"filters": filter_nothing()}, content_type="application/json"
+    ).request(view)
+
+    assert cached_response.status_code == 200
+    assert cached_response.json() == response.json()
+
+
+@pytest.mark.parametrize("zoom", [None, "1"])
+def test_coverage_mapped_files_json(
+    public_test_client: RequestBuilder, experiment: Experiment, view, monkeypatch: MonkeyPatch, settings, zoom
+):
+    monkeypatch.setattr(exp_cov, "coverage_path", mock_coverage_path)
+    url = f"/search/experiment_coverage?exp={experiment.accession_id}/{experiment.default_analysis.accession_id}&accept=application/json"
+    body = {"filters": filter_nothing()} if zoom is None else {"filters": filter_nothing(), "zoom": zoom}
+
+    responses = []
+    for mapped in [False, True]:
+        settings.COVERAGE_MAP_FILES = mapped
+        cache.clear()
+        monkeypatch.setattr(exp_cov, "coverage_file_cache", FileCache(max_bytes=settings.COVERAGE_FILE_CACHE_MAX_BYTES))
+        response = public_test_client.post(url, body, content_type="application/json").request(view)
+        assert response.status_code == 200
+        responses.append(response.json())
+
+    read_data, mapped_data = responses
+    assert mapped_data == read_data
+
+
 def test_coverage_filter_nothing_zoom_json(
     public_test_client: RequestBuilder, experiment: Experiment, view, monkeypatch: MonkeyPatch
 ):
@@ -163,3 +217,86 @@ def test_coverage_html(public_test_client: RequestBuilder, experiment: Experimen
             {"filters": filter_nothing(), "chromosomes": ["chr1"]},
             content_type="application/json",
         ).request(view)
+
+
+def test_coverage_window_json(public_test_client: RequestBuilder, experiment: Experiment, monkeypatch: MonkeyPatch):
+    facets = np.empty(2, dtype=object)
+    facets[:] = [[], []]
+    pyramid = CoveragePyramid.build(
+        {
+            "source": {
+                "chr1": {
+                    "pos": np.array([10, 6_000]),
+                    "effect": np.array([1.0, -2.0]),
+                    "sig": np.array([1.0, 3.0]),
+                    "facets": facets,
+                }
+            }
+        }
+    )
+    monkeypatch.setattr(exp_cov, "load_pyramid", lambda acc_id: pyramid)
+    view = exp_cov.CoverageWindowView.as_view()
+    exp_acc_id = f"{experiment.accession_id}/{experiment.default_analysis.accession_id}"
+
+    response = public_test_client.post(
+        f"/search/experiment_coverage_window?exp={exp_acc_id}&region=chr1:0-10000&width=2&accept=application/json",
+        {"filters": filter_nothing()},
+        content_type="application/json",
+    ).request(view)
+
+    assert response.status_code == 200
+    window = response.json()
+    assert window["bucket_size"] == 5_000
+    assert [b["source_count"] for b in window["buckets"]] == [1, 0]
+
+    with pytest.raises(BadRequest):
+        public_test_client.post(
+            f"/search/experiment_coverage_window?exp={exp_acc_id}&region=chr1:100-10&accept=application/json",
+            {"filters": filter_nothing()},
+            content_type="application/json",
+        ).request(view)
+
+
+def test_coverage_window_region_limits(
+    public_test_client: RequestBuilder, experiment: Experiment, monkeypatch: MonkeyPatch, settings
+):
+    facets = np.empty(1, dtype=object)
+    facets[:] = [[]]
+    pyramid = CoveragePyramid.build(
+        {
+            "source": {
+                "chr1": {
+                    "pos": np.array([248_950_000]),
+                    "effect": np.array([1.0]),
+                    "sig": np.array([1.0]),
+                    "facets": facets,
+                }
+            }
+        }
+    )
+    monkeypatch.setattr(exp_cov, "load_pyramid", lambda acc_id: pyramid)
+    view = exp_cov.CoverageWindowView.as_view()
+    exp_acc_id = f"{experiment.accession_id}/{experiment.default_analysis.accession_id}"
+
+    def request(region):
+        return public_test_client.post(
+            f"/search/experiment_coverage_window?exp={exp_acc_id}&region={region}&width=10&accept=application/json",
+            {"filters": filter_nothing()},
+            content_type="application/json",
+        ).request(view)
+
+    # The region is clamped to the end of chr1 (hg38)
+    response = request("chr1:248900000-999999999")
+    assert response.status_code == 200
+    window = response.json()
+    assert window["end"] == 248_956_422
+    assert window["buckets"][-1]["start"] < 248_956_422
+    assert sum(b["source_count"] for b in window["buckets"]) == 1
+
+    with pytest.raises(BadRequest):
+        request("chr1:248956422-248956500")
+
+    settings.COVERAGE_WINDOW_MAX_SPAN = 1_000_000
+    assert request("chr1:0-1000000").status_code == 200
+    with pytest.raises(BadRequest):
+        request("chr1:0-1000001")
@@ -1,8 +1,21 @@
 from typing import Any, Iterable, Optional, TypedDict, Union, cast
 
-from cegs_portal.task_status.models import TaskStatus
+from cegs_portal.task_status.models import TaskStage, TaskStatus
 from cegs_portal.utils.pagination_types import Pageable, PageableJson
 
+TaskStageJson = TypedDict(
+    "TaskStageJson",
+    {
+        "name": str,
+        "status": str,
+        "error_message": Optional[str],
+        "row_count": Optional[int],
+        "started": Optional[str],
+        "finished": Optional[str],
+        "modified": str,
+    },
+)
+
 TaskJson = TypedDict(
     "TaskJson",
     {
@@ -12,6 +25,7 @@ TaskJson = TypedDict(
         "error_message": Optional[str],
         "created": str,
         "modified": str,
+        "stages": list[TaskStageJson],
     },
 )
 
@@ -41,5 +55,19 @@ def task_status(task_obj: TaskStatus, options: Optional[dict[str, Any]] = None)
         "error_message": task_obj.error_message,
         "created": task_obj.created.isoformat(),
         "modified": task_obj.modified.isoformat(),
+        "stages": [task_stage(stage) for stage in task_obj.stages.all()],
     }
     return cast(TaskJson, result)
+
+
+def task_stage(stage_obj: TaskStage) -> TaskStageJson:
+    result = {
+        "name": stage_obj.name,
+        "status": stage_obj.status,
+        "error_message": stage_obj.error_message,
+        "row_count": stage_obj.row_count,
+        "started": stage_obj.started.isoformat() if stage_obj.started is not None else None,
+        "finished": stage_obj.finished.isoformat() if stage_obj.finished is not None else None,
+        "modified": stage_obj.modified.isoformat(),
+    }
+    return cast(TaskStageJson, result)
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("task_status", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskStage",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=256)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("W", "Waiting to Begin"), ("S", "Started"), ("F", "Finished"), ("E", "Error")],
+                        default="W",
+                        max_length=1,
+                    ),
+                ),
+                ("created", models.DateTimeField(auto_now_add=True)),
+                ("modified", models.DateTimeField(auto_now=True)),
+                (
+                    "task",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="stages", to="task_status.taskstatus"
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["created"],
+                "constraints": [models.UniqueConstraint(fields=("task", "name"), name="unique_task_stage_name")],
+            },
+        ),
+    ]
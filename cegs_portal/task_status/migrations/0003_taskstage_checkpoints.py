@@ -0,0 +1,38 @@
+# Generated by Django 5.1.4 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("task_status", "0002_taskstage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="taskstage",
+            name="checkpoint",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="taskstage",
+            name="error_message",
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="taskstage",
+            name="finished",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="taskstage",
+            name="row_count",
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="taskstage",
+            name="started",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -1,7 +1,10 @@
 import uuid
+from datetime import timedelta
+from typing import Optional
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 
 class TaskStatus(models.Model):
@@ -21,6 +24,7 @@ class TaskStatus(models.Model):
 
     def start(self):
         self.status = self.TaskState.STARTED
+        self.error_message = None
         self.save()
 
     def finish(self):
@@ -33,5 +37,80 @@ class TaskStatus(models.Model):
         self.error_message = error_message
         self.save()
 
+    def stage(self, name: str, checkpoint: Optional[dict] = None) -> "TaskStage":
+        stage, _ = TaskStage.objects.get_or_create(task=self, name=name, defaults={"checkpoint": checkpoint})
+        return stage
+
+    def stages_finished(self) -> bool:
+        return not self.stages.exclude(status=TaskStatus.TaskState.FINISHED).exists()
+
     def __str__(self):
         return f"{self.description} Status: {self.get_status_display()} Created: {self.created} Modified: {self.modified} ({self.id})"
+
+
+class TaskStage(models.Model):
+    """
+    The progress of one stage of a task, e.g., loading one analysis of an upload.
+
+    Stages can be used as context managers, which start the stage and then finish it, or record the error
+    if one is raised. A stage's checkpoint holds whatever is needed to run the stage again on its own, so
+    a task that failed part way through can be resumed from its unfinished stages.
+    """
+
+    class Meta:
+        ordering = ["created"]
+        constraints = [models.UniqueConstraint(fields=["task", "name"], name="unique_task_stage_name")]
+
+    task = models.ForeignKey(TaskStatus, on_delete=models.CASCADE, related_name="stages")
+    name = models.CharField(max_length=256)
+    status = models.CharField(max_length=1, choices=TaskStatus.TaskState.choices, default=TaskStatus.TaskState.WAITING)
+    error_message = models.TextField(null=True, blank=True)
+    row_count = models.BigIntegerField(null=True, blank=True)
+    checkpoint = models.JSONField(null=True, blank=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True, editable=False)
+    modified = models.DateTimeField(auto_now=True, editable=False)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.status == TaskStatus.TaskState.FINISHED
+
+    @property
+    def duration(self) -> Optional[timedelta]:
+        if self.started is None or self.finished is None:
+            return None
+        return self.finished - self.started
+
+    def start(self):
+        self.status = TaskStatus.TaskState.STARTED
+        self.error_message = None
+        self.started = timezone.now()
+        self.finished = None
+        self.save()
+
+    def finish(self, row_count: Optional[int] = None):
+        self.status = TaskStatus.TaskState.FINISHED
+        if row_count is not None:
+            self.row_count = row_count
+        self.finished = timezone.now()
+        self.save()
+
+    def error(self, error_message: Optional[str] = None):
+        self.status = TaskStatus.TaskState.ERROR
+        self.error_message = error_message
+        self.finished = timezone.now()
+        self.save()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.error(str(exc_value))
+
+    def __str__(self):
+        return f"{self.name} Status: {self.get_status_display()} ({self.task_id})"
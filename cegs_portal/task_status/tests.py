@@ -44,6 +44,56 @@ def test_task_status_handle_error(task: TaskStatus):
     assert task.error_message == "Bad Value"
 
 
+def test_task_stage(task: TaskStatus):
+    with task.stage("Load experiment"):
+        assert task.stage("Load experiment").status == TaskStatus.TaskState.STARTED
+    assert task.stage("Load experiment").status == TaskStatus.TaskState.FINISHED
+
+    with pytest.raises(ValueError):
+        with task.stage("Load analysis"):
+            raise ValueError("Bad Value")
+    assert task.stage("Load analysis").status == TaskStatus.TaskState.ERROR
+
+    assert [stage.name for stage in task.stages.all()] == ["Load experiment", "Load analysis"]
+    assert task_status(task)["stages"] == [
+        {
+            "name": stage.name,
+            "status": stage.status,
+            "error_message": stage.error_message,
+            "row_count": stage.row_count,
+            "started": stage.started.isoformat(),
+            "finished": stage.finished.isoformat(),
+            "modified": stage.modified.isoformat(),
+        }
+        for stage in task.stages.all()
+    ]
+
+
+def test_task_stage_progress(task: TaskStatus):
+    with task.stage("Load analysis", checkpoint={"analysis_accession": "DCPAN0000000000"}) as stage:
+        stage.row_count = 100
+
+    stage = task.stage("Load analysis")
+    assert stage.row_count == 100
+    assert stage.checkpoint == {"analysis_accession": "DCPAN0000000000"}
+    assert stage.duration == stage.finished - stage.started
+    assert task.stages_finished()
+
+    with pytest.raises(ValueError):
+        with task.stage("Generate coverage"):
+            raise ValueError("Bad Value")
+
+    stage = task.stage("Generate coverage")
+    assert stage.error_message == "Bad Value"
+    assert not task.stages_finished()
+
+    # Running a stage again clears the previous error
+    with stage:
+        pass
+    assert task.stage("Generate coverage").error_message is None
+    assert task.stages_finished()
+
+
 def test_task_status_list_json(task: TaskStatus):
     assert task_statuses([task]) == [
         {
@@ -53,6 +103,7 @@ def test_task_status_list_json(task: TaskStatus):
             "error_message": None,
             "created": task.created.isoformat(),
             "modified": task.modified.isoformat(),
+            "stages": [],
         }
     ]
 
@@ -65,6 +116,7 @@ def test_task_status_json(task: TaskStatus):
         "error_message": None,
         "created": task.created.isoformat(),
         "modified": task.modified.isoformat(),
+        "stages": [],
     }
 
 
@@ -85,6 +137,7 @@ def test_task_list_view(task: TaskStatus, login_client: SearchClient):
                 "error_message": None,
                 "created": task.created.isoformat(),
                 "modified": task.modified.isoformat(),
+                "stages": [],
             }
         ],
         "page": 1,
@@ -109,6 +162,7 @@ def test_task_view(task: TaskStatus, login_client: SearchClient):
         "error_message": None,
         "created": task.created.isoformat(),
         "modified": task.modified.isoformat(),
+        "stages": [],
     }
 
 
@@ -1,16 +1,51 @@
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor, wait
 
+from django.conf import settings
 from django.contrib.staticfiles import finders
+from django.db import connection
 
 from cegs_portal.search.models import Analysis
+from cegs_portal.search.view_models.v1 import CoverageCache
+from cegs_portal.search.view_models.v1.coverage_pyramid import PYRAMID_FILENAME
 
+from .coverage_pyramid import gen_coverage_pyramid
 from .experiment_coverage import gen_coverage, gen_coverage_manifest
+from .observations import AnalysisObservations
 from .qq_plot import gen_qq_plot
 from .volcano_plot import gen_volcano_plot
 
 logger = logging.getLogger(__name__)
 
+CHROM_NAMES = [
+    "1",
+    "2",
+    "3",
+    "4",
+    "5",
+    "6",
+    "7",
+    "8",
+    "9",
+    "10",
+    "11",
+    "12",
+    "13",
+    "14",
+    "15",
+    "16",
+    "17",
+    "18",
+    "19",
+    "20",
+    "21",
+    "22",
+    "X",
+    "Y",
+    "MT",
+]
+
 
 def get_analysis_dir(analysis):
     experiment = analysis.experiment_id
@@ -33,63 +68,74 @@ def create_analysis_dir(analysis):
 def delete_coverage_files(analysis_dir):
     analysis_dir_fd = os.open(analysis_dir, os.O_RDONLY)
     for file in os.listdir(analysis_dir):
-        if file.endswith((".fd", ".ecd", "coverage_manifest.json")):
+        if file.endswith((".fd", ".ecd", "coverage_manifest.json", PYRAMID_FILENAME)):
             os.remove(file, dir_fd=analysis_dir_fd)
     os.close(analysis_dir_fd)
 
 
+def gen_genome_coverage(analysis, analysis_dir):
+    # The manifest is generated from the genome-wide coverage file
+    gen_coverage(analysis, analysis_dir=analysis_dir)
+    try:
+        gen_coverage_manifest(analysis, analysis_dir=analysis_dir)
+    finally:
+        # This runs in a worker thread, which gets its own database connection
+        connection.close()
+
+
 def gen_all_coverage(analysis_accession):
     analysis = Analysis.objects.get(accession_id=analysis_accession)
 
     analysis_dir = create_analysis_dir(analysis)
 
     try:
-        logger.info(f"{analysis_accession}: Generating volcano plot")
-        gen_volcano_plot(analysis, analysis_dir=analysis_dir)
-    except:
-        logger.error(f"Volcano plot generation failed: {analysis.accession_id}")
-        raise
-
-    try:
-        logger.info(f"{analysis_accession}: Generating QQ plot")
-        gen_qq_plot(analysis, analysis_dir=analysis_dir)
-    except:
-        logger.error(f"QQ plot generation failed: {analysis.accession_id}")
-        raise
-
-    try:
-        logger.info(f"{analysis_accession}: Generating coverage")
-        gen_coverage(analysis, analysis_dir=analysis_dir)
-        gen_coverage_manifest(analysis, analysis_dir=analysis_dir)
-        for chrom_name in [
-            "1",
-            "2",
-            "3",
-            "4",
-            "5",
-            "6",
-            "7",
-            "8",
-            "9",
-            "10",
-            "11",
-            "12",
-            "13",
-            "14",
-            "15",
-            "16",
-            "17",
-            "18",
-            "19",
-            "20",
-            "21",
-            "22",
-            "X",
-            "Y",
-            "MT",
-        ]:
-            gen_coverage(analysis, analysis_dir=analysis_dir, bin_size=100_000, chrom_name=f"chr{chrom_name}")
-    except:
-        delete_coverage_files(analysis_dir)
-        logger.error(f"Coverage generation failed: {analysis.accession_id}")
-        raise
+        # cov_viz reads the analysis from the database itself, once per level, so only a few runs go at
+        # once. They're independent subprocesses, so they run alongside the rest of the data, which is
+        # generated from a single pass over the analysis's observations.
+        with ThreadPoolExecutor(max_workers=settings.COVERAGE_GEN_WORKERS) as executor:
+            coverage_futures = []
+            step = "Coverage generation"
+            try:
+                logger.info(f"{analysis_accession}: Generating coverage")
+                coverage_futures.append(executor.submit(gen_genome_coverage, analysis, analysis_dir))
+                coverage_futures.extend(
+                    executor.submit(
+                        gen_coverage,
+                        analysis,
+                        analysis_dir=analysis_dir,
+                        bin_size=100_000,
+                        chrom_name=f"chr{chrom_name}",
+                    )
+                    for chrom_name in CHROM_NAMES
+                )
+
+                step = "Reading observations"
+                logger.info(f"{analysis_accession}: Reading observations")
+                observations = AnalysisObservations.load(analysis)
+
+                step = "Volcano plot generation"
+                logger.info(f"{analysis_accession}: Generating volcano plot")
+                gen_volcano_plot(analysis, analysis_dir=analysis_dir, observations=observations)
+
+                step = "QQ plot generation"
+                logger.info(f"{analysis_accession}: Generating QQ plot")
+                gen_qq_plot(analysis, analysis_dir=analysis_dir, observations=observations)
+
+                step = "Coverage pyramid generation"
+                logger.info(f"{analysis_accession}: Generating coverage pyramid")
+                gen_coverage_pyramid(analysis, analysis_dir=analysis_dir, observations=observations)
+
+                step = "Coverage generation"
+                for future in coverage_futures:
+                    future.result()
+            except BaseException:
+                # Don't leave a partial set of coverage files behind, whichever step failed
+                for future in coverage_futures:
+                    future.cancel()
+                wait(coverage_futures)
+                delete_coverage_files(analysis_dir)
+                logger.error(f"{step} failed: {analysis.accession_id}")
+                raise
+    finally:
+        # Any cached, filtered coverage for this analysis was generated from the old coverage files
+        CoverageCache.invalidate(analysis.accession_id)
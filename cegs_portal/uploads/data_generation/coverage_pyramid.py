@@ -0,0 +1,13 @@
+import os
+
+from cegs_portal.search.models import Analysis
+from cegs_portal.search.view_models.v1.coverage_pyramid import (
+    PYRAMID_FILENAME,
+    CoveragePyramid,
+)
+
+from .observations import AnalysisObservations
+
+
+def gen_coverage_pyramid(analysis: Analysis, analysis_dir: str, observations: AnalysisObservations):
+    CoveragePyramid.build(observations.features).save(os.path.join(analysis_dir, PYRAMID_FILENAME))
@@ -0,0 +1,221 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+from django.db import connection
+
+from cegs_portal.search.models import Analysis, DNAFeature, Facet, FacetValue, GrnaType
+from cegs_portal.search.view_models.v1.coverage_pyramid import FEATURE_KINDS, NO_FACET
+
+# Observations are either from targeting guides or from controls
+TARGETING_CATEGORY = 0
+CONTROL_CATEGORY = 1
+
+# Stands in for a missing source or target id
+NO_FEATURE = -1
+
+# How many observations are fetched from the database, and converted to numpy columns, at a time
+OBSERVATIONS_FETCH_ROWS = 100_000
+
+# The columns of OBSERVATIONS_QUERY, in order, and their numpy types. "bytes" columns are UTF-8 encoded text and
+# cat_facets is a 2-d array, with each row padded with coverage_pyramid.NO_FACET to the same length.
+OBSERVATION_COLUMNS = [
+    ("reo_id", np.int64),
+    ("effect_size", np.float64),
+    ("adj_p_value", np.float64),
+    ("raw_p_value", np.float64),
+    ("log_significance", np.float64),
+    ("targeting_category", np.int32),
+    ("source_id", np.int64),
+    ("source_start", np.int32),
+    ("source_end", np.int32),
+    ("target_id", np.int64),
+    ("target_start", np.int32),
+    ("target_end", np.int32),
+    ("target_gene_symbol", np.bytes_),
+    ("source_chrom", np.bytes_),
+    ("target_chrom", np.bytes_),
+    ("cat_facets", np.int64),
+]
+
+# NULLs are replaced so each column can be read into a numpy array. Missing values are NaN, missing features
+# are NO_FEATURE, and missing text is empty.
+OBSERVATIONS_QUERY = """SELECT reo_id::int8,
+        coalesce(effect_size, 'NaN')::float8,
+        coalesce(adj_p_value, 'NaN')::float8,
+        coalesce(raw_p_value, 'NaN')::float8,
+        coalesce(log_significance, 'NaN')::float8,
+        CASE WHEN cat_facets && %s::bigint[] THEN 0 WHEN cat_facets && %s::bigint[] THEN 1 ELSE 0 END,
+        coalesce(source_id, -1)::int8,
+        coalesce(lower(source_loc), 0),
+        coalesce(upper(source_loc), 0),
+        coalesce(target_id, -1)::int8,
+        coalesce(lower(target_loc), 0),
+        coalesce(upper(target_loc), 0),
+        coalesce(target_gene_symbol, ''),
+        coalesce(source_chrom, ''),
+        coalesce(target_chrom, ''),
+        coalesce(cat_facets, '{}')
+    FROM get_expr_data_reo_sources_targets
+    WHERE reo_analysis = %s"""
+
+
+def _facet_array(facet_lists, width: int) -> np.ndarray:
+    """Pack lists of facet ids into a 2-d array, padding each row with NO_FACET"""
+    facets = np.full((len(facet_lists), width), NO_FACET, dtype=np.int64)
+    lengths = np.fromiter((len(facet_ids) for facet_ids in facet_lists), dtype=np.int64, count=len(facet_lists))
+    facets[np.arange(width) < lengths[:, None]] = np.fromiter(
+        (facet_id for facet_ids in facet_lists for facet_id in facet_ids), dtype=np.int64, count=lengths.sum()
+    )
+    return facets
+
+
+def observation_columns(rows: list[tuple]) -> dict[str, np.ndarray]:
+    """Convert rows of OBSERVATIONS_QUERY into columns, keyed by the names in OBSERVATION_COLUMNS"""
+    if len(rows) == 0:
+        return {
+            name: np.empty((0, 1) if name == "cat_facets" else 0, dtype=dtype) for name, dtype in OBSERVATION_COLUMNS
+        }
+
+    columns = {}
+    for (name, dtype), values in zip(OBSERVATION_COLUMNS, zip(*rows)):
+        if name == "cat_facets":
+            columns[name] = _facet_array(values, max(max(len(facet_ids) for facet_ids in values), 1))
+        elif dtype is np.bytes_:
+            columns[name] = np.array([value.encode("utf-8") for value in values], dtype=np.bytes_)
+        else:
+            columns[name] = np.array(values, dtype=dtype)
+    return columns
+
+
+def concat_observation_columns(batches: list[dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    """Join batches of columns from observation_columns into one set of columns"""
+    if len(batches) == 0:
+        return observation_columns([])
+
+    facet_width = max(batch["cat_facets"].shape[1] for batch in batches)
+    columns = {}
+    for name, _ in OBSERVATION_COLUMNS:
+        if name == "cat_facets":
+            columns[name] = np.concatenate(
+                [
+                    np.pad(batch[name], ((0, 0), (0, facet_width - batch[name].shape[1])), constant_values=NO_FACET)
+                    for batch in batches
+                ]
+            )
+        else:
+            columns[name] = np.concatenate([batch[name] for batch in batches])
+    return columns
+
+
+def _control_facet_ids():
+    ctrl_facet = Facet.objects.get(name=DNAFeature.Facet.GRNA_TYPE.value)
+    targeting_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.TARGETING.value).values_list(
+        "id", flat=True
+    )[0]
+    pos_ctrl_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.POSITIVE_CONTROL.value).values_list(
+        "id", flat=True
+    )[0]
+    neg_ctrl_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.NEGATIVE_CONTROL.value).values_list(
+        "id", flat=True
+    )[0]
+    return [targeting_facet], [pos_ctrl_facet, neg_ctrl_facet]
+
+
+@dataclass
+class AnalysisObservations:
+    """
+    The data from an analysis's observations needed to generate its visualizations, as columns.
+
+    The observation columns have one entry per observation. features holds, for each kind of feature
+    (source or target) and chromosome, one entry per observation/feature pair in the form expected by
+    CoveragePyramid.build. Gene symbols are UTF-8 encoded bytes, empty for observations without one.
+    """
+
+    effect_size: np.ndarray
+    adj_p_value: np.ndarray
+    raw_p_value: np.ndarray
+    log_significance: np.ndarray
+    target_gene_symbol: np.ndarray
+    targeting_category: np.ndarray
+    features: dict[str, dict[str, dict[str, np.ndarray]]] = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.effect_size)
+
+    @classmethod
+    def load(cls, analysis: Analysis) -> "AnalysisObservations":
+        """
+        Read all of the analysis's observations in one query. They're fetched from a server-side cursor in
+        batches, and each batch is converted to numpy columns, so the rows are never all in memory as tuples.
+        """
+        non_ctrl, ctrl = _control_facet_ids()
+
+        batches = []
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(OBSERVATIONS_QUERY, [non_ctrl, ctrl, analysis.accession_id])
+            while rows := cursor.fetchmany(OBSERVATIONS_FETCH_ROWS):
+                batches.append(observation_columns(rows))
+
+        return cls.from_columns(concat_observation_columns(batches))
+
+    @classmethod
+    def from_columns(cls, columns: dict[str, np.ndarray]) -> "AnalysisObservations":
+        """
+        Build the observation data from get_expr_data_reo_sources_targets rows, given as columns in the form
+        returned by observation_columns. Observations with several sources or targets show up in several rows.
+        """
+        reo_ids = columns["reo_id"]
+        cat_facets = columns["cat_facets"]
+        effect_size = columns["effect_size"]
+        log_significance = columns["log_significance"]
+
+        # Keep the first row of each observation, in the order they were read
+        _, first_rows = np.unique(reo_ids, return_index=True)
+        first_rows.sort()
+
+        features = {}
+        for kind in FEATURE_KINDS:
+            features[kind] = {}
+            feature_ids = columns[f"{kind}_id"]
+            has_feature = feature_ids != NO_FEATURE
+            if not has_feature.any():
+                continue
+
+            # Keep the first row of each observation/feature pair. lexsort is stable, so the first row of each
+            # run of equal pairs is the first one read.
+            rows = np.flatnonzero(has_feature)
+            pair_order = np.lexsort((feature_ids[rows], reo_ids[rows]))
+            sorted_reo_ids = reo_ids[rows][pair_order]
+            sorted_feature_ids = feature_ids[rows][pair_order]
+            first_pairs = np.ones(len(rows), dtype=bool)
+            first_pairs[1:] = (np.diff(sorted_reo_ids) != 0) | (np.diff(sorted_feature_ids) != 0)
+            rows = np.sort(rows[pair_order[first_pairs]])
+
+            # Group the rows by chromosome, keeping them in the order they were read within each chromosome
+            chrom_names, chrom_indices = np.unique(columns[f"{kind}_chrom"][rows], return_inverse=True)
+            rows = rows[np.argsort(chrom_indices, kind="stable")]
+            chrom_ends = np.cumsum(np.bincount(chrom_indices, minlength=len(chrom_names)))
+            pos = (columns[f"{kind}_start"][rows].astype(np.int64) + columns[f"{kind}_end"][rows]) // 2
+            effect = effect_size[rows]
+            sig = log_significance[rows]
+            facets = cat_facets[rows]
+            chrom_start = 0
+            for chrom, chrom_end in zip(chrom_names, chrom_ends):
+                chrom_rows = slice(chrom_start, chrom_end)
+                features[kind][chrom.decode("utf-8")] = {
+                    "pos": pos[chrom_rows],
+                    "effect": effect[chrom_rows],
+                    "sig": sig[chrom_rows],
+                    "facets": facets[chrom_rows],
+                }
+                chrom_start = chrom_end
+
+        return cls(
+            effect_size=effect_size[first_rows],
+            adj_p_value=columns["adj_p_value"][first_rows],
+            raw_p_value=columns["raw_p_value"][first_rows],
+            log_significance=log_significance[first_rows],
+            target_gene_symbol=columns["target_gene_symbol"][first_rows],
+            targeting_category=columns["targeting_category"][first_rows].astype(np.uint8),
+            features=features,
+        )
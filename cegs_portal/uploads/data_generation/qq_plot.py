@@ -1,63 +1,46 @@
 import logging
-import math
 import os
 import struct
 
 import numpy as np
 
-from cegs_portal.get_expr_data.models import ReoSourcesTargets
-from cegs_portal.search.models import (
-    DNAFeature,
-    Facet,
-    FacetValue,
-    GrnaType,
-    RegulatoryEffectObservation,
-)
+from .observations import CONTROL_CATEGORY, TARGETING_CATEGORY, AnalysisObservations
 
 MIN_SIG = 1e-100
 
 logger = logging.getLogger(__name__)
 
 
-def gen_qq_plot(analysis, analysis_dir):
-    ctrl_facet = Facet.objects.get(name=DNAFeature.Facet.GRNA_TYPE.value)
-    targeting_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.TARGETING.value).values_list(
-        "id", flat=True
-    )[0]
-    pos_ctrl_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.POSITIVE_CONTROL.value).values_list(
-        "id", flat=True
-    )[0]
-    neg_ctrl_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.NEGATIVE_CONTROL.value).values_list(
-        "id", flat=True
-    )[0]
-    non_ctrl = {targeting_facet}
-    ctrl = {pos_ctrl_facet, neg_ctrl_facet}
-    category_names = ["Targeting", "Controls"]
+def sorted_quantiles(values: np.ndarray, quantiles: np.ndarray) -> np.ndarray:
+    """
+    Equivalent to np.quantile(values, q=quantiles) with the default "linear" method. np.quantile partitions
+    the data once per quantile, which is very slow for thousands of quantiles; sorting once is much faster.
+    """
+    sorted_values = np.sort(values)
+    virtual_indexes = (len(sorted_values) - 1) * quantiles
+    previous_indexes = np.clip(np.floor(virtual_indexes).astype(np.int64), 0, len(sorted_values) - 1)
+    next_indexes = np.minimum(previous_indexes + 1, len(sorted_values) - 1)
+    gamma = virtual_indexes - previous_indexes
 
-    x_axis_label = b"-log10(Theoretical p-value quantiles)"
-    y_axis_label = b"-log10(Observed p-value quantiles)"
+    previous_values = sorted_values[previous_indexes]
+    next_values = sorted_values[next_indexes]
+    diff = next_values - previous_values
+    return np.where(gamma >= 0.5, next_values - diff * (1 - gamma), previous_values + diff * gamma)
 
-    reos = (
-        ReoSourcesTargets.objects.filter(reo_analysis=analysis.accession_id)
-        .order_by("reo_accession")
-        .distinct("reo_accession")
-        .values("cat_facets", "reo_facets")
-    )
 
-    qq_data = {0: [], 1: []}
-    for reo in reos:
-        raw_p_val = max(float(reo["reo_facets"][RegulatoryEffectObservation.Facet.RAW_P_VALUE.value]), MIN_SIG)
-        p_val_log_10 = -math.log10(raw_p_val)
+def gen_qq_plot(analysis, analysis_dir, observations: AnalysisObservations):
+    category_names = {TARGETING_CATEGORY: "Targeting", CONTROL_CATEGORY: "Controls"}
 
-        cat_facets = set(reo["cat_facets"])
-        if cat_facets & non_ctrl:
-            targeting_category = 0
-        elif cat_facets & ctrl:
-            targeting_category = 1
-        else:
-            targeting_category = 0
+    x_axis_label = b"-log10(Theoretical p-value quantiles)"
+    y_axis_label = b"-log10(Observed p-value quantiles)"
 
-        qq_data[targeting_category].append(p_val_log_10)
+    # Observations without a p-value are read as NaN, which would sort to the end of the quantiles
+    has_p_value = ~np.isnan(observations.raw_p_value)
+    p_val_log_10 = -np.log10(np.maximum(observations.raw_p_value, MIN_SIG))
+    qq_data = {
+        category: p_val_log_10[has_p_value & (observations.targeting_category == category)]
+        for category in [TARGETING_CATEGORY, CONTROL_CATEGORY]
+    }
 
     # If there is no data, drop that array
     keys = list(qq_data.keys())
@@ -73,16 +56,15 @@ def gen_qq_plot(analysis, analysis_dir):
 
     quantile_count = min(10_000, sample_size)
     quantile_step = 1 / quantile_count
-    percentiles = [x * quantile_step for x in range(1, 1 + quantile_count)]
+    percentiles = np.arange(1, 1 + quantile_count) * quantile_step
 
-    y_percentiles = [np.quantile(np.array(qq_data[category]), q=percentiles) for category in qq_data]
+    y_percentiles = [sorted_quantiles(qq_data[category], percentiles) for category in qq_data]
 
-    s = sorted(np.random.uniform(0, 1, sample_size))
-    x_percentiles = np.quantile(-np.log10(s), q=percentiles)
+    s = np.sort(np.random.uniform(0, 1, sample_size))
+    x_percentiles = sorted_quantiles(-np.log10(s), percentiles)
 
-    p_val_percentiles = []
-    for p in zip(x_percentiles, *y_percentiles):
-        p_val_percentiles.extend(p)
+    # x0yyx1yyx2yy...
+    p_val_percentiles = np.column_stack((x_percentiles, *y_percentiles)).ravel()
 
     # The serialized format of the qqplot data is (using pythons `struct` module formats)
     #   (\d indicates a non-negative integer)
@@ -106,12 +88,12 @@ def gen_qq_plot(analysis, analysis_dir):
     for idx in qq_data:
         y_val_name_data.extend((len(category_names[idx]), category_names[idx].encode("utf-8")))
 
-    packing_list = f">IB{''.join(y_val_name_format)}B{len(x_axis_label)}sB{len(y_axis_label)}s{(1 + len(qq_data)) * quantile_count}f"
+    header_packing_list = f">IB{''.join(y_val_name_format)}B{len(x_axis_label)}sB{len(y_axis_label)}s"
     out_filename = os.path.join(analysis_dir, "qqplot.pd")
     with open(out_filename, "wb") as out_file:
         out_file.write(
             struct.pack(
-                packing_list,
+                header_packing_list,
                 quantile_count,
                 len(qq_data),  # category count
                 *y_val_name_data,
@@ -119,6 +101,6 @@ def gen_qq_plot(analysis, analysis_dir):
                 x_axis_label,
                 len(y_axis_label),
                 y_axis_label,
-                *p_val_percentiles,
             )
         )
+        out_file.write(p_val_percentiles.astype(">f4").tobytes())
@@ -1,91 +1,71 @@
 import logging
 import os
-import struct
 
-from cegs_portal.get_expr_data.models import ReoSourcesTargets
-from cegs_portal.search.models import (
-    DNAFeature,
-    Facet,
-    FacetValue,
-    GrnaType,
-    RegulatoryEffectObservation,
-)
+import numpy as np
+
+from .observations import AnalysisObservations
 
 logger = logging.getLogger(__name__)
 
+# The fixed-size part of each volcano plot record. See gen_volcano_plot for the full format.
+VOLCANO_RECORD_DTYPE = np.dtype([("log_p_val", ">f4"), ("avg_log_fc", ">f4"), ("category", "u1"), ("symbol_len", "u1")])
 
-def gen_volcano_plot(analysis, analysis_dir):
-    logger.info(f"Generating volcano plot {analysis.accession_id}")
-    ctrl_facet = Facet.objects.get(name=DNAFeature.Facet.GRNA_TYPE.value)
-    targeting_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.TARGETING.value).values_list(
-        "id", flat=True
-    )[0]
-    pos_ctrl_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.POSITIVE_CONTROL.value).values_list(
-        "id", flat=True
-    )[0]
-    neg_ctrl_facet = FacetValue.objects.filter(facet=ctrl_facet, value=GrnaType.NEGATIVE_CONTROL.value).values_list(
-        "id", flat=True
-    )[0]
-    non_ctrl = {targeting_facet}
-    ctrl = {pos_ctrl_facet, neg_ctrl_facet}
 
-    sig_threshold = analysis.p_value_threshold
+def pack_records(records: np.ndarray, symbols: np.ndarray, symbol_lengths: np.ndarray) -> np.ndarray:
+    """Each fixed-size record followed by the first symbol_lengths bytes of its symbol, as one byte array"""
+    record_size = records.dtype.itemsize
+    symbol_width = symbols.dtype.itemsize
+    record_ends = np.cumsum(record_size + symbol_lengths)
+    record_starts = record_ends - record_size - symbol_lengths
 
-    reos = (
-        ReoSourcesTargets.objects.filter(reo_analysis=analysis.accession_id)
-        .order_by("reo_accession")
-        .distinct("reo_accession")
-        .values("reo_facets", "target_gene_symbol", "cat_facets")
-    )
+    packed = np.empty(record_ends[-1] if len(records) > 0 else 0, dtype=np.uint8)
+    packed[record_starts[:, None] + np.arange(record_size)] = records.view(np.uint8).reshape(-1, record_size)
 
-    out_filename = os.path.join(analysis_dir, "vpdata.pd")
-    try:
-        with open(out_filename, "wb") as out_file:
-            for reo in reos:
-                reo_facets = reo["reo_facets"]
-                p_val = float(reo_facets[RegulatoryEffectObservation.Facet.SIGNIFICANCE.value])
-                p_val_log_10 = float(reo_facets[RegulatoryEffectObservation.Facet.LOG_SIGNIFICANCE.value])
-                avg_log_fc = float(reo_facets[RegulatoryEffectObservation.Facet.EFFECT_SIZE.value])
+    symbol_bytes = symbols.view(np.uint8).reshape(-1, symbol_width)
+    in_symbol = np.arange(symbol_width) < symbol_lengths[:, None]
+    symbol_offsets = (record_starts + record_size)[:, None] + np.arange(symbol_width)
+    packed[symbol_offsets[in_symbol]] = symbol_bytes[in_symbol]
+    return packed
 
-                # Skip non-significant, low fold-change data
-                # This is by far most of the data so this keeps the number of
-                # observation relatively small, which means the output file is small
-                if p_val > sig_threshold and abs(avg_log_fc) < 1:
-                    continue
 
-                if reo["target_gene_symbol"] is not None:
-                    symbol = reo["target_gene_symbol"].encode("utf-8")
-                else:
-                    symbol = b""
+def gen_volcano_plot(analysis, analysis_dir, observations: AnalysisObservations):
+    logger.info(f"Generating volcano plot {analysis.accession_id}")
+    sig_threshold = analysis.p_value_threshold
 
-                cat_facets = set(reo["cat_facets"])
-                if cat_facets & non_ctrl:
-                    targeting_category = 0
-                elif cat_facets & ctrl:
-                    targeting_category = 1
-                else:
-                    targeting_category = 0
+    # Skip non-significant, low fold-change data
+    # This is by far most of the data so this keeps the number of
+    # observation relatively small, which means the output file is small
+    keep = ~((observations.adj_p_value > sig_threshold) & (np.abs(observations.effect_size) < 1))
+    # Observations without a p-value or effect size can't be plotted. NULLs are read as NaN, and NaN fails
+    # every comparison, so they have to be left out explicitly.
+    keep &= ~(
+        np.isnan(observations.adj_p_value)
+        | np.isnan(observations.log_significance)
+        | np.isnan(observations.effect_size)
+    )
 
-                # The serialized format of the histogram data is (using pythons `struct` module formats)
-                #   (\d indicates a non-negative integer)
-                #   See https://docs.python.org/3.11/library/struct.html#module-struct
-                # >: Big-endian byte order
-                # f: -log10(p-value)
-                # f: avg log fold change
-                # B: A number associated with the category the data come from ("targeting", "nontargeting", etc.)
-                # B: The length of the associated gene symbol
-                # \ds: The gene symbol
+    symbols = observations.target_gene_symbol[keep]
 
-                data = struct.pack(
-                    f">ffBB{len(symbol)}s",
-                    p_val_log_10,
-                    avg_log_fc,
-                    targeting_category,
-                    len(symbol),
-                    symbol,
-                )
+    # The serialized format of the histogram data is (using pythons `struct` module formats)
+    #   (\d indicates a non-negative integer)
+    #   See https://docs.python.org/3.11/library/struct.html#module-struct
+    # >: Big-endian byte order
+    # f: -log10(p-value)
+    # f: avg log fold change
+    # B: A number associated with the category the data come from ("targeting", "nontargeting", etc.)
+    # B: The length of the associated gene symbol
+    # \ds: The gene symbol
+    out_filename = os.path.join(analysis_dir, "vpdata.pd")
+    try:
+        records = np.empty(len(symbols), dtype=VOLCANO_RECORD_DTYPE)
+        records["log_p_val"] = observations.log_significance[keep]
+        records["avg_log_fc"] = observations.effect_size[keep]
+        records["category"] = observations.targeting_category[keep]
+        symbol_lengths = np.char.str_len(symbols)
+        records["symbol_len"] = symbol_lengths
 
-                out_file.write(data)
+        with open(out_filename, "wb") as out_file:
+            out_file.write(pack_records(records, symbols, symbol_lengths).tobytes())
     except Exception as ex:
         logger.debug(str(ex))
         try:
@@ -1,18 +1,18 @@
 import csv
 import logging
 import math
+import pickle
 from dataclasses import dataclass
-from io import StringIO
-from itertools import tee
-from typing import Optional
+from itertools import repeat, tee
+from typing import Container, Iterable, Optional, TextIO
 
+import numpy as np
+from django.conf import settings
 from django.db import transaction
-from psycopg.types.range import Int4Range
 
 from cegs_portal.search.models import (
     AccessionIds,
     AccessionType,
-    DNAFeature,
     DNAFeatureType,
     Experiment,
     Facet,
@@ -21,11 +21,27 @@ from cegs_portal.search.models import (
 )
 from cegs_portal.utils.db_ids import ReoIds
 
-from .db import bulk_reo_save, cat_facet_entry, reo_entry, source_entry, target_entry
+from .columnar import ColumnBatch, read_column_batches
+from .db import (
+    REO_COLUMNS,
+    REO_FACET_COLUMNS,
+    REO_SOURCE_COLUMNS,
+    REO_TARGET_COLUMNS,
+    bulk_reo_save,
+    bulk_source_flag_save,
+    cat_facet_entry,
+    copy_spool,
+    reo_entry,
+    source_entry,
+    target_entry,
+)
 from .metadata import AnalysisMetadata, InternetFile
+from .resolver import FeatureResolver
 from .types import Facets, FeatureType
 
 MIN_SIG = 1e-100
+# How many parsed observations are written to a parsed observations file at a time
+PARSED_BATCH_ROWS = 10_000
 
 logger = logging.getLogger(__name__)
 
@@ -65,9 +81,148 @@ class ObservationRow:
     numeric_facets: dict[Facets, float]
 
 
+def categorical_facets(facets: Optional[str], facet_values: Container[str]) -> list[list[str]]:
+    if facets is None or facets == "":
+        return []
+
+    facet_pairs = [f.split("=") for f in facets.split(";")]
+    for _, facet_value in facet_pairs:
+        if facet_value not in facet_values:
+            raise ValueError(f"Invalid categorical facet value: '{facet_value}'")
+
+    return facet_pairs
+
+
+def parse_observations(lines: Iterable[dict[str, str]], source_type: str, facet_values: Container[str]):
+    """Parse lines of an observations file, as read by csv.DictReader, into ObservationRows"""
+    source_type = FeatureType(source_type)
+
+    for line in lines:
+        chrom_name, start, end, strand = (
+            line["chrom"],
+            int(line["start"]),
+            int(line["end"]),
+            line["strand"],
+        )
+        sources = [SourceInfo(chrom_name, start, end, strand, source_type)]
+
+        if (target := line["gene_ensembl_id"]) != "":
+            targets = [target]
+        else:
+            targets = []
+
+        raw_p_value = float(line["raw_p_val"])
+        adjusted_p_value = float(line["adj_p_val"])
+        try:
+            effect_size = float(line["effect_size"])
+        except ValueError:
+            effect_size = None
+
+        num_facets = {
+            Facets.EFFECT_SIZE: effect_size,
+            Facets.SIGNIFICANCE: adjusted_p_value,
+            Facets.RAW_P_VALUE: raw_p_value,
+        }
+
+        name = line.get("name")
+
+        yield ObservationRow(name, sources, targets, categorical_facets(line["facets"], facet_values), num_facets)
+
+
+def parse_observation_columns(batches: Iterable[ColumnBatch], source_type: str, facet_values: Container[str]):
+    """
+    Parse an observations file, as read by read_column_batches, into ObservationRows. The numeric columns of each
+    batch are converted together, and each distinct facets string is only parsed once.
+    """
+    source_type = FeatureType(source_type)
+
+    for batch in batches:
+        starts = batch.int_column("start").tolist()
+        ends = batch.int_column("end").tolist()
+        raw_p_values = batch.float_column("raw_p_val").tolist()
+        adjusted_p_values = batch.float_column("adj_p_val").tolist()
+        effect_sizes = batch.float_column("effect_size", missing_ok=True)
+        effect_sizes = np.where(np.isnan(effect_sizes), None, effect_sizes).tolist()
+
+        facets_column = batch.column("facets")
+        batch_facets = {facets: categorical_facets(facets, facet_values) for facets in set(facets_column)}
+        names = batch.column("name") if "name" in batch else repeat(None)
+
+        for chrom_name, start, end, strand, target, raw_p_value, adjusted_p_value, effect_size, facets, name in zip(
+            batch.column("chrom"),
+            starts,
+            ends,
+            batch.column("strand"),
+            batch.column("gene_ensembl_id"),
+            raw_p_values,
+            adjusted_p_values,
+            effect_sizes,
+            facets_column,
+            names,
+        ):
+            num_facets = {
+                Facets.EFFECT_SIZE: effect_size,
+                Facets.SIGNIFICANCE: adjusted_p_value,
+                Facets.RAW_P_VALUE: raw_p_value,
+            }
+
+            yield ObservationRow(
+                name,
+                [SourceInfo(chrom_name, start, end, strand, source_type)],
+                [target] if target != "" else [],
+                batch_facets[facets],
+                num_facets,
+            )
+
+
+def parse_observations_file(data_filename: str, source_type: str, facet_values: Container[str], parsed_filename: str):
+    """
+    Parse an observations file into parsed_filename, to be read with Analysis.load_parsed. This doesn't use the
+    database, so observations files can be parsed in separate processes.
+
+    Returns the number of observations.
+    """
+    with open(data_filename, newline="") as data_file:
+        return parse_observations_stream(data_file, source_type, facet_values, parsed_filename)
+
+
+def parse_observations_stream(data_file: TextIO, source_type: str, facet_values: Container[str], parsed_filename: str):
+    """The same as parse_observations_file, but for an open observations file"""
+    observation_count = 0
+    batch = []
+    with open(parsed_filename, "wb") as parsed_file:
+        if settings.UPLOAD_COLUMNAR_PARSE:
+            observations = parse_observation_columns(read_column_batches(data_file), source_type, facet_values)
+        else:
+            reader = csv.DictReader(data_file, delimiter="\t", quoting=csv.QUOTE_NONE)
+            observations = parse_observations(reader, source_type, facet_values)
+
+        for observation in observations:
+            batch.append(observation)
+            observation_count += 1
+            if len(batch) >= PARSED_BATCH_ROWS:
+                pickle.dump(batch, parsed_file, protocol=pickle.HIGHEST_PROTOCOL)
+                batch = []
+
+        if len(batch) > 0:
+            pickle.dump(batch, parsed_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return observation_count
+
+
+def read_parsed_observations(parsed_filename: str):
+    with open(parsed_filename, "rb") as parsed_file:
+        while True:
+            try:
+                batch = pickle.load(parsed_file)
+            except EOFError:
+                return
+            yield from batch
+
+
 class Analysis:
     metadata: AnalysisMetadata
-    observations: Optional[list[ObservationRow]] = None
+    observations: Optional[Iterable[ObservationRow]] = None
     accession_id: Optional[str] = None
 
     def __init__(self, metadata: AnalysisMetadata):
@@ -82,9 +237,13 @@ class Analysis:
     def add_file_data_source(self, results_file_location):
         def _ds():
             results_tsv = InternetFile(results_file_location).file
-            reader = csv.DictReader(results_tsv, delimiter="\t", quoting=csv.QUOTE_NONE)
-            for line in reader:
-                yield line
+            if settings.UPLOAD_COLUMNAR_PARSE:
+                yield from parse_observation_columns(
+                    read_column_batches(results_tsv), self.metadata.source_type, self.categorical_facet_values
+                )
+            else:
+                reader = csv.DictReader(results_tsv, delimiter="\t", quoting=csv.QUOTE_NONE)
+                yield from parse_observations(reader, self.metadata.source_type, self.categorical_facet_values)
             results_tsv.close()
 
         self.data_source = _ds
@@ -94,8 +253,7 @@ class Analysis:
     def add_generator_data_source(self, generator):
         def _ds():
             [new_gen] = tee(generator, 1)
-            for line in new_gen:
-                yield line
+            yield from parse_observations(new_gen, self.metadata.source_type, self.categorical_facet_values)
 
         self.data_source = _ds
         return self
@@ -103,46 +261,13 @@ class Analysis:
     def load(self):
         assert self.data_source is not None
 
-        source_type = FeatureType(self.metadata.source_type)
-
-        observations: list[ObservationRow] = []
-        for line in self.data_source():
-            chrom_name, start, end, strand = (
-                line["chrom"],
-                int(line["start"]),
-                int(line["end"]),
-                line["strand"],
-            )
-            sources = [SourceInfo(chrom_name, start, end, strand, source_type)]
-
-            if (target := line["gene_ensembl_id"]) != "":
-                targets = [target]
-            else:
-                targets = []
-
-            raw_p_value = float(line["raw_p_val"])
-            adjusted_p_value = float(line["adj_p_val"])
-            try:
-                effect_size = float(line["effect_size"])
-            except ValueError:
-                effect_size = None
-            categorical_facets = [f.split("=") for f in line["facets"].split(";")] if line["facets"] != "" else []
-
-            for _, facet_value in categorical_facets:
-                if facet_value not in self.categorical_facet_values:
-                    raise ValueError(f"Invalid categorical facet value: '{facet_value}'")
-
-            num_facets = {
-                Facets.EFFECT_SIZE: effect_size,
-                Facets.SIGNIFICANCE: adjusted_p_value,
-                Facets.RAW_P_VALUE: raw_p_value,
-            }
-
-            name = line.get("name")
-
-            observations.append(ObservationRow(name, sources, targets, categorical_facets, num_facets))
+        # Observations are parsed as they are saved, so the whole file is never in memory at once
+        self.observations = self.data_source()
+        return self
 
-        self.observations = observations
+    def load_parsed(self, parsed_filename):
+        # Observations parsed ahead of time by parse_observations_file
+        self.observations = read_parsed_observations(parsed_filename)
         return self
 
     def _save_reos(self, accession_ids):
@@ -157,96 +282,84 @@ class Analysis:
         assert experiment is not None
         experiment_id = experiment.id
         genome_assembly = self.metadata.genome_assembly
-        sources = StringIO()
-        targets = StringIO()
-        effects = StringIO()
-        cat_facets = StringIO()
-        source_cache = {}
-        target_cache = {}
+        # Sources and targets that can't be found are reported all together, after every observation is read
+        resolver = FeatureResolver(experiment_accession_id, genome_assembly)
+        # The flags and facets for each source feature are collected here, then saved all at once
+        significant_sources = set()
+        source_facets: dict[int, set[int]] = {}
 
         fcm_facet_value = None
         for facet_value in experiment.facet_values.all():
             if facet_value.facet.name == Experiment.Facet.FUNCTIONAL_CHARACTERIZATION.value:
                 fcm_facet_value = facet_value
 
-        with ReoIds() as reo_ids:
-            for reo_id, reo in zip(reo_ids, self.observations):
-                reo_direction = [
-                    fv for f, fv in reo.categorical_facets if f == RegulatoryEffectObservation.Facet.DIRECTION.value
-                ]
-
-                for source in reo.sources:
-                    source_string = f"{source.chrom}:{source.start}-{source.end}:{source.strand}:{genome_assembly}"
-                    if source_string not in source_cache:
-                        try:
-                            source_cache[source_string] = DNAFeature.objects.filter(
-                                experiment_accession_id=experiment_accession_id,
-                                chrom_name=source.chrom,
-                                location=Int4Range(source.start, source.end),
-                                strand=source.strand,
-                                ref_genome=genome_assembly,
-                                feature_type=DNAFeatureType(source.feature_type),
-                            ).values_list("id", flat=True)[0]
-                        except Exception:
-                            logger.debug(
-                                f"{experiment_accession_id} {source.chrom}:{Int4Range(source.start, source.end)}:{source.strand} {genome_assembly} {source.feature_type}"
-                            )
-                            raise
-
-                    feature_id = source_cache[source_string]
-                    sources.write(source_entry(reo_id, feature_id))
-
-                    feature = DNAFeature.objects.get(id=feature_id)
-                    if fcm_facet_value is not None:
-                        feature.facet_values.add(fcm_facet_value)
-
-                    if reo_direction:
-                        feature.significant_reo = feature.significant_reo or (reo_direction[0] != "Non-significant")
-                        feature.facet_values.add(self.categorical_facet_values[reo_direction[0]])
-                    feature.save()
-
-                for target in reo.targets:
-                    if target not in target_cache:
-                        try:
-                            target_cache[target] = DNAFeature.objects.filter(
-                                ref_genome=genome_assembly, ensembl_id=target
-                            ).values_list("id", flat=True)[0]
-                        except Exception:
-                            logger.debug(f"{genome_assembly} {target}")
-                            raise
-
-                    targets.write(target_entry(reo_id, target_cache[target]))
-
-                facet_num_values = {
-                    RegulatoryEffectObservation.Facet(key).value: value for key, value in reo.numeric_facets.items()
-                }
-
-                if Facets.LOG_SIGNIFICANCE not in facet_num_values:
-                    facet_num_values[RegulatoryEffectObservation.Facet.LOG_SIGNIFICANCE.value] = -math.log10(
-                        max(reo.numeric_facets[Facets.SIGNIFICANCE], MIN_SIG)
-                    )
-
-                effects.write(
-                    reo_entry(
-                        id_=reo_id,
-                        name=reo.name,
-                        accession_id=accession_ids.incr(AccessionType.REGULATORY_EFFECT_OBS),
-                        experiment_id=experiment_id,
-                        experiment_accession_id=experiment_accession_id,
-                        analysis_accession_id=analysis_accession_id,
-                        facet_num_values=facet_num_values,
+        with (
+            copy_spool(REO_SOURCE_COLUMNS) as sources,
+            copy_spool(REO_TARGET_COLUMNS) as targets,
+            copy_spool(REO_COLUMNS) as effects,
+            copy_spool(REO_FACET_COLUMNS) as cat_facets,
+        ):
+            with ReoIds() as reo_ids:
+                for reo_id, reo in zip(reo_ids, self.observations):
+                    reo_direction = [
+                        fv for f, fv in reo.categorical_facets if f == RegulatoryEffectObservation.Facet.DIRECTION.value
+                    ]
+
+                    for source in reo.sources:
+                        feature_id = resolver.source_id(
+                            source.chrom, source.start, source.end, source.strand, source.feature_type
+                        )
+                        if feature_id is None:
+                            continue
+
+                        sources.write_row(source_entry(reo_id, feature_id))
+
+                        feature_facets = source_facets.setdefault(feature_id, set())
+                        if fcm_facet_value is not None:
+                            feature_facets.add(fcm_facet_value.id)
+
+                        if reo_direction:
+                            if reo_direction[0] != "Non-significant":
+                                significant_sources.add(feature_id)
+                            feature_facets.add(self.categorical_facet_values[reo_direction[0]].id)
+
+                    for target in reo.targets:
+                        target_id = resolver.target_id(target)
+                        if target_id is not None:
+                            targets.write_row(target_entry(reo_id, target_id))
+
+                    facet_num_values = {
+                        RegulatoryEffectObservation.Facet(key).value: value for key, value in reo.numeric_facets.items()
+                    }
+
+                    if Facets.LOG_SIGNIFICANCE not in facet_num_values:
+                        facet_num_values[RegulatoryEffectObservation.Facet.LOG_SIGNIFICANCE.value] = -math.log10(
+                            max(reo.numeric_facets[Facets.SIGNIFICANCE], MIN_SIG)
+                        )
+
+                    effects.write_row(
+                        reo_entry(
+                            id_=reo_id,
+                            name=reo.name,
+                            accession_id=accession_ids.incr(AccessionType.REGULATORY_EFFECT_OBS),
+                            experiment_id=experiment_id,
+                            experiment_accession_id=experiment_accession_id,
+                            analysis_accession_id=analysis_accession_id,
+                            facet_num_values=facet_num_values,
+                        )
                     )
-                )
 
-                for _, facet_value in reo.categorical_facets:
-                    facet_value_id = self.categorical_facet_values[facet_value].id
-                    cat_facets.write(cat_facet_entry(reo_id, facet_value_id))
+                    for _, facet_value in reo.categorical_facets:
+                        facet_value_id = self.categorical_facet_values[facet_value].id
+                        cat_facets.write_row(cat_facet_entry(reo_id, facet_value_id))
 
-                # Write the experiment's Functional Characterization Modality as a facet on the REO
-                if fcm_facet_value is not None:
-                    cat_facets.write(cat_facet_entry(reo_id, fcm_facet_value.id))
+                    # Write the experiment's Functional Characterization Modality as a facet on the REO
+                    if fcm_facet_value is not None:
+                        cat_facets.write_row(cat_facet_entry(reo_id, fcm_facet_value.id))
 
-        bulk_reo_save(effects, cat_facets, sources, targets)
+            resolver.check()
+            bulk_reo_save(effects, cat_facets, sources, targets)
+            bulk_source_flag_save(significant_sources, source_facets)
 
     def save(self):
         with transaction.atomic():
@@ -1,115 +1,151 @@
-import sys
 from functools import lru_cache
+from typing import Iterable, Optional
 
-from cegs_portal.search.models import DNAFeature, DNAFeatureType
+import numpy as np
+from django.db.models import Count, Max
 
+from cegs_portal.search.models import DNAFeature, DNAFeatureType
 
-@lru_cache(maxsize=1)
-def get_pos_genes(chrom_name, ref_genome):
-    return list(
-        DNAFeature.objects.filter(
-            chrom_name=chrom_name,
-            strand="+",
-            ref_genome=ref_genome,
-            feature_type=DNAFeatureType.GENE,
+NO_GENE = -1
+# How many gene indexes (reference genome versions) are kept loaded
+GENE_INDEX_CACHE_SIZE = 4
+# Genes are (+) or (-) strand. The TSS of a (+) strand gene is the start of its location and the TSS of a (-)
+# strand gene is the end. Strands are checked in order, so when genes on both strands are equally close the
+# (+) strand gene is picked.
+STRANDS = ["+", "-"]
+
+
+class GeneIndex:
+    """
+    The genes of a reference genome, for finding the gene closest to a location.
+
+    For each chromosome and strand the index holds the gene TSSs as a sorted array, so the closest genes
+    for any number of locations can be found with np.searchsorted.
+    """
+
+    def __init__(self, genes: list[dict]):
+        self.genes = genes
+        self.tss: dict[tuple[str, str], tuple[np.ndarray, np.ndarray]] = {}
+
+        groups: dict[tuple[str, str], list[int]] = {}
+        for i, gene in enumerate(genes):
+            groups.setdefault((gene["chrom_name"], gene["strand"]), []).append(i)
+
+        for (chrom_name, strand), gene_indices in groups.items():
+            if strand not in STRANDS:
+                continue
+            gene_indices = np.array(gene_indices, dtype=np.int64)
+            tss = np.array(
+                [genes[i]["location"].lower if strand == "+" else genes[i]["location"].upper for i in gene_indices],
+                dtype=np.int64,
+            )
+            order = np.argsort(tss, kind="stable")
+            self.tss[(chrom_name, strand)] = (tss[order], gene_indices[order])
+
+    @classmethod
+    def load(cls, ref_genome: str) -> "GeneIndex":
+        return cls(
+            list(
+                DNAFeature.objects.filter(ref_genome=ref_genome, feature_type=DNAFeatureType.GENE)
+                .order_by("location", "id")
+                .values("id", "name", "location", "ensembl_id", "chrom_name", "strand")
+            )
         )
-        .order_by("location")
-        .values("id", "name", "location", "ensembl_id")
-        .all()
-    )
-
 
-@lru_cache(maxsize=1)
-def get_neg_genes(chrom_name, ref_genome):
-    return list(
-        DNAFeature.objects.filter(
-            chrom_name=chrom_name,
-            strand="-",
-            ref_genome=ref_genome,
-            feature_type=DNAFeatureType.GENE,
-        )
-        .order_by("location")
-        .values("id", "name", "location", "ensembl_id")
-        .all()
+    def closest(self, chrom_name: str, midpoints: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The index (into self.genes) of the gene with the closest TSS to each midpoint, and the distance from the
+        TSS to the midpoint. Midpoints without any genes on the chromosome get NO_GENE.
+        """
+        midpoints = np.asarray(midpoints, dtype=np.int64)
+        closest = np.full(len(midpoints), NO_GENE, dtype=np.int64)
+        distances = np.zeros(len(midpoints), dtype=np.int64)
+
+        for strand in STRANDS:
+            if (strand_tss := self.tss.get((chrom_name, strand))) is None:
+                continue
+
+            strand_closest, strand_distances = _closest_tss(*strand_tss, midpoints)
+            closer = (closest == NO_GENE) | (np.abs(strand_distances) < np.abs(distances))
+            closest[closer] = strand_closest[closer]
+            distances[closer] = strand_distances[closer]
+
+        return closest, distances
+
+    def closest_genes(
+        self, chrom_names: Iterable[str], starts: Iterable[int], ends: Iterable[int]
+    ) -> list[tuple[Optional[dict], Optional[int], str]]:
+        """The closest gene to each location, in the form returned by get_closest_gene"""
+        chrom_names = np.array(list(chrom_names), dtype=object)
+        midpoints = (np.fromiter(starts, dtype=np.int64) + np.fromiter(ends, dtype=np.int64)) // 2
+
+        closest = np.full(len(midpoints), NO_GENE, dtype=np.int64)
+        distances = np.zeros(len(midpoints), dtype=np.int64)
+        for chrom_name in set(chrom_names):
+            in_chrom = np.flatnonzero(chrom_names == chrom_name)
+            closest[in_chrom], distances[in_chrom] = self.closest(chrom_name, midpoints[in_chrom])
+
+        results = []
+        for gene_index, distance in zip(closest.tolist(), distances.tolist()):
+            if gene_index == NO_GENE:
+                results.append((None, None, "No Gene"))
+            else:
+                gene = self.genes[gene_index]
+                results.append((gene, distance, gene["name"]))
+        return results
+
+
+def _closest_tss(tss, gene_indices, midpoints):
+    # tss[after] is the first TSS at or after each midpoint, so the closest is either it or the one before it
+    after = np.searchsorted(tss, midpoints, side="left")
+    before = after - 1
+    has_after = after < len(tss)
+    has_before = before >= 0
+
+    after_distances = np.where(has_after, tss[np.minimum(after, len(tss) - 1)] - midpoints, np.iinfo(np.int64).max)
+    before_distances = np.where(has_before, midpoints - tss[np.maximum(before, 0)], np.iinfo(np.int64).max)
+
+    # When the TSSs before and after are the same distance away, the one before is picked
+    use_before = before_distances <= after_distances
+    closest = np.where(use_before, before, after)
+    return gene_indices[closest], midpoints - tss[closest]
+
+
+def _genes_version(ref_genome: str) -> tuple[Optional[int], int]:
+    # New genes get larger ids, so this changes whenever a reference genome's genes are loaded or deleted
+    genes = DNAFeature.objects.filter(ref_genome=ref_genome, feature_type=DNAFeatureType.GENE).aggregate(
+        max_id=Max("id"), count=Count("id")
     )
+    return genes["max_id"], genes["count"]
 
 
-def find_pos_closest(midpoint, genes):
-    if len(genes) == 0:
-        return None
-
-    start = 0
-    end = len(genes)
-    index = (end + start) // 2
-    while True:
-        gene = genes[index]
-        if index == end or index == start:
-            # the loop is hacky, but the binary search only gets _close_ to finding the closest feature.
-            for i in range(-6, 7):
-                new_gene = genes[min(max(0, index + i), len(genes) - 1)]
-                if abs(new_gene["location"].lower - midpoint) < abs(gene["location"].lower - midpoint):
-                    gene = new_gene
-            return gene
-
-        if gene["location"].lower >= midpoint:
-            end = index
-        elif gene["location"].lower < midpoint:
-            start = index
-
-        index = (end + start) // 2
-
-
-def find_neg_closest(midpoint, genes):
-    if len(genes) == 0:
-        return None
-
-    start = 0
-    end = len(genes)
-    index = (end + start) // 2
-    while True:
-        gene = genes[index]
-        if index == end or index == start:
-            # the loop is hacky, but the binary search only gets _close_ to finding the closest feature.
-            for i in range(-6, 7):
-                new_gene = genes[min(max(0, index + i), len(genes) - 1)]
-                if abs(new_gene["location"].upper - midpoint) < abs(gene["location"].upper - midpoint):
-                    gene = new_gene
-            return gene
-
-        if gene["location"].upper >= midpoint:
-            end = index
-        elif gene["location"].upper < midpoint:
-            start = index
-
-        index = (end + start) // 2
+@lru_cache(maxsize=GENE_INDEX_CACHE_SIZE)
+def _gene_index(ref_genome: str, version: tuple[Optional[int], int]) -> GeneIndex:
+    return GeneIndex.load(ref_genome)
 
 
-def get_closest_gene(ref_genome, chrom_name, start, end):
-    range_midpoint = (start + end) // 2
+def gene_index(ref_genome: str) -> GeneIndex:
+    """The reference genome's GeneIndex, cached until its genes change"""
+    return _gene_index(ref_genome, _genes_version(ref_genome))
 
-    closest_pos_gene = find_pos_closest(range_midpoint, get_pos_genes(chrom_name, ref_genome))
-    pos_feature_distance = (
-        range_midpoint - closest_pos_gene["location"].lower if closest_pos_gene is not None else sys.maxsize
-    )
-    closest_neg_gene = find_neg_closest(range_midpoint, get_neg_genes(chrom_name, ref_genome))
-    neg_feature_distance = (
-        range_midpoint - closest_neg_gene["location"].upper if closest_neg_gene is not None else sys.maxsize
-    )
-
-    closest_gene = None
-    distance = None
-    gene_name = "No Gene"
-
-    if closest_pos_gene is None and closest_neg_gene is None:
-        pass
-    elif closest_pos_gene is None or abs(neg_feature_distance) < abs(pos_feature_distance):
-        closest_gene = closest_neg_gene
-        distance = neg_feature_distance
-    elif closest_neg_gene is None or abs(pos_feature_distance) <= abs(neg_feature_distance):
-        closest_gene = closest_pos_gene
-        distance = pos_feature_distance
 
-    if closest_gene is not None:
-        gene_name = closest_gene["name"]
-
-    return closest_gene, distance, gene_name
+def get_closest_gene(ref_genome, chrom_name, start, end):
+    return gene_index(ref_genome).closest_genes([chrom_name], [start], [end])[0]
+
+
+def get_closest_genes(locations: list[tuple[str, str, int, int]]) -> list[tuple[Optional[dict], Optional[int], str]]:
+    """
+    The closest gene to each (ref_genome, chrom_name, start, end) location, in the form returned by
+    get_closest_gene. The genes are read once for each reference genome.
+    """
+    results = [None] * len(locations)
+    for ref_genome in set(location[0] for location in locations):
+        location_indices = [i for i, location in enumerate(locations) if location[0] == ref_genome]
+        closest_genes = GeneIndex.load(ref_genome).closest_genes(
+            [locations[i][1] for i in location_indices],
+            [locations[i][2] for i in location_indices],
+            [locations[i][3] for i in location_indices],
+        )
+        for i, closest_gene in zip(location_indices, closest_genes):
+            results[i] = closest_gene
+    return results
@@ -0,0 +1,120 @@
+from typing import Callable, Iterator, Optional, TextIO
+
+import numpy as np
+
+# Roughly how many characters of a file are parsed at a time
+PARSE_BATCH_CHARS = 16 * 2**20
+
+
+class ColumnBatch:
+    """
+    A batch of lines from a tab separated file, split into columns. Numeric columns are converted into NumPy
+    arrays all at once instead of one value at a time.
+    """
+
+    def __init__(self, header: list[str], fields: list[str], first_line: int):
+        self.header = header
+        self.fields = fields
+        self.first_line = first_line
+        self.row_count = len(fields) // len(header)
+        self._columns = {name: i for i, name in enumerate(header)}
+
+    def __len__(self):
+        return self.row_count
+
+    def __contains__(self, name: str):
+        return name in self._columns
+
+    def column(self, name: str) -> list[str]:
+        if name not in self._columns:
+            raise ValueError(f"Missing column '{name}'")
+
+        return self.fields[self._columns[name] :: len(self.header)]
+
+    def _invalid_value(self, name: str, values: list[str], convert: Callable) -> ValueError:
+        # Only used once a column is known to be invalid, to find the line it's invalid on
+        for i, value in enumerate(values):
+            try:
+                convert(value)
+            except ValueError:
+                return ValueError(f"Invalid {name} on line {self.first_line + i}: '{value}'")
+        return ValueError(f"Invalid {name}")
+
+    def int_column(self, name: str, skip: Optional[np.ndarray] = None) -> np.ndarray:
+        """The values of rows where skip is True, if it's given, aren't read and are 0."""
+        values = self.column(name)
+        if skip is not None:
+            values = ["0" if skipped else value for skipped, value in zip(skip.tolist(), values)]
+        try:
+            return np.array(values, dtype=np.int64)
+        except (ValueError, OverflowError) as e:
+            raise self._invalid_value(name, values, int) from e
+
+    def float_column(self, name: str, missing_ok=False) -> np.ndarray:
+        """If missing_ok is True, values that aren't numbers are NaN instead of being invalid."""
+        values = self.column(name)
+        try:
+            return np.array(values, dtype=np.float64)
+        except ValueError as e:
+            if not missing_ok:
+                raise self._invalid_value(name, values, float) from e
+
+        return np.array([_float_or_nan(value) for value in values], dtype=np.float64)
+
+
+def _float_or_nan(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def _pad_lines(text: str, column_count: int, first_line: int) -> list[str]:
+    # Like csv.DictReader, lines missing values at the end are read as if those values were empty, and blank
+    # lines are skipped
+    fields = []
+    for i, line in enumerate(text.split("\n")):
+        if line == "":
+            continue
+
+        line_fields = line.split("\t")
+        if len(line_fields) > column_count:
+            raise ValueError(f"Line {first_line + i} has {len(line_fields)} columns, but the header has {column_count}")
+        fields.extend(line_fields)
+        fields.extend([""] * (column_count - len(line_fields)))
+    return fields
+
+
+def read_column_batches(file: TextIO, batch_chars: int = PARSE_BATCH_CHARS) -> Iterator[ColumnBatch]:
+    """
+    Read a tab separated file, with a header line, in batches of whole lines. Unlike csv.DictReader, lines
+    with more values than there are columns are invalid.
+    """
+    header = file.readline().rstrip("\r\n").split("\t")
+    line_number = 2
+
+    while True:
+        text = file.read(batch_chars)
+        if text == "":
+            return
+
+        if not text.endswith("\n"):
+            text += file.readline()
+
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+
+        # Blank lines are skipped, like they are by csv.DictReader
+        stripped_text = text.strip("\n")
+        line_number += len(text) - len(text.lstrip("\n"))
+        text = stripped_text
+        if text == "":
+            continue
+
+        line_count = text.count("\n") + 1
+        fields = text.replace("\n", "\t").split("\t")
+        if len(fields) != line_count * len(header):
+            fields = _pad_lines(text, len(header), line_number)
+
+        yield ColumnBatch(header, fields, line_number)
+        line_number += line_count
@@ -1,34 +1,219 @@
+import io
 import logging
+import multiprocessing
+import os
 import os.path
+import shutil
 import tarfile
 import tempfile
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from typing import BinaryIO, Callable, Iterable, Optional, TextIO
 
-from .analysis import Analysis
+import django
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connection
+
+from cegs_portal.task_status.models import TaskStatus
+
+from .analysis import Analysis, parse_observations_file, parse_observations_stream
 from .experiment import Experiment
-from .metadata import AnalysisMetadata, ExperimentMetadata
+from .metadata import AnalysisMetadata, ExperimentMetadata, InternetFile
+from .streams import ChunkStream, file_chunks, text_stream
+
+EXPERIMENT_FILENAME = "experiment.json"
+TESTED_ELEMENTS_FILENAME = "tested_elements.tsv"
+# Uploads made before archives could hold several analyses always named their observations file this
+DEFAULT_OBSERVATIONS_FILENAME = "observations.tsv"
 
 logger = logging.getLogger(__name__)
 
 
-def load(compressed_file, experiment_accession_id):
-    with tarfile.open(fileobj=compressed_file, mode="r:gz") as data_files, tempfile.TemporaryDirectory() as dir_name:
-        logger.info(f"{experiment_accession_id}: Extracting compressed file")
-        data_files.extractall(dir_name)
+@dataclass
+class ArchiveAnalysis:
+    name: str
+    analysis: Analysis
+    parsed_filename: str
+    observation_count: Optional[int] = None
+    # Observations read before the analysis's metadata are parsed in a worker process
+    parsed: Optional[Future] = None
 
-        experiment_filename = os.path.join(dir_name, "experiment.json")
-        expr_data_filename = os.path.join(dir_name, "tested_elements.tsv")
-        analysis_filename = os.path.join(dir_name, "analysis001.json")
-        analysis_data_filename = os.path.join(dir_name, "observations.tsv")
 
-        logger.info(f"{experiment_accession_id}: Loading experiment")
-        metadata = ExperimentMetadata.load(experiment_filename, experiment_accession_id)
-        metadata.db_save()
-        Experiment(metadata).add_file_data_source(expr_data_filename).load().save()
+def stage(task_status: Optional[TaskStatus], name: str):
+    return task_status.stage(name) if task_status is not None else nullcontext()
+
+
+def _unparsed_analysis(analyses: Iterable[ArchiveAnalysis], data_filename: str) -> Optional[ArchiveAnalysis]:
+    for analysis in analyses:
+        if analysis.observation_count is None and analysis.analysis.metadata.results.filename == data_filename:
+            return analysis
+    return None
+
+
+def _member_text(member_file: BinaryIO) -> TextIO:
+    # Files read from a tar stream can't be wrapped in a TextIOWrapper directly, since they raise an
+    # AttributeError when asked if they're seekable
+    return text_stream(io.BufferedReader(ChunkStream(file_chunks(member_file)), settings.UPLOAD_STREAM_CHUNK_SIZE))
 
-        logger.info(f"{experiment_accession_id}: Loading analysis")
-        metadata = AnalysisMetadata.load(analysis_filename, experiment_accession_id)
+
+def _spool(member_file: BinaryIO, dir_name: str, file_number: int) -> str:
+    spooled_filename = os.path.join(dir_name, f"spooled{file_number}")
+    with open(spooled_filename, "wb") as spooled_file:
+        shutil.copyfileobj(member_file, spooled_file, settings.UPLOAD_STREAM_CHUNK_SIZE)
+    return spooled_filename
+
+
+def _load_experiment(
+    metadata: ExperimentMetadata,
+    tested_elements: str | TextIO,
+    experiment_accession_id: str,
+    task_status: Optional[TaskStatus],
+):
+    logger.info(f"{experiment_accession_id}: Loading experiment")
+    with stage(task_status, "Load experiment"):
         metadata.db_save()
-        analysis = Analysis(metadata).add_file_data_source(analysis_data_filename).load().save()
+        Experiment(metadata).add_file_data_source(tested_elements).load().save()
+
+
+def _post_load(analysis_loaded: Callable[[str], None], analysis_accession_id: str):
+    try:
+        analysis_loaded(analysis_accession_id)
+    finally:
+        # Runs in its own thread, which has its own database connection
+        connection.close()
+
+
+def load(
+    compressed_file: str | UploadedFile,
+    experiment_accession_id,
+    task_status: Optional[TaskStatus] = None,
+    analysis_loaded: Optional[Callable[[str], None]] = None,
+) -> list[str]:
+    """
+    Load an archive with an experiment and any number of analyses (analysis001.json, analysis002.json, ...).
+
+    The archive is read as a stream, one file at a time. Each tested elements or observations file that comes
+    after its metadata file is loaded or parsed as it's read. The other data files are written to a temporary
+    directory and the analyses' observations are parsed in parallel, in worker processes, once the whole archive
+    is read. Analyses are then saved one at a time, in name order. Once an analysis is saved, analysis_loaded is
+    called with its accession id in a separate thread, so later stages for that analysis (e.g., generating
+    coverage) run while the next analysis is saved.
+
+    Returns the accession ids of the loaded analyses.
+    """
+    experiment_metadata = None
+    experiment_loaded = False
+    analyses: dict[str, ArchiveAnalysis] = {}
+    # Data files that were read before their metadata, by name
+    spooled_files: dict[str, str] = {}
+
+    with (
+        InternetFile(compressed_file, binary=True).file as archive_file,
+        tarfile.open(fileobj=archive_file, mode="r|") as data_files,
+        tempfile.TemporaryDirectory() as dir_name,
+        ProcessPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=django.setup,
+        ) as parsers,
+        ThreadPoolExecutor(max_workers=1) as post_load,
+    ):
+        logger.info(f"{experiment_accession_id}: Reading compressed file")
+        for member in data_files:
+            if not member.isfile():
+                continue
+
+            name = os.path.normpath(member.name)
+            member_file = data_files.extractfile(member)
+            if name == EXPERIMENT_FILENAME:
+                experiment_metadata = ExperimentMetadata.load(member_file, experiment_accession_id)
+            elif os.path.dirname(name) == "" and fnmatch(name, "analysis*.json"):
+                analyses[name] = ArchiveAnalysis(
+                    name,
+                    Analysis(AnalysisMetadata.load(member_file, experiment_accession_id)),
+                    os.path.join(dir_name, f"{name}.parsed"),
+                )
+            elif name == TESTED_ELEMENTS_FILENAME and experiment_metadata is not None:
+                _load_experiment(experiment_metadata, _member_text(member_file), experiment_accession_id, task_status)
+                experiment_loaded = True
+            elif (analysis := _unparsed_analysis(analyses.values(), name)) is not None:
+                logger.info(f"{experiment_accession_id}: Parsing {analysis.name}")
+                with stage(task_status, f"Parse {analysis.name}") as parse_stage:
+                    analysis.observation_count = parse_observations_stream(
+                        _member_text(member_file),
+                        analysis.analysis.metadata.source_type,
+                        set(analysis.analysis.categorical_facet_values),
+                        analysis.parsed_filename,
+                    )
+                    if parse_stage is not None:
+                        parse_stage.row_count = analysis.observation_count
+            else:
+                spooled_files[name] = _spool(member_file, dir_name, len(spooled_files))
+
+        if experiment_metadata is None:
+            raise ValueError(f"No {EXPERIMENT_FILENAME} found in upload")
+
+        if not experiment_loaded:
+            if TESTED_ELEMENTS_FILENAME not in spooled_files:
+                raise ValueError(f"No {TESTED_ELEMENTS_FILENAME} found in upload")
+            _load_experiment(
+                experiment_metadata,
+                spooled_files[TESTED_ELEMENTS_FILENAME],
+                experiment_accession_id,
+                task_status,
+            )
+
+        if len(analyses) == 0:
+            raise ValueError("No analyses found in upload")
+
+        analyses = [analyses[name] for name in sorted(analyses)]
+        for analysis in analyses:
+            if analysis.observation_count is not None:
+                continue
+
+            metadata = analysis.analysis.metadata
+            data_filename = spooled_files.get(
+                metadata.results.filename, spooled_files.get(DEFAULT_OBSERVATIONS_FILENAME)
+            )
+            if data_filename is None:
+                raise ValueError(f"{analysis.name}: {metadata.results.filename} not found in upload")
+
+            logger.info(f"{experiment_accession_id}: Parsing {analysis.name}")
+            analysis.parsed = parsers.submit(
+                parse_observations_file,
+                data_filename,
+                metadata.source_type,
+                set(analysis.analysis.categorical_facet_values),
+                analysis.parsed_filename,
+            )
+            if task_status is not None:
+                task_status.stage(f"Parse {analysis.name}").start()
+
+        analysis_accession_ids = []
+        post_loads = []
+        for analysis in analyses:
+            if analysis.parsed is not None:
+                with stage(task_status, f"Parse {analysis.name}") as parse_stage:
+                    analysis.observation_count = analysis.parsed.result()
+                    if parse_stage is not None:
+                        parse_stage.row_count = analysis.observation_count
+
+            logger.info(f"{experiment_accession_id}: Loading {analysis.name}")
+            with stage(task_status, f"Load {analysis.name}") as load_stage:
+                analysis.analysis.metadata.db_save()
+                analysis.analysis.load_parsed(analysis.parsed_filename).save()
+                if load_stage is not None:
+                    load_stage.row_count = analysis.observation_count
+            analysis_accession_ids.append(analysis.analysis.accession_id)
+
+            if analysis_loaded is not None:
+                post_loads.append(post_load.submit(_post_load, analysis_loaded, analysis.analysis.accession_id))
+
+        for post_loaded in post_loads:
+            post_loaded.result()
 
         logger.info(f"{experiment_accession_id}: Finished loading data")
-        return analysis.accession_id
+        return analysis_accession_ids
@@ -1,13 +1,217 @@
 import json
 import logging
-from io import StringIO
+import struct
+from functools import partial
 from os import SEEK_SET
-from typing import Optional
+from tempfile import SpooledTemporaryFile
+from typing import Any, Iterable, Optional, Union
 
+from django.conf import settings
 from django.db import connection, transaction
+from psycopg import Copy, postgres
+from psycopg.adapt import Dumper
+from psycopg.copy import FileWriter
+from psycopg.pq import Format
+from psycopg.types.range import Int4Range, dump_range_binary
 
 logger = logging.getLogger(__name__)
 
+# How much COPY data (in characters) is sent to the database at a time
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# How much COPY data is kept in memory before it's written to a temporary file
+COPY_SPOOL_MAX_MEMORY = 32 * 1024 * 1024
+
+# The columns, and their postgres types, of each table loaded with COPY. The types are only needed
+# for binary COPY, which sends each value in postgres's own binary representation.
+REO_COLUMNS = [
+    ("id", "int8"),
+    ("name", "text"),
+    ("accession_id", "text"),
+    ("experiment_id", "int8"),
+    ("experiment_accession_id", "text"),
+    ("analysis_accession_id", "text"),
+    ("facet_num_values", "jsonb"),
+    ("archived", "bool"),
+    ("public", "bool"),
+]
+REO_FACET_COLUMNS = [("regulatoryeffectobservation_id", "int8"), ("facetvalue_id", "int8")]
+REO_SOURCE_COLUMNS = [("regulatoryeffectobservation_id", "int8"), ("dnafeature_id", "int8")]
+REO_TARGET_COLUMNS = [("regulatoryeffectobservation_id", "int8"), ("dnafeature_id", "int8")]
+FEATURE_COLUMNS = [
+    ("id", "int8"),
+    ("accession_id", "text"),
+    ("ids", "jsonb"),
+    ("ensembl_id", "text"),
+    ("name", "text"),
+    ("cell_line", "text"),
+    ("chrom_name", "text"),
+    ("closest_gene_id", "int8"),
+    ("closest_gene_distance", "int4"),
+    ("closest_gene_name", "text"),
+    ("closest_gene_ensembl_id", "text"),
+    ("location", "int4range"),
+    ("strand", "text"),
+    ("ref_genome", "text"),
+    ("ref_genome_patch", "text"),
+    ("feature_type", "text"),
+    ("feature_subtype", "text"),
+    ("source_file_id", "int8"),
+    ("experiment_accession_id", "text"),
+    ("parent_id", "int8"),
+    ("parent_accession_id", "text"),
+    ("misc", "jsonb"),
+    ("significant_reo", "bool"),
+    ("archived", "bool"),
+    ("public", "bool"),
+]
+FEATURE_FACET_COLUMNS = [("dnafeature_id", "int8"), ("facetvalue_id", "int8")]
+CCRE_ASSOCIATION_COLUMNS = [("from_dnafeature_id", "int8"), ("to_dnafeature_id", "int8")]
+
+_TEXT_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def text_value(value: Any) -> str:
+    """Format a value for text COPY"""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, str):
+        return value.translate(_TEXT_ESCAPES)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value).translate(_TEXT_ESCAPES)
+    return str(value)
+
+
+def text_row(row: tuple) -> str:
+    return "\t".join([text_value(value) for value in row]) + "\n"
+
+
+class CopySpool:
+    """
+    Collects rows of COPY data until they can be sent to the database.
+
+    Only one COPY can be in progress on a connection, and loading data requires other queries while the rows
+    are being generated, so rows can't be sent as they are created. Instead, they are kept in memory up
+    to a limit and then written to a temporary file. They are sent to the database in fixed-size chunks
+    so the data is never all in memory at once.
+    """
+
+    copy_options = ""
+
+    def __init__(self, column_types: Optional[list[str]] = None, max_memory: int = COPY_SPOOL_MAX_MEMORY):
+        self.file = SpooledTemporaryFile(max_size=max_memory, mode="w+", encoding="utf-8", newline="")
+        self.row_count = 0
+
+    def write(self, data: str):
+        self.file.write(data)
+        self.row_count += data.count("\n")
+
+    def write_row(self, row: tuple):
+        self.file.write(text_row(row))
+        self.row_count += 1
+
+    def copy_to(self, copy, chunk_size: int = COPY_CHUNK_SIZE):
+        self.file.seek(0, SEEK_SET)
+        while chunk := self.file.read(chunk_size):
+            copy.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class BinaryCopySpool(CopySpool):
+    """
+    A CopySpool for binary COPY.
+
+    Rows are written with a psycopg Copy whose writer is the spool's file rather than the database, so each
+    row is converted to its binary representation, based on the column types, as it's written. The file
+    holds a complete binary COPY, which is sent to the database as is. This skips formatting each row as
+    text, and skips the server parsing that text back into ranges, JSON, etc.
+    """
+
+    copy_options = " (FORMAT BINARY)"
+
+    def __init__(self, column_types: list[str], max_memory: int = COPY_SPOOL_MAX_MEMORY):
+        self.file = SpooledTemporaryFile(max_size=max_memory, mode="w+b")
+        self.row_count = 0
+
+        # The Copy only uses the connection's adapters to dump values. It never sends anything to the database.
+        connection.ensure_connection()
+        self.cursor = connection.connection.cursor()
+        self.cursor.adapters.register_dumper(Int4Range, Int4RangeBinaryDumper)
+        self.copy = Copy(self.cursor, binary=True, writer=FileWriter(self.file))
+        self.copy.set_types(column_types)
+        self.finished = False
+
+    def write(self, data: str):
+        raise TypeError("Binary COPY data must be written with write_row")
+
+    def write_row(self, row: tuple):
+        self.copy.write_row(row)
+        self.row_count += 1
+
+    def copy_to(self, copy, chunk_size: int = COPY_CHUNK_SIZE):
+        if not self.finished:
+            # Writes the binary COPY trailer
+            self.copy.finish(None)
+            self.finished = True
+        self.file.seek(0, SEEK_SET)
+        while chunk := self.file.read(chunk_size):
+            copy.write(chunk)
+
+    def close(self):
+        self.cursor.close()
+        self.file.close()
+
+
+class Int4RangeBinaryDumper(Dumper):
+    """
+    Dumps Int4Ranges with int4 bounds. psycopg's own binary int4range dumper dumps each bound with the smallest
+    int type that fits it, so, e.g., [1,5) is sent with int2 bounds, which postgres rejects.
+    """
+
+    format = Format.BINARY
+    oid = postgres.types["int4range"].oid
+
+    _pack_int4 = struct.Struct("!i").pack
+
+    def dump(self, obj: Int4Range) -> bytes:
+        return bytes(dump_range_binary(obj, self._pack_int4))
+
+
+COPY_SPOOLS = {"text": CopySpool, "binary": BinaryCopySpool}
+
+
+def copy_spool(columns: list[tuple[str, str]]) -> Union[CopySpool, BinaryCopySpool]:
+    """A spool for COPY data for columns, in the format set by settings.UPLOAD_COPY_FORMAT"""
+    return COPY_SPOOLS[settings.UPLOAD_COPY_FORMAT]([column_type for _, column_type in columns])
+
+
+def copy_rows(cursor, table: str, columns: list[tuple[str, str]], rows: CopySpool):
+    """
+    COPY rows into table. After loads of at least settings.UPLOAD_ANALYZE_ROWS rows, table is analyzed once the
+    transaction commits, so queries on it are planned with statistics that include the new rows.
+    """
+    column_names = ", ".join(name for name, _ in columns)
+    with cursor.copy(f"COPY {table} ({column_names}) FROM STDIN{rows.copy_options}") as copy:
+        rows.copy_to(copy)
+
+    if rows.row_count >= settings.UPLOAD_ANALYZE_ROWS:
+        transaction.on_commit(partial(analyze, table))
+
+
+def analyze(table: str):
+    with connection.cursor() as cursor:
+        logger.info(f"Analyzing {table}")
+        cursor.execute(f"ANALYZE {table}")
+
 
 def reo_entry(
     id_,
@@ -17,61 +221,43 @@ def reo_entry(
     experiment_accession_id,
     analysis_accession_id,
     facet_num_values=None,
-    archived="false",
-    public="true",
+    archived=False,
+    public=True,
 ):
-    name = "\\N" if name is None else name
-    facet_num_values = "\\N" if facet_num_values is None else json.dumps(facet_num_values)
-    return f"{id_}\t{name}\t{accession_id}\t{experiment_id}\t{experiment_accession_id}\t{analysis_accession_id}\t{facet_num_values}\t{archived}\t{public}\n"
+    return (
+        id_,
+        name,
+        accession_id,
+        experiment_id,
+        experiment_accession_id,
+        analysis_accession_id,
+        facet_num_values,
+        archived,
+        public,
+    )
 
 
 def bulk_reo_save(
-    effects: StringIO,
-    categorical_facets: StringIO,
-    source_associations: StringIO,
-    target_associations: Optional[StringIO] = None,
+    effects: CopySpool,
+    categorical_facets: CopySpool,
+    source_associations: CopySpool,
+    target_associations: Optional[CopySpool] = None,
 ):
     with transaction.atomic(), connection.cursor() as cursor:
-        effects.seek(0, SEEK_SET)
         logger.info("Adding RegulatoryEffectObservations")
-        with cursor.copy(
-            """COPY search_regulatoryeffectobservation (
-                id,
-                name,
-                accession_id,
-                experiment_id,
-                experiment_accession_id,
-                analysis_accession_id,
-                facet_num_values,
-                archived,
-                public
-            ) FROM STDIN"""
-        ) as copy:
-            copy.write(effects.getvalue())
+        copy_rows(cursor, "search_regulatoryeffectobservation", REO_COLUMNS, effects)
 
     with transaction.atomic(), connection.cursor() as cursor:
-        categorical_facets.seek(0, SEEK_SET)
         logger.info("Adding categorical facets to effects")
-        with cursor.copy(
-            "COPY search_regulatoryeffectobservation_facet_values (regulatoryeffectobservation_id, facetvalue_id) FROM STDIN"
-        ) as copy:
-            copy.write(categorical_facets.getvalue())
+        copy_rows(cursor, "search_regulatoryeffectobservation_facet_values", REO_FACET_COLUMNS, categorical_facets)
 
     with transaction.atomic(), connection.cursor() as cursor:
-        source_associations.seek(0, SEEK_SET)
         logger.info("Adding sources to RegulatoryEffectObservations")
-        with cursor.copy(
-            "COPY search_regulatoryeffectobservation_sources (regulatoryeffectobservation_id, dnafeature_id) FROM STDIN"
-        ) as copy:
-            copy.write(source_associations.getvalue())
+        copy_rows(cursor, "search_regulatoryeffectobservation_sources", REO_SOURCE_COLUMNS, source_associations)
 
         if target_associations is not None:
-            target_associations.seek(0, SEEK_SET)
             logger.info("Adding targets to RegulatoryEffectObservations")
-            with cursor.copy(
-                "COPY search_regulatoryeffectobservation_targets (regulatoryeffectobservation_id, dnafeature_id) FROM STDIN"
-            ) as copy:
-                copy.write(target_associations.getvalue())
+            copy_rows(cursor, "search_regulatoryeffectobservation_targets", REO_TARGET_COLUMNS, target_associations)
 
 
 def feature_entry(
@@ -82,103 +268,114 @@ def feature_entry(
     genome_assembly,
     feature_type,
     ids=None,
-    ensembl_id="\\N",
+    ensembl_id=None,
     name=None,
-    cell_line="\\N",
-    closest_gene_id="\\N",
-    closest_gene_distance="\\N",
-    closest_gene_name="\\N",
-    closest_gene_ensembl_id="\\N",
+    cell_line=None,
+    closest_gene_id=None,
+    closest_gene_distance=None,
+    closest_gene_name=None,
+    closest_gene_ensembl_id=None,
     genome_assembly_patch="0",
-    feature_subtype="\\N",
+    feature_subtype=None,
     strand=None,
     source_file_id=None,
-    experiment_accession_id="\\N",
+    experiment_accession_id=None,
     parent_id=None,
     parent_accession_id=None,
     misc=None,
-    archived="false",
-    public="true",
+    archived=False,
+    public=True,
 ):
-    ids = "\\N" if ids is None else json.dumps(ids)
-    name = "\\N" if name is None else name
-    misc = "\\N" if misc is None else json.dumps(misc)
-    strand = "\\N" if strand is None else strand
-    source_file_id = "\\N" if source_file_id is None else source_file_id
-    parent_id = "\\N" if parent_id is None else parent_id
-    parent_accession_id = "\\N" if parent_accession_id is None else parent_accession_id
-    return f"{id_}\t{accession_id}\t{ids}\t{ensembl_id}\t{name}\t{cell_line}\t{chrom_name}\t{closest_gene_id}\t{closest_gene_distance}\t{closest_gene_name}\t{closest_gene_ensembl_id}\t{location}\t{strand}\t{genome_assembly}\t{genome_assembly_patch}\t{feature_type}\t{feature_subtype}\t{source_file_id}\t{experiment_accession_id}\t{parent_id}\t{parent_accession_id}\t{misc}\tFALSE\t{archived}\t{public}\n"
+    return (
+        id_,
+        accession_id,
+        ids,
+        ensembl_id,
+        name,
+        cell_line,
+        chrom_name,
+        closest_gene_id,
+        closest_gene_distance,
+        closest_gene_name,
+        closest_gene_ensembl_id,
+        location,
+        strand,
+        str(genome_assembly),
+        genome_assembly_patch,
+        # Feature types are stored as, e.g., "DNAFeatureType.CCRE"
+        str(feature_type),
+        feature_subtype,
+        source_file_id,
+        experiment_accession_id,
+        parent_id,
+        parent_accession_id,
+        misc,
+        False,
+        archived,
+        public,
+    )
 
 
 def feature_facet_entry(feature_id, facet_id):
-    return f"{feature_id}\t{facet_id}\n"
+    return (feature_id, facet_id)
 
 
 def source_entry(reo_id, source_id):
-    return f"{reo_id}\t{source_id}\n"
+    return (reo_id, source_id)
 
 
 def target_entry(reo_id, target_id):
-    return f"{reo_id}\t{target_id}\n"
+    return (reo_id, target_id)
 
 
 def cat_facet_entry(reo_id, facet_id):
-    return f"{reo_id}\t{facet_id}\n"
+    return (reo_id, facet_id)
 
 
 def ccre_associate_entry(feature_id, ccre_id):
-    return f"{feature_id}\t{ccre_id}\n"
+    return (feature_id, ccre_id)
 
 
-def bulk_feature_save(features: StringIO):
-    features.seek(0, SEEK_SET)
+def bulk_feature_save(features: CopySpool):
     logger.info("Adding features")
     with transaction.atomic(), connection.cursor() as cursor:
-        with cursor.copy(
-            """COPY search_dnafeature (
-                id,
-                accession_id,
-                ids,
-                ensembl_id,
-                name,
-                cell_line,
-                chrom_name,
-                closest_gene_id,
-                closest_gene_distance,
-                closest_gene_name,
-                closest_gene_ensembl_id,
-                location,
-                strand,
-                ref_genome,
-                ref_genome_patch,
-                feature_type,
-                feature_subtype,
-                source_file_id,
-                experiment_accession_id,
-                parent_id,
-                parent_accession_id,
-                misc,
-                significant_reo,
-                archived,
-                public
-            ) FROM STDIN"""
-        ) as copy:
-            copy.write(features.getvalue())
-
-
-def bulk_feature_facet_save(facets):
+        copy_rows(cursor, "search_dnafeature", FEATURE_COLUMNS, features)
+
+
+def bulk_feature_facet_save(facets: CopySpool):
     with transaction.atomic(), connection.cursor() as cursor:
-        facets.seek(0, SEEK_SET)
         logger.info("Adding facets to features")
-        with cursor.copy("COPY search_dnafeature_facet_values (dnafeature_id, facetvalue_id) FROM STDIN") as copy:
-            copy.write(facets.getvalue())
+        copy_rows(cursor, "search_dnafeature_facet_values", FEATURE_FACET_COLUMNS, facets)
 
 
-def bulk_save_associations(associations):
-    associations.seek(0, SEEK_SET)
+def bulk_save_associations(associations: CopySpool):
     logger.info("Adding ccre associations to features")
     with transaction.atomic(), connection.cursor() as cursor:
-        with cursor.copy(
-            "COPY search_dnafeature_associated_ccres (from_dnafeature_id, to_dnafeature_id) FROM STDIN"
-        ) as copy:
-            copy.write(associations.getvalue())
+        copy_rows(cursor, "search_dnafeature_associated_ccres", CCRE_ASSOCIATION_COLUMNS, associations)
+
+
+def bulk_source_flag_save(significant_feature_ids: Iterable[int], feature_facets: dict[int, set[int]]):
+    """
+    Flag the features that are the sources of significant REOs and add facets (e.g., REO directions) to
+    features, skipping any facets the features already have.
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        logger.info("Flagging source features")
+        cursor.execute(
+            "UPDATE search_dnafeature SET significant_reo = true WHERE id = ANY(%s) AND NOT significant_reo",
+            [list(significant_feature_ids)],
+        )
+
+        cursor.execute(
+            "SELECT dnafeature_id, facetvalue_id FROM search_dnafeature_facet_values WHERE dnafeature_id = ANY(%s)",
+            [list(feature_facets)],
+        )
+        existing_facets = set(cursor.fetchall())
+
+        logger.info("Adding facets to source features")
+        with copy_spool(FEATURE_FACET_COLUMNS) as facets:
+            for feature_id, facet_ids in feature_facets.items():
+                for facet_id in sorted(facet_ids):
+                    if (feature_id, facet_id) not in existing_facets:
+                        facets.write_row(feature_facet_entry(feature_id, facet_id))
+            copy_rows(cursor, "search_dnafeature_facet_values", FEATURE_FACET_COLUMNS, facets)
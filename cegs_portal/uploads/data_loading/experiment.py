@@ -1,11 +1,12 @@
 import csv
 from dataclasses import dataclass, field
 from enum import Enum
-from io import StringIO
-from itertools import tee
-from typing import Any, Optional
+from itertools import repeat, tee
+from typing import Any, Iterable, Optional
 
-from django.db import transaction
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
 from django.db.models import F, Func
 from psycopg.types.range import Int4Range
 
@@ -19,12 +20,17 @@ from cegs_portal.search.models import (
 )
 from cegs_portal.utils.db_ids import FeatureIds
 
-from .closest_gene import get_closest_gene
+from .closest_gene import get_closest_genes
+from .columnar import ColumnBatch, read_column_batches
 from .db import (
+    CCRE_ASSOCIATION_COLUMNS,
+    FEATURE_COLUMNS,
+    FEATURE_FACET_COLUMNS,
     bulk_feature_facet_save,
     bulk_feature_save,
     bulk_save_associations,
     ccre_associate_entry,
+    copy_spool,
     feature_entry,
     feature_facet_entry,
 )
@@ -57,6 +63,86 @@ class FeatureRow:
             self.strand = None
 
 
+def _parse_facets(facets: Optional[str]) -> list[list[str]]:
+    return [f.split("=") for f in facets.split(";")] if facets != "" and facets is not None else []
+
+
+def _parse_misc(misc: Optional[str]) -> dict[str, str]:
+    return {k: v for k, v in [f.split("=") for f in misc.split(";")]} if misc != "" and misc is not None else {}
+
+
+def parse_tested_elements(lines: Iterable[dict[str, str]]):
+    """
+    Parse lines of a tested elements file, as read by csv.DictReader, into
+    (element location, parent location, categorical facets, misc) tuples. The parent location is None if the
+    element has no parent.
+    """
+    for line in lines:
+        parent_chrom, parent_start, parent_end, parent_strand = (
+            line["parent_chrom"],
+            line["parent_start"],
+            line["parent_end"],
+            line["parent_strand"],
+        )
+
+        if (parent_chrom == parent_start == parent_end == parent_strand) and (
+            parent_chrom is None or parent_chrom == ""
+        ):
+            parent = None
+        else:
+            parent = (parent_chrom, int(parent_start), int(parent_end), parent_strand)
+
+        element = (line["chrom"], int(line["start"]), int(line["end"]), line["strand"])
+
+        yield element, parent, _parse_facets(line["facets"]), _parse_misc(line["misc"])
+
+
+def parse_tested_element_columns(batches: Iterable[ColumnBatch]):
+    """
+    The same as parse_tested_elements, but for a tested elements file read by read_column_batches. The
+    numeric columns of each batch are converted together, and each distinct facets and misc string is only
+    parsed once.
+    """
+    for batch in batches:
+        starts = batch.int_column("start").tolist()
+        ends = batch.int_column("end").tolist()
+
+        parent_chroms = batch.column("parent_chrom")
+        parent_starts = batch.column("parent_start")
+        parent_ends = batch.column("parent_end")
+        parent_strands = batch.column("parent_strand")
+        # Elements without parents have all of their parent columns empty
+        no_parent = (
+            (np.array(parent_chroms) == "")
+            & (np.array(parent_starts) == "")
+            & (np.array(parent_ends) == "")
+            & (np.array(parent_strands) == "")
+        )
+        if no_parent.all():
+            parents = repeat(None)
+        else:
+            parent_locations = zip(
+                parent_chroms,
+                batch.int_column("parent_start", skip=no_parent).tolist(),
+                batch.int_column("parent_end", skip=no_parent).tolist(),
+                parent_strands,
+            )
+            parents = (
+                None if without_parent else location for without_parent, location in zip(no_parent, parent_locations)
+            )
+
+        facets_column = batch.column("facets")
+        misc_column = batch.column("misc")
+        batch_facets = {facets: _parse_facets(facets) for facets in set(facets_column)}
+        batch_misc = {misc: _parse_misc(misc) for misc in set(misc_column)}
+
+        for chrom, start, end, strand, parent, facets, misc in zip(
+            batch.column("chrom"), starts, ends, batch.column("strand"), parents, facets_column, misc_column
+        ):
+            # Each feature gets its own misc dictionary, since they're saved separately
+            yield (chrom, start, end, strand), parent, batch_facets[facets], dict(batch_misc[misc])
+
+
 class FeatureOverlap(Enum):
     BEFORE = 1
     OVERLAP = 2
@@ -127,6 +213,63 @@ def get_ccres(genome_assembly) -> list[tuple[int, str, Int4Range]]:
     )
 
 
+def get_ccre_overlaps(features: list[CCREFeature], genome_assembly) -> dict[int, list[int]]:
+    """
+    The ids of the cCREs that overlap each feature, keyed by feature id.
+
+    The features are copied into a temporary table and joined against the cCREs in the database, so
+    the sdf_loc_index GiST index is used and only the overlapping cCREs are read.
+    """
+    assert GenomeAssembly(genome_assembly)
+
+    overlaps = {}
+    # The table is dropped when the transaction ends, so an error doesn't leave it behind. It can already exist
+    # when this is called more than once in a transaction.
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            """CREATE TEMPORARY TABLE IF NOT EXISTS upload_ccre_features (id bigint, chrom_name text, location int4range)
+            ON COMMIT DROP"""
+        )
+        cursor.execute("TRUNCATE upload_ccre_features")
+        with cursor.copy("COPY upload_ccre_features (id, chrom_name, location) FROM STDIN") as copy:
+            for feature in features:
+                copy.write_row((feature._id, feature.chrom_name, feature.location))
+        cursor.execute("ANALYZE upload_ccre_features")
+
+        cursor.execute(
+            """SELECT f.id, c.id
+            FROM upload_ccre_features AS f
+            JOIN search_dnafeature AS c ON c.location && f.location AND c.chrom_name = f.chrom_name
+            WHERE c.feature_type = 'DNAFeatureType.CCRE' AND c.ref_genome = %s
+            ORDER BY f.id, lower(c.location), upper(c.location)""",
+            [genome_assembly],
+        )
+        for feature_id, ccre_id in cursor:
+            overlaps.setdefault(feature_id, []).append(ccre_id)
+
+    return overlaps
+
+
+def pseudo_ccre_entry(feature: CCREFeature, ccre_id: int, accession_ids):
+    return feature_entry(
+        id_=ccre_id,
+        accession_id=accession_ids.incr(AccessionType.CCRE),
+        cell_line=feature.cell_line,
+        chrom_name=feature.chrom_name,
+        closest_gene_id=feature.closest_gene_id,
+        closest_gene_distance=feature.closest_gene_distance,
+        closest_gene_name=feature.closest_gene_name,
+        closest_gene_ensembl_id=feature.closest_gene_ensembl_id,
+        location=feature.location,
+        genome_assembly=feature.genome_assembly,
+        genome_assembly_patch=feature.genome_assembly_patch,
+        misc=feature.misc,
+        feature_type=DNAFeatureType.CCRE,
+        source_file_id=feature.source_file_id,
+        experiment_accession_id=feature.experiment_accession_id,
+    )
+
+
 class Experiment:
     metadata: ExperimentMetadata
     features: Optional[list[FeatureRow]] = None
@@ -153,9 +296,11 @@ class Experiment:
     def add_file_data_source(self, elements_file_location):
         def _ds():
             elements_tsv = InternetFile(elements_file_location).file
-            reader = csv.DictReader(elements_tsv, delimiter="\t", quoting=csv.QUOTE_NONE)
-            for line in reader:
-                yield line
+            if settings.UPLOAD_COLUMNAR_PARSE:
+                yield from parse_tested_element_columns(read_column_batches(elements_tsv))
+            else:
+                reader = csv.DictReader(elements_tsv, delimiter="\t", quoting=csv.QUOTE_NONE)
+                yield from parse_tested_elements(reader)
             elements_tsv.close()
 
         self.data_source = _ds
@@ -165,8 +310,7 @@ class Experiment:
     def add_generator_data_source(self, generator):
         def _ds():
             [new_gen] = tee(generator, 1)
-            for line in new_gen:
-                yield line
+            yield from parse_tested_elements(new_gen)
 
         self.data_source = _ds
         return self
@@ -176,29 +320,21 @@ class Experiment:
 
         elements_file = self.metadata.tested_elements_metadata
 
-        source_type = self.metadata.source_type
+        feature_type = FeatureType(self.metadata.source_type)
         parent_source_type = self.metadata.parent_source_type
+        parent_feature_type = FeatureType(parent_source_type) if parent_source_type is not None else None
 
-        genome_assembly = elements_file.genome_assembly
+        genome_assembly = GenomeAssembly(elements_file.genome_assembly)
         elements_cell_line = self.metadata.biosamples[0].cell_line
 
         new_elements: dict[str, FeatureRow] = {}
         new_parent_elements: dict[str, FeatureRow] = {}
 
-        for line in self.data_source():
-            parent_chrom, parent_start, parent_end, parent_strand = (
-                line["parent_chrom"],
-                line["parent_start"],
-                line["parent_end"],
-                line["parent_strand"],
-            )
-
-            if (parent_chrom == parent_start == parent_end == parent_strand) and (
-                parent_chrom is None or parent_chrom == ""
-            ):
+        for element, parent, categorical_facets, misc in self.data_source():
+            if parent is None:
                 parent_row = None
             else:
-                parent_start, parent_end = int(parent_start), int(parent_end)
+                parent_chrom, parent_start, parent_end, parent_strand = parent
                 parent_name = f"{parent_chrom}:{parent_start}-{parent_end}:{parent_strand}"
 
                 if parent_name not in new_parent_elements:
@@ -207,40 +343,24 @@ class Experiment:
                         chrom_name=parent_chrom,
                         location=(parent_start, parent_end),
                         strand=parent_strand,
-                        genome_assembly=GenomeAssembly(genome_assembly),
+                        genome_assembly=genome_assembly,
                         cell_line=elements_cell_line,
-                        feature_type=FeatureType(parent_source_type) if parent_source_type is not None else None,
+                        feature_type=parent_feature_type,
                     )
 
                 parent_row = new_parent_elements[parent_name]
 
-            element_chrom, element_start, element_end, element_strand = (
-                line["chrom"],
-                int(line["start"]),
-                int(line["end"]),
-                line["strand"],
-            )
+            element_chrom, element_start, element_end, element_strand = element
             element_name = f"{element_chrom}:{element_start}-{element_end}:{element_strand}"
 
-            categorical_facets = (
-                [f.split("=") for f in line["facets"].split(";")]
-                if line["facets"] != "" and line["facets"] is not None
-                else []
-            )
-            misc = (
-                {k: v for k, v in [f.split("=") for f in line["misc"].split(";")]}
-                if line["misc"] != "" and line["misc"] is not None
-                else {}
-            )
-
             new_elements[element_name] = FeatureRow(
                 name=element_name,
                 chrom_name=element_chrom,
                 location=(element_start, element_end),
                 strand=element_strand,
-                genome_assembly=GenomeAssembly(genome_assembly),
+                genome_assembly=genome_assembly,
                 cell_line=elements_cell_line,
-                feature_type=FeatureType(source_type),
+                feature_type=feature_type,
                 facets=categorical_facets,
                 parent_name=parent_row.name if parent_row is not None else None,
                 misc=misc,
@@ -253,188 +373,197 @@ class Experiment:
 
     def _save_features(self, features, accession_ids, source_file_id, parents=None):
         experiment_accession_id = self.accession_id
-        feature_rows = StringIO()
-        feature_facets = StringIO()
+
+        features = list(features)
+        closest_genes = get_closest_genes(
+            [(feature.genome_assembly, feature.chrom_name, *feature.location) for feature in features]
+        )
 
         db_ids = {}
-        with FeatureIds() as feature_ids:
-            for feature, feature_id in zip(features, feature_ids):
-                feature_location = Int4Range(*feature.location)
-                closest_gene, distance, gene_name = get_closest_gene(
-                    feature.genome_assembly, feature.chrom_name, feature_location.lower, feature_location.upper
-                )
-                closest_gene_ensembl_id = closest_gene["ensembl_id"] if closest_gene is not None else None
-                accession_type = AccessionType.from_feature_type(feature.feature_type)
-                accession_id = accession_ids.incr(accession_type)
-
-                parent = parents.get(feature.parent_name) if parents is not None else None
-                if parent is not None:
-                    parent_id, parent_accession_id = (parent._id, parent.accession_id)
-                else:
-                    parent_id, parent_accession_id = (None, None)
-
-                db_ids[feature.name] = CCREFeature(
-                    _id=feature_id,
-                    accession_id=accession_id,
-                    chrom_name=feature.chrom_name,
-                    location=feature_location,
-                    cell_line=feature.cell_line,
-                    closest_gene_id=closest_gene["id"] if closest_gene is not None else None,
-                    closest_gene_distance=distance,
-                    closest_gene_name=gene_name,
-                    closest_gene_ensembl_id=closest_gene_ensembl_id,
-                    source_file_id=source_file_id,
-                    genome_assembly=feature.genome_assembly,
-                    experiment_accession_id=experiment_accession_id,
-                    feature_type=DNAFeatureType(feature.feature_type),
-                    parent=parent,
-                )
-
-                feature_rows.write(
-                    feature_entry(
-                        id_=feature_id,
-                        name=feature.name,
+        with copy_spool(FEATURE_COLUMNS) as feature_rows, copy_spool(FEATURE_FACET_COLUMNS) as feature_facets:
+            with FeatureIds() as feature_ids:
+                for feature, feature_id, closest in zip(features, feature_ids, closest_genes):
+                    feature_location = Int4Range(*feature.location)
+                    closest_gene, distance, gene_name = closest
+                    closest_gene_ensembl_id = closest_gene["ensembl_id"] if closest_gene is not None else None
+                    accession_type = AccessionType.from_feature_type(feature.feature_type)
+                    accession_id = accession_ids.incr(accession_type)
+
+                    parent = parents.get(feature.parent_name) if parents is not None else None
+                    if parent is not None:
+                        parent_id, parent_accession_id = (parent._id, parent.accession_id)
+                    else:
+                        parent_id, parent_accession_id = (None, None)
+
+                    db_ids[feature.name] = CCREFeature(
+                        _id=feature_id,
                         accession_id=accession_id,
-                        cell_line=feature.cell_line,
                         chrom_name=feature.chrom_name,
                         location=feature_location,
-                        strand=feature.strand,
+                        cell_line=feature.cell_line,
                         closest_gene_id=closest_gene["id"] if closest_gene is not None else None,
                         closest_gene_distance=distance,
                         closest_gene_name=gene_name,
                         closest_gene_ensembl_id=closest_gene_ensembl_id,
-                        genome_assembly=feature.genome_assembly,
-                        feature_type=DNAFeatureType(feature.feature_type),
                         source_file_id=source_file_id,
-                        parent_id=parent_id,
-                        parent_accession_id=parent_accession_id,
+                        genome_assembly=feature.genome_assembly,
                         experiment_accession_id=experiment_accession_id,
+                        feature_type=DNAFeatureType(feature.feature_type),
+                        parent=parent,
                     )
-                )
-                for _, facet_value in feature.facets:
-                    feature_facets.write(
-                        feature_facet_entry(feature_id=feature_id, facet_id=self.facet_values[facet_value].id)
+
+                    feature_rows.write_row(
+                        feature_entry(
+                            id_=feature_id,
+                            name=feature.name,
+                            accession_id=accession_id,
+                            cell_line=feature.cell_line,
+                            chrom_name=feature.chrom_name,
+                            location=feature_location,
+                            strand=feature.strand,
+                            closest_gene_id=closest_gene["id"] if closest_gene is not None else None,
+                            closest_gene_distance=distance,
+                            closest_gene_name=gene_name,
+                            closest_gene_ensembl_id=closest_gene_ensembl_id,
+                            genome_assembly=feature.genome_assembly,
+                            feature_type=DNAFeatureType(feature.feature_type),
+                            source_file_id=source_file_id,
+                            parent_id=parent_id,
+                            parent_accession_id=parent_accession_id,
+                            experiment_accession_id=experiment_accession_id,
+                        )
                     )
+                    for _, facet_value in feature.facets:
+                        feature_facets.write_row(
+                            feature_facet_entry(feature_id=feature_id, facet_id=self.facet_values[facet_value].id)
+                        )
 
-        bulk_feature_save(feature_rows)
-        bulk_feature_facet_save(feature_facets)
+            bulk_feature_save(feature_rows)
+            bulk_feature_facet_save(feature_facets)
         return db_ids
 
     def _save_ccres(self, features: list[CCREFeature], accession_ids, parent_ccre_assignments: dict[int:int] = None):
+        if settings.UPLOAD_CCRE_OVERLAP_IN_DB:
+            return self._save_ccres_in_db(features, accession_ids, parent_ccre_assignments)
+
         features.sort()
         ccres = get_ccres(self.metadata.tested_elements_metadata.genome_assembly)
-        new_ccres = StringIO()
-        ccre_associations = StringIO()
         features_with_associated_ccres: dict[int:int] = {}
 
         f_idx = 0  # features list index
         c_idx = 0  # ccre list index
-        with FeatureIds() as ccre_ids:
-            # To associate features with cCREs we need two lists -- The list of all current cCREs for a genome
-            # assembly and the the list of features. These two lists must be sorted, and must be sorted in the
-            # same manner.
-            #
-            # We work our way through both lists linearly, on each iteration moving forward on one or the other
-            # (but not both). Which list we move forward on depends on the comparison between the current ccre
-            # and current feature.
-            # If the current feature is AFTER the current cCRE we just advance to the next cCRE.
-            # If the current feature is BEFORE the current cCRE, then we create a new pseudo-cCRE from that
-            # feature. The new pseudo-cCRE get associated with the current feature. We then advance to the next
-            # feature.
-            # If the current feature OVERLAPS with this current cCRE then we associate the feature with the cCRE.
-            # Afterwards we look ahead to see if we advance the feature or the cCRE. If the feature also overlaps
-            # the next cCRE we advance the cCRE -- this way if a feature overlaps multiple cCREs it will be
-            # associated with all of them. Otherwise we advance to the next feature.
-            #
-            # If we get through all the features without getting through the cCREs, then we're done. If we get
-            # through all the cCREs without getting through all the features then we have to make new psudeo-cCREs
-            # with the remaining features, and do the association.
-            #
-            # Once we're through the lists we save all the new pseudo-cCREs and then the associations.
-            #
-            # By sorting the lists and advancing through only one at a time we can be sure to catch all the matches
-            # without incurring massive algorithmic overhead. This is an O(n+m) algorithm, modulo the list sorting.
-            while True:
-                if f_idx >= len(features):
-                    # We're done, we associated all the features with cCREs.
-                    break
-
-                feature = features[f_idx]
-                if parent_ccre_assignments is not None and feature.parent._id in parent_ccre_assignments:
-                    ccre_id = parent_ccre_assignments[feature.parent._id]
-                    ccre_associations.write(ccre_associate_entry(feature._id, ccre_id))
-                    features_with_associated_ccres[feature._id] = ccre_id
-                    f_idx += 1
-                    continue
-
-                if c_idx >= len(ccres):
-                    # We got through all the existing cCREs so we have to create new pseudo-cCREs from
-                    # all the remaining features.
-                    for feature in features[f_idx:]:
-                        ccre_id = ccre_ids.next_id()
-                        new_ccres.write(
-                            feature_entry(
-                                id_=ccre_id,
-                                accession_id=accession_ids.incr(AccessionType.CCRE),
-                                cell_line=feature.cell_line,
-                                chrom_name=feature.chrom_name,
-                                closest_gene_id=feature.closest_gene_id,
-                                closest_gene_distance=feature.closest_gene_distance,
-                                closest_gene_name=feature.closest_gene_name,
-                                closest_gene_ensembl_id=feature.closest_gene_ensembl_id,
-                                location=feature.location,
-                                genome_assembly=feature.genome_assembly,
-                                genome_assembly_patch=feature.genome_assembly_patch,
-                                misc=feature.misc,
-                                feature_type=DNAFeatureType.CCRE,
-                                source_file_id=feature.source_file_id,
-                                experiment_accession_id=feature.experiment_accession_id,
-                            )
-                        )
-                        ccre_associations.write(ccre_associate_entry(feature._id, ccre_id))
+        with copy_spool(FEATURE_COLUMNS) as new_ccres, copy_spool(CCRE_ASSOCIATION_COLUMNS) as ccre_associations:
+            with FeatureIds() as ccre_ids:
+                # To associate features with cCREs we need two lists -- The list of all current cCREs for a genome
+                # assembly and the the list of features. These two lists must be sorted, and must be sorted in the
+                # same manner.
+                #
+                # We work our way through both lists linearly, on each iteration moving forward on one or the other
+                # (but not both). Which list we move forward on depends on the comparison between the current ccre
+                # and current feature.
+                # If the current feature is AFTER the current cCRE we just advance to the next cCRE.
+                # If the current feature is BEFORE the current cCRE, then we create a new pseudo-cCRE from that
+                # feature. The new pseudo-cCRE get associated with the current feature. We then advance to the next
+                # feature.
+                # If the current feature OVERLAPS with this current cCRE then we associate the feature with the cCRE.
+                # Afterwards we look ahead to see if we advance the feature or the cCRE. If the feature also overlaps
+                # the next cCRE we advance the cCRE -- this way if a feature overlaps multiple cCREs it will be
+                # associated with all of them. Otherwise we advance to the next feature.
+                #
+                # If we get through all the features without getting through the cCREs, then we're done. If we get
+                # through all the cCREs without getting through all the features then we have to make new psudeo-cCREs
+                # with the remaining features, and do the association.
+                #
+                # Once we're through the lists we save all the new pseudo-cCREs and then the associations.
+                #
+                # By sorting the lists and advancing through only one at a time we can be sure to catch all the matches
+                # without incurring massive algorithmic overhead. This is an O(n+m) algorithm, modulo the list sorting.
+                while True:
+                    if f_idx >= len(features):
+                        # We're done, we associated all the features with cCREs.
+                        break
+
+                    feature = features[f_idx]
+                    if parent_ccre_assignments is not None and feature.parent._id in parent_ccre_assignments:
+                        ccre_id = parent_ccre_assignments[feature.parent._id]
+                        ccre_associations.write_row(ccre_associate_entry(feature._id, ccre_id))
                         features_with_associated_ccres[feature._id] = ccre_id
-                    break
+                        f_idx += 1
+                        continue
+
+                    if c_idx >= len(ccres):
+                        # We got through all the existing cCREs so we have to create new pseudo-cCREs from
+                        # all the remaining features.
+                        for feature in features[f_idx:]:
+                            ccre_id = ccre_ids.next_id()
+                            new_ccres.write_row(pseudo_ccre_entry(feature, ccre_id, accession_ids))
+                            ccre_associations.write_row(ccre_associate_entry(feature._id, ccre_id))
+                            features_with_associated_ccres[feature._id] = ccre_id
+                        break
+
+                    ccre = ccres[c_idx]
+
+                    match feature.ccre_comp(ccre):
+                        case FeatureOverlap.BEFORE:
+                            ccre_id = ccre_ids.next_id()
+                            new_ccres.write_row(pseudo_ccre_entry(feature, ccre_id, accession_ids))
+                            ccre_associations.write_row(ccre_associate_entry(feature._id, ccre_id))
+                            features_with_associated_ccres[feature._id] = ccre_id
+                            f_idx += 1
+                        case FeatureOverlap.AFTER:
+                            c_idx += 1
+                        case FeatureOverlap.OVERLAP:
+                            ccre_associations.write_row(ccre_associate_entry(feature._id, ccre[0]))
+                            features_with_associated_ccres[feature._id] = ccre[0]
+
+                            if (
+                                c_idx < (len(ccres) - 1)
+                                and feature.ccre_comp(ccres[c_idx + 1]) == FeatureOverlap.OVERLAP
+                            ):
+                                c_idx += 1
+                            else:
+                                f_idx += 1
+
+            bulk_feature_save(new_ccres)
+            bulk_save_associations(ccre_associations)
+        return features_with_associated_ccres
 
-                ccre = ccres[c_idx]
+    def _save_ccres_in_db(
+        self, features: list[CCREFeature], accession_ids, parent_ccre_assignments: dict[int:int] = None
+    ):
+        # Associates features with cCREs like _save_ccres, but finds the overlapping cCREs in the database
+        # instead of reading every cCRE for the genome assembly.
+        features.sort()
+        features_with_associated_ccres: dict[int:int] = {}
 
-                match feature.ccre_comp(ccre):
-                    case FeatureOverlap.BEFORE:
+        unassigned_features = []
+        for feature in features:
+            if parent_ccre_assignments is not None and feature.parent._id in parent_ccre_assignments:
+                features_with_associated_ccres[feature._id] = parent_ccre_assignments[feature.parent._id]
+            else:
+                unassigned_features.append(feature)
+
+        ccre_overlaps = get_ccre_overlaps(unassigned_features, self.metadata.tested_elements_metadata.genome_assembly)
+
+        with copy_spool(FEATURE_COLUMNS) as new_ccres, copy_spool(CCRE_ASSOCIATION_COLUMNS) as ccre_associations:
+            for feature_id, ccre_id in features_with_associated_ccres.items():
+                ccre_associations.write_row(ccre_associate_entry(feature_id, ccre_id))
+
+            with FeatureIds() as ccre_ids:
+                for feature in unassigned_features:
+                    if (overlapping_ccre_ids := ccre_overlaps.get(feature._id)) is not None:
+                        for ccre_id in overlapping_ccre_ids:
+                            ccre_associations.write_row(ccre_associate_entry(feature._id, ccre_id))
+                        features_with_associated_ccres[feature._id] = overlapping_ccre_ids[-1]
+                    else:
+                        # Features that don't overlap any cCREs get their own pseudo-cCRE
                         ccre_id = ccre_ids.next_id()
-                        new_ccres.write(
-                            feature_entry(
-                                id_=ccre_id,
-                                accession_id=accession_ids.incr(AccessionType.CCRE),
-                                cell_line=feature.cell_line,
-                                chrom_name=feature.chrom_name,
-                                closest_gene_id=feature.closest_gene_id,
-                                closest_gene_distance=feature.closest_gene_distance,
-                                closest_gene_name=feature.closest_gene_name,
-                                closest_gene_ensembl_id=feature.closest_gene_ensembl_id,
-                                location=feature.location,
-                                genome_assembly=feature.genome_assembly,
-                                genome_assembly_patch=feature.genome_assembly_patch,
-                                misc=feature.misc,
-                                feature_type=DNAFeatureType.CCRE,
-                                source_file_id=feature.source_file_id,
-                                experiment_accession_id=feature.experiment_accession_id,
-                            )
-                        )
-                        ccre_associations.write(ccre_associate_entry(feature._id, ccre_id))
+                        new_ccres.write_row(pseudo_ccre_entry(feature, ccre_id, accession_ids))
+                        ccre_associations.write_row(ccre_associate_entry(feature._id, ccre_id))
                         features_with_associated_ccres[feature._id] = ccre_id
-                        f_idx += 1
-                    case FeatureOverlap.AFTER:
-                        c_idx += 1
-                    case FeatureOverlap.OVERLAP:
-                        ccre_associations.write(ccre_associate_entry(feature._id, ccre[0]))
-                        features_with_associated_ccres[feature._id] = ccre[0]
-
-                        if c_idx < (len(ccres) - 1) and feature.ccre_comp(ccres[c_idx + 1]) == FeatureOverlap.OVERLAP:
-                            c_idx += 1
-                        else:
-                            f_idx += 1
 
-        bulk_feature_save(new_ccres)
-        bulk_save_associations(ccre_associations)
+            bulk_feature_save(new_ccres)
+            bulk_save_associations(ccre_associations)
         return features_with_associated_ccres
 
     def save(self):
@@ -2,10 +2,10 @@ import json
 import logging
 from datetime import datetime, timezone
 from enum import StrEnum
-from io import StringIO
 from typing import Any, Optional
 
 import requests
+from django.conf import settings
 from django.core.files.uploadedfile import UploadedFile
 
 from cegs_portal.search.models import (
@@ -21,6 +21,7 @@ from cegs_portal.search.models import (
 
 from .biosample import ExperimentBiosample
 from .file import AnalysisResultsMetadata, TestedElementsMetadata
+from .streams import decompressed, file_chunks, text_stream
 
 MAX_METADATA_CONTENT_LENGTH = 65_536
 
@@ -80,7 +81,14 @@ def get_source_type(source_type_string) -> DNAFeatureSourceType:
 
 
 class InternetFile:
-    def __init__(self, file: str | UploadedFile):
+    """
+    A local, uploaded, or downloaded file. Local and downloaded files are read a chunk at a time, and are
+    decompressed as they're read if they're gzip or zstd compressed. If binary is True uploaded files are too,
+    and the file is a binary stream instead of a text stream.
+    """
+
+    def __init__(self, file: str | UploadedFile, binary: bool = False):
+        self.binary = binary
         if isinstance(file, str):
             if file.startswith("http://") or file.startswith("https://"):
                 self.file = self._http_load(file)
@@ -88,18 +96,27 @@ class InternetFile:
                 self.file = self._s3_load(file)
             else:
                 self.file = self._file_load(file)
+        elif binary:
+            self.file = decompressed(file_chunks(file), file.close)
         else:
             self.file = file
 
+    def _stream(self, chunks, on_close):
+        stream = decompressed(chunks, on_close)
+        return stream if self.binary else text_stream(stream)
+
     def _file_load(self, file_path: str):
-        return open(file_path, "r")
+        file = open(file_path, "rb")
+        return self._stream(file_chunks(file), file.close)
 
     def _http_load(self, file_url: str):
-        with requests.get(file_url) as response:
-            if not response.ok:
-                raise ValueError(f"Unable to download {file_url}: {response.status_code} {response.reason}")
+        # The response body is read, and decompressed, a chunk at a time as the file is read
+        response = requests.get(file_url, stream=True)
+        if not response.ok:
+            response.close()
+            raise ValueError(f"Unable to download {file_url}: {response.status_code} {response.reason}")
 
-            return StringIO(response.text)
+        return self._stream(response.iter_content(chunk_size=settings.UPLOAD_STREAM_CHUNK_SIZE), response.close)
 
     def _s3_load(self, file_url: str):
         return open(file_url, "r")
@@ -0,0 +1,83 @@
+from typing import Optional
+
+from cegs_portal.search.models import DNAFeature, DNAFeatureType
+
+# How many of the unresolved sources and targets are listed in an UnresolvedFeaturesError's message
+MAX_REPORTED_KEYS = 20
+
+
+def source_key(chrom_name: str, start: int, end: int, strand: Optional[str], feature_type) -> tuple:
+    return (chrom_name, start, end, strand, str(DNAFeatureType(feature_type)))
+
+
+def _key_list(keys: list[str]) -> str:
+    reported = ", ".join(keys[:MAX_REPORTED_KEYS])
+    if len(keys) > MAX_REPORTED_KEYS:
+        reported = f"{reported}, and {len(keys) - MAX_REPORTED_KEYS} more"
+    return reported
+
+
+class UnresolvedFeaturesError(ValueError):
+    def __init__(self, sources: list[str], targets: list[str]):
+        self.sources = sources
+        self.targets = targets
+
+        problems = []
+        if sources:
+            problems.append(f"{len(sources)} source(s) not found in the experiment: {_key_list(sources)}")
+        if targets:
+            problems.append(f"{len(targets)} target gene(s) not found: {_key_list(targets)}")
+        super().__init__("; ".join(problems))
+
+
+class FeatureResolver:
+    """
+    Finds the ids of the source features (an experiment's tested elements) and target genes of an analysis's
+    observations. The experiment's features and the genome assembly's genes are each read with one query.
+
+    Sources and targets that can't be found are collected, rather than failing on the first one, so they
+    can all be reported together by check().
+    """
+
+    def __init__(self, experiment_accession_id: str, genome_assembly: str):
+        self.sources = {
+            (chrom_name, location.lower, location.upper, strand, feature_type): feature_id
+            for feature_id, chrom_name, location, strand, feature_type in DNAFeature.objects.filter(
+                experiment_accession_id=experiment_accession_id, ref_genome=genome_assembly
+            ).values_list("id", "chrom_name", "location", "strand", "feature_type")
+        }
+
+        self.targets = {}
+        for feature_id, ensembl_id in (
+            DNAFeature.objects.filter(ref_genome=genome_assembly, feature_type=DNAFeatureType.GENE)
+            .order_by("id")
+            .values_list("id", "ensembl_id")
+        ):
+            self.targets.setdefault(ensembl_id, feature_id)
+
+        self.unresolved_sources: dict[tuple, None] = {}
+        self.unresolved_targets: dict[str, None] = {}
+
+    def source_id(self, chrom_name: str, start: int, end: int, strand: Optional[str], feature_type) -> Optional[int]:
+        key = source_key(chrom_name, start, end, strand, feature_type)
+        feature_id = self.sources.get(key)
+        if feature_id is None:
+            self.unresolved_sources[key] = None
+        return feature_id
+
+    def target_id(self, ensembl_id: str) -> Optional[int]:
+        feature_id = self.targets.get(ensembl_id)
+        if feature_id is None:
+            self.unresolved_targets[ensembl_id] = None
+        return feature_id
+
+    def check(self):
+        """Raise an UnresolvedFeaturesError if any sources or targets couldn't be found"""
+        if self.unresolved_sources or self.unresolved_targets:
+            raise UnresolvedFeaturesError(
+                [
+                    f"{chrom_name}:{start}-{end}:{strand or '.'} {feature_type}"
+                    for chrom_name, start, end, strand, feature_type in self.unresolved_sources
+                ],
+                list(self.unresolved_targets),
+            )
@@ -0,0 +1,85 @@
+import gzip
+import io
+from functools import partial
+from itertools import chain
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional
+
+import zstandard
+from django.conf import settings
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class ChunkStream(io.RawIOBase):
+    """
+    A readable binary stream of chunks of bytes, e.g., from requests.Response.iter_content. Only the current
+    chunk is held in memory. on_close, if given, is called when the stream is closed.
+    """
+
+    def __init__(self, chunks: Iterable[bytes], on_close: Optional[Callable[[], None]] = None):
+        self.chunks = iter(chunks)
+        self.on_close = on_close
+        self.chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer) -> int:
+        while len(self.chunk) == 0:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed and self.on_close is not None:
+            self.on_close()
+        super().close()
+
+
+class _ClosingGzipFile(gzip.GzipFile):
+    # GzipFile doesn't close file objects it's given
+    def close(self):
+        fileobj = self.fileobj
+        super().close()
+        if fileobj is not None:
+            fileobj.close()
+
+
+def file_chunks(file: BinaryIO, chunk_size: Optional[int] = None) -> Iterator[bytes]:
+    return iter(partial(file.read, chunk_size or settings.UPLOAD_STREAM_CHUNK_SIZE), b"")
+
+
+def decompressed(chunks: Iterable[bytes], on_close: Optional[Callable[[], None]] = None) -> BinaryIO:
+    """
+    A binary stream of the bytes in chunks, decompressed as it's read if the bytes are gzip or zstd compressed.
+    The compression is recognized by the first few bytes, not by a file name.
+    """
+    chunks = iter(chunks)
+
+    # Enough of the stream to recognize the compression format, if any
+    head = b""
+    while len(head) < len(ZSTD_MAGIC) and (chunk := next(chunks, None)) is not None:
+        head += chunk
+
+    chunk_size = settings.UPLOAD_STREAM_CHUNK_SIZE
+    stream = io.BufferedReader(ChunkStream(chain([head], chunks), on_close), chunk_size)
+    if head.startswith(GZIP_MAGIC):
+        return _ClosingGzipFile(fileobj=stream, mode="rb")
+
+    if head.startswith(ZSTD_MAGIC):
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(stream, read_size=chunk_size, closefd=True), chunk_size
+        )
+
+    return stream
+
+
+def text_stream(binary_stream: BinaryIO) -> io.TextIOWrapper:
+    return io.TextIOWrapper(binary_stream, encoding="utf-8")
@@ -0,0 +1,89 @@
+import logging
+
+from huey.contrib.djhuey import db_task
+
+from cegs_portal.get_expr_data.models import ReoSourcesTargets
+from cegs_portal.task_status.models import TaskStatus
+from cegs_portal.uploads.data_generation import gen_all_coverage
+
+logger = logging.getLogger(__name__)
+
+# The stages run for each analysis once it's loaded, in order. Each stage is a huey task that queues the next
+# stage when it finishes. Finished stages are skipped, so an upload that failed in one of these stages can be
+# resumed from that stage without loading the data again.
+DENORMALIZE = "Denormalize"
+GENERATE_COVERAGE = "Generate coverage"
+ANALYSIS_STAGES = [DENORMALIZE, GENERATE_COVERAGE]
+
+
+def analysis_stage(task_status: TaskStatus, stage_name: str, analysis_accession: str):
+    return task_status.stage(
+        f"{stage_name} {analysis_accession}", checkpoint={"analysis_accession": analysis_accession}
+    )
+
+
+def run_analysis_stage(task_status: TaskStatus, stage_name: str, analysis_accession: str, f) -> bool:
+    """Run a stage, unless it has already finished. Returns whether the stage is finished."""
+    stage = analysis_stage(task_status, stage_name, analysis_accession)
+    if stage.is_finished:
+        return True
+
+    logger.info(f"{analysis_accession}: {stage_name}")
+    try:
+        with stage:
+            stage.row_count = f(analysis_accession)
+    except Exception as e:
+        task_status.error(f"{stage.name}: {e}")
+        logger.exception(str(e), exc_info=e)
+        return False
+
+    return True
+
+
+def finish_task(task_status: TaskStatus):
+    """Finish the task if all of its stages are finished"""
+    task_status.refresh_from_db()
+    if task_status.stages_finished():
+        task_status.finish()
+
+
+def queue_analysis_stages(task_status: TaskStatus, analysis_accession: str):
+    # All of the analysis's stages are added up front, so the task isn't finished before they run
+    for stage_name in ANALYSIS_STAGES:
+        analysis_stage(task_status, stage_name, analysis_accession)
+
+    denormalize(task_status, analysis_accession)
+
+
+@db_task()
+def denormalize(task_status: TaskStatus, analysis_accession: str):
+    if run_analysis_stage(task_status, DENORMALIZE, analysis_accession, ReoSourcesTargets.load_analysis):
+        generate_coverage(task_status, analysis_accession)
+
+
+@db_task()
+def generate_coverage(task_status: TaskStatus, analysis_accession: str):
+    if run_analysis_stage(task_status, GENERATE_COVERAGE, analysis_accession, gen_all_coverage):
+        finish_task(task_status)
+
+
+@db_task()
+def resume_upload(task_status: TaskStatus):
+    """Run the unfinished stages of a failed upload again"""
+    unfinished = list(task_status.stages.exclude(status=TaskStatus.TaskState.FINISHED))
+    if len(unfinished) == 0:
+        # There's no stage to resume from, so the task keeps its status and error
+        logger.info(f"{task_status.id}: No unfinished stages to resume")
+        return
+
+    if any(stage.checkpoint is None for stage in unfinished):
+        task_status.error("The upload failed while loading its data. Please upload it again.")
+        return
+
+    task_status.start()
+    analysis_accessions = dict.fromkeys(stage.checkpoint["analysis_accession"] for stage in unfinished)
+    for analysis_accession in analysis_accessions:
+        logger.info(f"{analysis_accession}: Resuming upload")
+        denormalize(task_status, analysis_accession)
+
+    finish_task(task_status)
@@ -5,4 +5,5 @@ from . import views
 app_name = "uploads"
 urlpatterns = [
     path("", views.upload, name="upload"),
+    path("resume/<uuid:task_id>", views.resume, name="resume"),
 ]
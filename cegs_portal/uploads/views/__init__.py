@@ -1 +1 @@
-from .uploads import upload
+from .uploads import resume, upload
@@ -0,0 +1,101 @@
+import random
+
+import pytest
+from psycopg.types.range import Int4Range
+
+from cegs_portal.search.models.tests.dna_feature_factory import DNAFeatureFactory
+from cegs_portal.uploads.data_loading.closest_gene import GeneIndex, gene_index
+
+
+def gene(id_, chrom_name, strand, start, end):
+    return {
+        "id": id_,
+        "name": f"GENE{id_}",
+        "location": Int4Range(start, end),
+        "ensembl_id": f"ENSG{id_:011}",
+        "chrom_name": chrom_name,
+        "strand": strand,
+    }
+
+
+def brute_force_closest(genes, chrom_name, start, end):
+    midpoint = (start + end) // 2
+    closest = None
+    distance = None
+    for strand in ["+", "-"]:
+        for g in genes:
+            if g["chrom_name"] != chrom_name or g["strand"] != strand:
+                continue
+            tss = g["location"].lower if strand == "+" else g["location"].upper
+            if closest is None or abs(midpoint - tss) < abs(distance):
+                closest, distance = g, midpoint - tss
+    return distance
+
+
+def test_closest_genes():
+    genes = [
+        gene(1, "chr1", "+", 100, 200),
+        gene(2, "chr1", "-", 300, 400),
+        gene(3, "chr1", "+", 1000, 2000),
+        gene(4, "chr2", "-", 500, 600),
+    ]
+    index = GeneIndex(genes)
+
+    assert index.closest_genes(["chr1", "chr1", "chr2", "chr3"], [90, 350, 0, 0], [110, 450, 10, 10]) == [
+        (genes[0], 0, "GENE1"),
+        (genes[1], 0, "GENE2"),
+        (genes[3], -595, "GENE4"),
+        (None, None, "No Gene"),
+    ]
+
+
+def test_closest_genes_ties():
+    genes = [
+        gene(1, "chr1", "+", 100, 200),
+        gene(2, "chr1", "+", 200, 300),
+        gene(3, "chr1", "-", 50, 350),
+    ]
+    index = GeneIndex(genes)
+
+    # Equally close genes on the same strand go to the one before, and on different strands to the (+) strand
+    assert index.closest_genes(["chr1", "chr1"], [150, 275], [150, 275]) == [
+        (genes[0], 50, "GENE1"),
+        (genes[1], 75, "GENE2"),
+    ]
+
+
+def test_closest_genes_matches_brute_force():
+    rng = random.Random(42)
+    genes = []
+    for i in range(500):
+        start = rng.randrange(0, 1_000_000)
+        genes.append(
+            gene(i, rng.choice(["chr1", "chr2"]), rng.choice(["+", "-"]), start, start + rng.randrange(1, 50_000))
+        )
+    index = GeneIndex(genes)
+
+    locations = []
+    for _ in range(1000):
+        start = rng.randrange(0, 1_100_000)
+        locations.append((rng.choice(["chr1", "chr2"]), start, start + rng.randrange(1, 1000)))
+
+    closest_genes = index.closest_genes(*zip(*locations))
+    for (chrom_name, start, end), (_, distance, _) in zip(locations, closest_genes):
+        assert abs(distance) == abs(brute_force_closest(genes, chrom_name, start, end))
+
+
+@pytest.mark.django_db
+def test_gene_index_reloads_when_genes_change(genes):
+    index = gene_index("hg38")
+    assert gene_index("hg38") is index
+    assert {g["id"] for g in index.genes} == {g.id for g in genes}
+
+    new_gene = DNAFeatureFactory(
+        name="NEWGENE", ensembl_id="ENSG00000000001", feature_type="DNAFeatureType.GENE", chrom_name="chr1", strand="+"
+    )
+    new_index = gene_index("hg38")
+    assert new_index is not index
+    assert new_gene.id in {g["id"] for g in new_index.genes}
+
+    new_gene.delete()
+    assert new_gene.id not in {g["id"] for g in gene_index("hg38").genes}
@@ -0,0 +1,85 @@
+import csv
+import os.path
+from io import StringIO
+
+import pytest
+
+from cegs_portal.uploads.data_loading.analysis import (
+    parse_observation_columns,
+    parse_observations,
+)
+from cegs_portal.uploads.data_loading.columnar import read_column_batches
+from cegs_portal.uploads.data_loading.experiment import (
+    parse_tested_element_columns,
+    parse_tested_elements,
+)
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+FACET_VALUES = {"Depleted Only", "Enriched Only", "Non-significant", "Mixed"}
+
+
+def _dict_reader(file):
+    return csv.DictReader(file, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+
+def test_read_column_batches():
+    tsv = StringIO("a\tb\tc\n1\t2\t3\r\n4\t5\n\n6\t7\t8\n")
+    batches = list(read_column_batches(tsv, batch_chars=4))
+
+    assert [batch.first_line for batch in batches] == [2, 3, 5]
+    assert [value for batch in batches for value in batch.column("c")] == ["3", "", "8"]
+    assert [value for batch in batches for value in batch.int_column("a").tolist()] == [1, 4, 6]
+
+
+def test_read_column_batches_invalid():
+    with pytest.raises(ValueError, match="Line 3 has 4 columns"):
+        list(read_column_batches(StringIO("a\tb\tc\n1\t2\t3\n4\t5\t6\t7\n")))
+
+    (batch,) = read_column_batches(StringIO("a\tb\n1\t2\nx\t3\n"))
+    with pytest.raises(ValueError, match="Invalid a on line 3: 'x'"):
+        batch.int_column("a")
+    with pytest.raises(ValueError, match="Missing column 'c'"):
+        batch.column("c")
+
+
+def test_parse_observation_columns():
+    with open(os.path.join(TEST_DIR, "observations.tsv")) as tsv:
+        expected = list(parse_observations(_dict_reader(tsv), "DHS", FACET_VALUES))
+    with open(os.path.join(TEST_DIR, "observations.tsv")) as tsv:
+        observations = list(parse_observation_columns(read_column_batches(tsv, batch_chars=100), "DHS", FACET_VALUES))
+
+    assert len(observations) == 14
+    assert observations == expected
+
+
+def test_parse_observation_columns_invalid_facet():
+    tsv = StringIO(
+        "chrom\tstart\tend\tstrand\tgene_ensembl_id\traw_p_val\tadj_p_val\teffect_size\tfacets\n"
+        "chr1\t1\t2\t.\tENSG00000131584\t0.1\t0.1\t\tDirection=Sideways\n"
+    )
+    with pytest.raises(ValueError, match="Invalid categorical facet value: 'Sideways'"):
+        list(parse_observation_columns(read_column_batches(tsv), "DHS", FACET_VALUES))
+
+
+def test_parse_tested_element_columns():
+    with open(os.path.join(TEST_DIR, "tested_elements.tsv")) as tsv:
+        expected = list(parse_tested_elements(_dict_reader(tsv)))
+    with open(os.path.join(TEST_DIR, "tested_elements.tsv")) as tsv:
+        elements = list(parse_tested_element_columns(read_column_batches(tsv, batch_chars=100)))
+
+    assert len(elements) == 10
+    assert elements == expected
+
+
+def test_parse_tested_element_columns_parents():
+    tested_elements = (
+        "chrom\tstart\tend\tstrand\tparent_chrom\tparent_start\tparent_end\tparent_strand\tfacets\tmisc\n"
+        "chr1\t10\t20\t+\tchr1\t5\t50\t+\tgRNA type=targeting\tguide=ACGT\n"
+        "chr1\t30\t40\t+\t\t\t\t\t\t\n"
+    )
+    expected = list(parse_tested_elements(_dict_reader(StringIO(tested_elements))))
+    elements = list(parse_tested_element_columns(read_column_batches(StringIO(tested_elements))))
+
+    assert elements == expected
+    assert elements[0] == (("chr1", 10, 20, "+"), ("chr1", 5, 50, "+"), [["gRNA type", "targeting"]], {"guide": "ACGT"})
+    assert elements[1][1] is None
@@ -0,0 +1,99 @@
+import pytest
+from django.db import connection
+from psycopg.types.range import Int4Range
+
+from cegs_portal.uploads.data_loading.db import (
+    BinaryCopySpool,
+    CopySpool,
+    copy_rows,
+    source_entry,
+    text_row,
+)
+
+
+class MockCopy:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(data)
+
+
+def test_copy_spool_chunks():
+    copy = MockCopy()
+    with CopySpool() as spool:
+        for i in range(100):
+            spool.write_row(source_entry(i, i + 1))
+        spool.copy_to(copy, chunk_size=64)
+
+    data = "".join(copy.chunks)
+    assert data == "".join(text_row(source_entry(i, i + 1)) for i in range(100))
+    assert all(len(chunk) <= 64 for chunk in copy.chunks)
+    assert len(copy.chunks) == -(-len(data) // 64)
+
+
+def test_copy_spool_spills_to_disk():
+    copy = MockCopy()
+    with CopySpool(max_memory=100) as spool:
+        for i in range(100):
+            spool.write_row(source_entry(i, i + 1))
+        assert spool.file._rolled
+        spool.copy_to(copy)
+
+    assert "".join(copy.chunks) == "".join(text_row(source_entry(i, i + 1)) for i in range(100))
+
+
+def test_text_row():
+    assert text_row((1, None, True, "a\tb\\c", {"key": 'say "hi"'}, Int4Range(10, 20))) == (
+        '1\t\\N\ttrue\ta\\tb\\\\c\t{"key": "say \\\\"hi\\\\""}\t[10, 20)\n'
+    )
+
+
+@pytest.mark.django_db
+def test_binary_copy_spool():
+    columns = [("id", "int8"), ("name", "text"), ("misc", "jsonb"), ("location", "int4range")]
+    rows = [(i, f"name\t{i}", {"value": i}, Int4Range(i, i + 10)) for i in range(25)] + [(25, None, None, None)]
+    with connection.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE binary_copy_test (id int8, name text, misc jsonb, location int4range)")
+        with BinaryCopySpool([column_type for _, column_type in columns], max_memory=100) as spool:
+            for row in rows:
+                spool.write_row(row)
+            assert spool.file._rolled
+            copy_rows(cursor, "binary_copy_test", columns, spool)
+
+        cursor.execute("SELECT id, name, misc, location FROM binary_copy_test ORDER BY id")
+        assert cursor.fetchall() == rows
+
+
+@pytest.mark.django_db
+def test_binary_copy_spool_contents():
+    copy = MockCopy()
+    with BinaryCopySpool(["int8", "int8"]) as spool:
+        spool.write_row(source_entry(1, 2))
+        spool.copy_to(copy, chunk_size=16)
+
+    # A complete binary COPY: the header, one row of two int8s, and the trailer
+    data = b"".join(copy.chunks)
+    assert data == (
+        b"PGCOPY\n\xff\r\n\x00"
+        + bytes(8)
+        + b"\x00\x02"
+        + b"\x00\x00\x00\x08"
+        + (1).to_bytes(8, "big")
+        + b"\x00\x00\x00\x08"
+        + (2).to_bytes(8, "big")
+        + b"\xff\xff"
+    )
+    assert all(len(chunk) <= 16 for chunk in copy.chunks)
+
+
+@pytest.mark.django_db
+def test_copy_spool_row_count():
+    with CopySpool() as spool, BinaryCopySpool(["int8", "int8"]) as binary_spool:
+        for i in range(25):
+            spool.write_row(source_entry(i, i + 1))
+            binary_spool.write_row(source_entry(i, i + 1))
+        spool.write(text_row(source_entry(25, 26)) + text_row(source_entry(26, 27)))
+
+        assert spool.row_count == 27
+        assert binary_spool.row_count == 25
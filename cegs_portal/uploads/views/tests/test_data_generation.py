@@ -0,0 +1,36 @@
+import pytest
+
+from cegs_portal.search.models.tests.analysis_factory import AnalysisFactory
+from cegs_portal.uploads import data_generation
+
+pytestmark = pytest.mark.django_db
+
+GENERATORS = ["gen_volcano_plot", "gen_qq_plot", "gen_coverage_pyramid", "gen_coverage"]
+
+
+def no_op(*args, **kwargs):
+    pass
+
+
+@pytest.mark.parametrize("failing_generator", GENERATORS)
+def test_gen_all_coverage_failure(monkeypatch, tmp_path, failing_generator):
+    analysis = AnalysisFactory()
+    (tmp_path / "level1.ecd").write_bytes(b"coverage")
+    (tmp_path / "volcano.tsv").write_text("volcano")
+
+    def failed_generator(*args, **kwargs):
+        raise ValueError(f"{failing_generator} failed")
+
+    monkeypatch.setattr(data_generation, "create_analysis_dir", lambda analysis: str(tmp_path))
+    monkeypatch.setattr(data_generation, "gen_genome_coverage", no_op)
+    monkeypatch.setattr(data_generation.AnalysisObservations, "load", no_op)
+    for generator in GENERATORS:
+        monkeypatch.setattr(data_generation, generator, no_op)
+    monkeypatch.setattr(data_generation, failing_generator, failed_generator)
+
+    with pytest.raises(ValueError):
+        data_generation.gen_all_coverage(analysis.accession_id)
+
+    # The coverage files are deleted whichever step failed. Other files are left alone.
+    assert not (tmp_path / "level1.ecd").exists()
+    assert (tmp_path / "volcano.tsv").exists()
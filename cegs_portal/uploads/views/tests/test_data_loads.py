@@ -5,6 +5,7 @@ from django.http import HttpResponseForbidden
 
 from cegs_portal.conftest import SearchClient
 from cegs_portal.search.models import DNAFeature, RegulatoryEffectObservation
+from cegs_portal.uploads.data_loading.db import analyze
 
 pytestmark = pytest.mark.django_db
 
@@ -65,3 +66,45 @@ def test_post_analysis_data(add_experiment_client: SearchClient):
         # Make sure that some of the DNA features get updated with information about their
         # significant REOs
         assert any(feature.significant_reo for feature in DNAFeature.objects.all())
+
+        # Each source feature has the directions of all of its REOs, once each
+        for feature in DNAFeature.objects.filter(source_for__isnull=False).distinct():
+            reo_directions = {
+                facet_value.value
+                for reo in feature.source_for.all()
+                for facet_value in reo.facet_values.all()
+                if facet_value.facet.name == "Direction"
+            }
+            feature_directions = [
+                facet_value.value for facet_value in feature.facet_values.all() if facet_value.facet.name == "Direction"
+            ]
+            assert sorted(feature_directions) == sorted(reo_directions)
+            assert feature.significant_reo == any(direction != "Non-significant" for direction in reo_directions)
+
+
+def test_post_analysis_data_analyze(add_experiment_client: SearchClient, settings, django_capture_on_commit_callbacks):
+    # Every table the upload adds rows to is analyzed
+    settings.UPLOAD_ANALYZE_ROWS = 1
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    with open(os.path.join(current_dir, "experiment.json")) as experiment, open(
+        os.path.join(current_dir, "analysis001.json")
+    ) as analysis, django_capture_on_commit_callbacks(execute=True) as callbacks:
+        response = add_experiment_client.post(
+            "/uploads/",
+            {
+                "experiment_accession": "DCPEXPR0000000000",
+                "experiment_file": experiment,
+                "experiment_url": [""],
+                "analysis_file": analysis,
+                "analysis_url": [""],
+            },
+        )
+        assert response.status_code < 400
+
+    analyzed_tables = {callback.args[0] for callback in callbacks if getattr(callback, "func", None) is analyze}
+    assert {
+        "search_dnafeature",
+        "search_regulatoryeffectobservation",
+        "search_regulatoryeffectobservation_sources",
+    } <= analyzed_tables
+    assert RegulatoryEffectObservation.objects.all().count() == 14
@@ -13,6 +13,11 @@ from cegs_portal.uploads.data_loading.types import (
 pytestmark = pytest.mark.django_db
 
 
+@pytest.fixture(autouse=True, params=[True, False], ids=["overlap_in_db", "overlap_in_python"])
+def ccre_overlap_in_db(request, settings):
+    settings.UPLOAD_CCRE_OVERLAP_IN_DB = request.param
+
+
 def ccre_ids():
     return set(DNAFeature.objects.filter(feature_type=DNAFeatureType.CCRE).values_list("id", flat=True))
 
@@ -0,0 +1,132 @@
+import os
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+
+from cegs_portal.uploads.data_generation.observations import (
+    NO_FEATURE,
+    AnalysisObservations,
+    concat_observation_columns,
+    observation_columns,
+)
+from cegs_portal.uploads.data_generation.qq_plot import gen_qq_plot
+from cegs_portal.uploads.data_generation.volcano_plot import gen_volcano_plot
+
+
+def _columns():
+    # Observation 1 has two sources, observation 2 has a target and no gene symbol
+    return {
+        "reo_id": np.array([1, 1, 2], dtype=np.int64),
+        "effect_size": np.array([0.5, 0.5, np.nan]),
+        "adj_p_value": np.array([0.01, 0.01, 0.5]),
+        "raw_p_value": np.array([0.001, 0.001, 0.4]),
+        "log_significance": np.array([2.0, 2.0, 0.3]),
+        "targeting_category": np.array([0, 0, 1], dtype=np.int32),
+        "source_id": np.array([10, 11, 12], dtype=np.int64),
+        "source_start": np.array([100, 300, 500], dtype=np.int32),
+        "source_end": np.array([200, 400, 600], dtype=np.int32),
+        "target_id": np.array([NO_FEATURE, NO_FEATURE, 20], dtype=np.int64),
+        "target_start": np.array([0, 0, 1000], dtype=np.int32),
+        "target_end": np.array([0, 0, 2000], dtype=np.int32),
+        "target_gene_symbol": np.array(["GATA1".encode(), "GATA1".encode(), b""]),
+        "source_chrom": np.array([b"chr1", b"chr1", b"chr10"]),
+        "target_chrom": np.array([b"", b"", b"chr10"]),
+        "cat_facets": np.array([[1, 2], [1, 2], [3, 0]], dtype=np.int64),
+    }
+
+
+def _rows(columns):
+    # The rows as they're fetched from the database, with text as str and facets as unpadded lists
+    rows = []
+    for i in range(len(columns["reo_id"])):
+        row = []
+        for name, values in columns.items():
+            if name == "cat_facets":
+                row.append([facet_id for facet_id in values[i].tolist() if facet_id != 0])
+            elif values.dtype.kind == "S":
+                row.append(values[i].decode("utf-8"))
+            else:
+                row.append(values[i].item())
+        rows.append(tuple(row))
+    return rows
+
+
+def test_observation_columns():
+    columns = _columns()
+    converted = observation_columns(_rows(columns))
+
+    assert converted.keys() == columns.keys()
+    for name, values in columns.items():
+        np.testing.assert_array_equal(converted[name], values)
+        assert converted[name].dtype.kind == values.dtype.kind
+
+
+def test_concat_observation_columns():
+    columns = _columns()
+    rows = _rows(columns)
+    # The batches have different facet counts and string widths
+    concatenated = concat_observation_columns([observation_columns(rows[:1]), observation_columns(rows[1:])])
+
+    for name, values in columns.items():
+        np.testing.assert_array_equal(concatenated[name], values)
+
+
+def test_no_observations():
+    columns = concat_observation_columns([])
+    assert all(len(values) == 0 for values in columns.values())
+    assert len(AnalysisObservations.from_columns(columns)) == 0
+
+
+def test_from_columns():
+    observations = AnalysisObservations.from_columns(observation_columns(_rows(_columns())))
+
+    assert len(observations) == 2
+    np.testing.assert_array_equal(observations.raw_p_value, [0.001, 0.4])
+    np.testing.assert_array_equal(observations.targeting_category, [0, 1])
+    assert list(observations.target_gene_symbol) == [b"GATA1", b""]
+
+    sources = observations.features["source"]
+    assert sources.keys() == {"chr1", "chr10"}
+    np.testing.assert_array_equal(sources["chr1"]["pos"], [150, 350])
+    np.testing.assert_array_equal(sources["chr1"]["facets"], [[1, 2], [1, 2]])
+    targets = observations.features["target"]
+    assert targets.keys() == {"chr10"}
+    np.testing.assert_array_equal(targets["chr10"]["pos"], [1500])
+    np.testing.assert_array_equal(targets["chr10"]["effect"], [np.nan])
+
+
+def _plot_observations():
+    return AnalysisObservations(
+        effect_size=np.array([2.0, -1.5, 0.1, np.nan, 3.0]),
+        adj_p_value=np.array([0.01, 0.5, 0.5, 0.01, np.nan]),
+        raw_p_value=np.array([0.001, 0.2, 0.3, np.nan, np.nan]),
+        log_significance=np.array([2.0, 0.3, 0.3, 2.0, np.nan]),
+        target_gene_symbol=np.array([b"GATA1", b"", b"MYC", b"HBG1", b"HBG2"]),
+        targeting_category=np.array([0, 1, 0, 0, 1], dtype=np.uint8),
+    )
+
+
+def test_volcano_plot(tmp_path):
+    analysis = SimpleNamespace(accession_id="DCPAN0000000000", p_value_threshold=0.05)
+    gen_volcano_plot(analysis, str(tmp_path), _plot_observations())
+
+    # The non-significant, low fold-change observation and the ones missing a p-value or effect size are skipped
+    expected = struct.pack(">ffBB5s", 2.0, 2.0, 0, 5, b"GATA1") + struct.pack(">ffBB", 0.3, -1.5, 1, 0)
+    with open(os.path.join(tmp_path, "vpdata.pd"), "rb") as plot_file:
+        assert plot_file.read() == expected
+
+
+def test_qq_plot_skips_missing_p_values(tmp_path):
+    analysis = SimpleNamespace(accession_id="DCPAN0000000000")
+    gen_qq_plot(analysis, str(tmp_path), _plot_observations())
+
+    with open(os.path.join(tmp_path, "qqplot.pd"), "rb") as plot_file:
+        data = plot_file.read()
+
+    # Each category has one observation with a p-value, so there's one quantile
+    (quantile_count,) = struct.unpack_from(">I", data)
+    assert quantile_count == 1
+    values = np.frombuffer(data[-12:], dtype=">f4")
+    assert not np.isnan(values).any()
+    np.testing.assert_allclose(values[1:], [3.0, -np.log10(0.2)], rtol=1e-6)
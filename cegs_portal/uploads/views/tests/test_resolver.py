@@ -0,0 +1,56 @@
+import pytest
+from psycopg.types.range import Int4Range
+
+from cegs_portal.search.models import DNAFeatureType
+from cegs_portal.search.models.tests.dna_feature_factory import DNAFeatureFactory
+from cegs_portal.uploads.data_loading.resolver import (
+    FeatureResolver,
+    UnresolvedFeaturesError,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def test_resolve_features(genes):
+    source = DNAFeatureFactory(
+        chrom_name="chr1",
+        location=Int4Range(540930, 541007),
+        strand=None,
+        feature_type=str(DNAFeatureType.DHS),
+    )
+    acap3, _, _ = genes
+
+    resolver = FeatureResolver(source.experiment_accession_id, "hg38")
+
+    assert resolver.source_id("chr1", 540930, 541007, None, "DHS") == source.id
+    assert resolver.target_id("ENSG00000131584") == acap3.id
+    resolver.check()
+
+
+def test_unresolved_features(genes):
+    source = DNAFeatureFactory(
+        chrom_name="chr1",
+        location=Int4Range(540930, 541007),
+        strand=None,
+        feature_type=str(DNAFeatureType.DHS),
+    )
+
+    resolver = FeatureResolver(source.experiment_accession_id, "hg38")
+
+    assert resolver.source_id("chr1", 540930, 541008, None, "DHS") is None
+    assert resolver.source_id("chr2", 540930, 541007, None, "DHS") is None
+    assert resolver.source_id("chr2", 540930, 541007, None, "DHS") is None
+    assert resolver.target_id("ENSG00000000001") is None
+    assert resolver.target_id("ENSG00000000002") is None
+
+    # All of the missing sources and targets are reported in one error
+    with pytest.raises(UnresolvedFeaturesError) as error:
+        resolver.check()
+
+    assert error.value.sources == [
+        "chr1:540930-541008:. DNAFeatureType.DHS",
+        "chr2:540930-541007:. DNAFeatureType.DHS",
+    ]
+    assert error.value.targets == ["ENSG00000000001", "ENSG00000000002"]
+    assert "2 source(s)" in str(error.value)
+    assert "2 target gene(s)" in str(error.value)
@@ -0,0 +1,120 @@
+import gzip
+import io
+import os.path
+import tarfile
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import zstandard
+
+from cegs_portal.search.models import DNAFeature, RegulatoryEffectObservation
+from cegs_portal.uploads.data_loading.compressed import load as c_load
+from cegs_portal.uploads.data_loading.metadata import InternetFile
+from cegs_portal.uploads.data_loading.streams import ChunkStream, decompressed
+
+TEST_DIR = os.path.dirname(os.path.realpath(__file__))
+CONTENTS = "".join(f"chr1\t{i}\t{i + 10}\n" for i in range(10_000))
+COMPRESSIONS = {
+    "": lambda data: data,
+    ".gz": gzip.compress,
+    ".zst": zstandard.ZstdCompressor().compress,
+}
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    """A local HTTP server for the files in tmp_path"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(tmp_path)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_chunk_stream():
+    closed = []
+    chunks = iter([b"abc", b"", b"defg", b"h"])
+    stream = io.BufferedReader(ChunkStream(chunks, lambda: closed.append(True)), buffer_size=2)
+
+    assert stream.read(2) == b"ab"
+    # Chunks are only read as they're needed
+    assert next(chunks) == b""
+    assert stream.read() == b"cdefgh"
+
+    stream.close()
+    assert closed == [True]
+
+
+@pytest.mark.parametrize("suffix", COMPRESSIONS.keys())
+def test_decompressed(suffix):
+    data = COMPRESSIONS[suffix](CONTENTS.encode())
+    closed = []
+    chunks = (data[i : i + 100] for i in range(0, len(data), 100))
+
+    with decompressed(chunks, lambda: closed.append(True)) as stream:
+        assert stream.read() == CONTENTS.encode()
+
+    assert closed == [True]
+
+
+@pytest.mark.parametrize("suffix", COMPRESSIONS.keys())
+def test_http_internet_file(suffix, tmp_path, http_server, settings):
+    settings.UPLOAD_STREAM_CHUNK_SIZE = 1024
+    (tmp_path / f"elements.tsv{suffix}").write_bytes(COMPRESSIONS[suffix](CONTENTS.encode()))
+
+    file = InternetFile(f"{http_server}/elements.tsv{suffix}")
+    assert file.file.readline() == "chr1\t0\t10\n"
+    assert file.file.read() == CONTENTS[len("chr1\t0\t10\n") :]
+    file.close()
+
+
+def test_http_internet_file_missing(http_server):
+    with pytest.raises(ValueError, match="Unable to download"):
+        InternetFile(f"{http_server}/missing.tsv")
+
+
+def _archive(member_names, compress) -> io.BytesIO:
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode="w") as tar:
+        for name in member_names:
+            tar.add(os.path.join(TEST_DIR, name), arcname=name)
+    return io.BytesIO(compress(archive.getvalue()))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize(
+    "member_names",
+    [
+        # Data files after their metadata are loaded straight from the archive
+        ["experiment.json", "tested_elements.tsv", "analysis001.json", "observations.tsv"],
+        # Data files before their metadata are written to disk first
+        ["observations.tsv", "tested_elements.tsv", "analysis001.json", "experiment.json"],
+    ],
+)
+@pytest.mark.parametrize("suffix", [".gz", ".zst"])
+def test_load_compressed(member_names, suffix, settings):
+    settings.UPLOAD_STREAM_CHUNK_SIZE = 1024
+    loaded = []
+
+    analysis_accession_ids = c_load(
+        _archive(member_names, COMPRESSIONS[suffix]), "DCPEXPR0000000000", analysis_loaded=loaded.append
+    )
+
+    assert len(analysis_accession_ids) == 1
+    assert loaded == analysis_accession_ids
+    assert DNAFeature.objects.filter(feature_type="DNAFeatureType.DHS").count() == 10
+    assert RegulatoryEffectObservation.objects.filter(analysis__accession_id=analysis_accession_ids[0]).count() == 14
+
+
+@pytest.mark.django_db
+def test_load_compressed_missing_experiment():
+    with pytest.raises(ValueError, match="No experiment.json found in upload"):
+        c_load(_archive(["analysis001.json", "observations.tsv"], gzip.compress), "DCPEXPR0000000000")
@@ -0,0 +1,93 @@
+import pytest
+
+from cegs_portal.task_status.factories import TaskStatusFactory
+from cegs_portal.task_status.models import TaskStatus
+from cegs_portal.uploads import tasks
+from cegs_portal.uploads.views import uploads
+
+pytestmark = pytest.mark.django_db
+
+ANALYSIS_ACCESSION = "DCPAN0000000000"
+
+
+def test_resume_from_failed_stage(monkeypatch):
+    task_status = TaskStatusFactory()
+    task_status.start()
+    calls = []
+
+    def load_analysis(analysis_accession):
+        calls.append(("denormalize", analysis_accession))
+        return 10
+
+    def failed_coverage(analysis_accession):
+        calls.append(("coverage", analysis_accession))
+        raise ValueError("Coverage failed")
+
+    monkeypatch.setattr(tasks.ReoSourcesTargets, "load_analysis", load_analysis)
+    monkeypatch.setattr(tasks, "gen_all_coverage", failed_coverage)
+
+    tasks.queue_analysis_stages(task_status, ANALYSIS_ACCESSION)
+
+    task_status.refresh_from_db()
+    assert task_status.status == TaskStatus.TaskState.ERROR
+    assert [(stage.status, stage.row_count) for stage in task_status.stages.all()] == [
+        (TaskStatus.TaskState.FINISHED, 10),
+        (TaskStatus.TaskState.ERROR, None),
+    ]
+
+    # Only the failed stage runs again
+    calls.clear()
+    monkeypatch.setattr(
+        tasks, "gen_all_coverage", lambda analysis_accession: calls.append(("coverage", analysis_accession))
+    )
+    tasks.resume_upload(task_status)
+
+    task_status.refresh_from_db()
+    assert calls == [("coverage", ANALYSIS_ACCESSION)]
+    assert task_status.status == TaskStatus.TaskState.FINISHED
+    assert task_status.error_message is None
+
+
+def test_resume_failed_load():
+    task_status = TaskStatusFactory()
+    with pytest.raises(ValueError):
+        with task_status.stage("Load upload"):
+            raise ValueError("Bad file")
+
+    tasks.resume_upload(task_status)
+
+    task_status.refresh_from_db()
+    assert task_status.status == TaskStatus.TaskState.ERROR
+
+
+def test_resume_failed_partial_load(monkeypatch):
+    def failed_load(analysis_file, experiment_accession):
+        raise ValueError("Bad analysis file")
+
+    monkeypatch.setattr(uploads, "an_load", failed_load)
+    task_status = TaskStatusFactory()
+
+    uploads.handle_partial_upload(None, "analysis.json", "DCPEXPR0000000000", task_status, None)
+
+    task_status.refresh_from_db()
+    assert task_status.status == TaskStatus.TaskState.ERROR
+    assert [(stage.name, stage.status) for stage in task_status.stages.all()] == [
+        ("Load analysis", TaskStatus.TaskState.ERROR)
+    ]
+
+    tasks.resume_upload(task_status)
+
+    task_status.refresh_from_db()
+    assert task_status.status == TaskStatus.TaskState.ERROR
+    assert task_status.error_message == "The upload failed while loading its data. Please upload it again."
+
+
+def test_resume_without_stages():
+    task_status = TaskStatusFactory()
+    task_status.error("Bad file")
+
+    tasks.resume_upload(task_status)
+
+    task_status.refresh_from_db()
+    assert task_status.status == TaskStatus.TaskState.ERROR
+    assert task_status.error_message == "Bad file"
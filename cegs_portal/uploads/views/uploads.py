@@ -2,20 +2,21 @@ import logging
 from functools import partial
 
 from django.contrib.auth.decorators import permission_required
+from django.core.exceptions import PermissionDenied
 from django.db import transaction
-from django.http import JsonResponse
+from django.http import HttpResponseNotAllowed, JsonResponse
 from django.shortcuts import render
 from huey.contrib.djhuey import db_task
 
-from cegs_portal.get_expr_data.models import ReoSourcesTargets, ReoSourcesTargetsSigOnly
 from cegs_portal.search.views.view_utils import JSON_MIME
 from cegs_portal.task_status.decorators import handle_error
 from cegs_portal.task_status.models import TaskStatus
-from cegs_portal.uploads.data_generation import gen_all_coverage
+from cegs_portal.task_status.view_models import get_status
 from cegs_portal.uploads.data_loading.analysis import load as an_load
 from cegs_portal.uploads.data_loading.compressed import load as c_load
 from cegs_portal.uploads.data_loading.experiment import load as expr_load
 from cegs_portal.uploads.forms import UploadFileForm
+from cegs_portal.uploads.tasks import finish_task, queue_analysis_stages, resume_upload
 from cegs_portal.uploads.validators import validate_experiment_accession_id
 from cegs_portal.uploads.view_models import (
     add_experiment_to_user,
@@ -85,6 +86,12 @@ def upload(request):
     return render(request, "uploads/upload.html", {"upload_form": form})
 
 
+def load_full_upload(full_file, experiment_accession, task_status):
+    # Each analysis's stages are added before this stage finishes, so the task can't be finished early
+    with task_status.stage("Load upload"):
+        c_load(full_file, experiment_accession, task_status, partial(queue_analysis_stages, task_status))
+
+
 @db_task()
 def handle_full_upload(full_file, experiment_accession, task_status, user):
     """Handle upload as single compressed file"""
@@ -92,21 +99,26 @@ def handle_full_upload(full_file, experiment_accession, task_status, user):
 
     logger.info(f"{experiment_accession}: Starting upload")
 
-    c_load_error = handle_error(c_load, task_status)
-    analysis_accession = c_load_error(full_file, experiment_accession)
+    load_error = handle_error(load_full_upload, task_status)
+    load_error(full_file, experiment_accession, task_status)
 
     transaction.on_commit(
         handle_error(partial(add_experiment_to_user, experiment_accession=experiment_accession, user=user), task_status)
     )
 
-    logger.info(f"{experiment_accession}: Adding data to ReoSourcesTargets")
-    ReoSourcesTargets.load_analysis(analysis_accession)
-    ReoSourcesTargetsSigOnly.load_analysis(analysis_accession)
+    logger.info(f"{experiment_accession}: Data loaded")
+    transaction.on_commit(lambda: finish_task(task_status))
+
+
+def load_experiment(experiment_file, experiment_accession, task_status):
+    with task_status.stage("Load experiment"):
+        expr_load(experiment_file, experiment_accession)
 
-    logger.info(f"{experiment_accession}: Generating coverage/graph files")
-    transaction.on_commit(handle_error(partial(gen_all_coverage, analysis_accession=analysis_accession), task_status))
-    logger.info(f"{experiment_accession}: Done")
-    transaction.on_commit(lambda: task_status.finish())
+
+def load_analysis(analysis_file, experiment_accession, task_status):
+    # The analysis's stages are queued once this stage has finished and the load has been committed
+    with task_status.stage("Load analysis"):
+        return an_load(analysis_file, experiment_accession)
 
 
 @db_task()
@@ -118,8 +130,8 @@ def handle_partial_upload(experiment_file, analysis_file, experiment_accession,
     logger.info(f"{experiment_accession}: Starting partial upload")
 
     if experiment_file is not None:
-        expr_load_error = handle_error(expr_load, task_status)
-        expr_load_error(experiment_file, experiment_accession)
+        expr_load_error = handle_error(load_experiment, task_status)
+        expr_load_error(experiment_file, experiment_accession, task_status)
 
         transaction.on_commit(
             handle_error(
@@ -128,14 +140,29 @@ def handle_partial_upload(experiment_file, analysis_file, experiment_accession,
         )
 
     if analysis_file is not None:
-        an_load_error = handle_error(an_load, task_status)
-        analysis_accession = an_load_error(analysis_file, experiment_accession)
+        an_load_error = handle_error(load_analysis, task_status)
+        analysis_accession = an_load_error(analysis_file, experiment_accession, task_status)
 
-        ReoSourcesTargets.load_analysis(analysis_accession)
-        ReoSourcesTargetsSigOnly.load_analysis(analysis_accession)
-        transaction.on_commit(
-            handle_error(partial(gen_all_coverage, analysis_accession=analysis_accession), task_status)
-        )
+        if analysis_accession is not None:
+            transaction.on_commit(partial(queue_analysis_stages, task_status, analysis_accession))
 
-    logger.info(f"{experiment_accession}: Done")
-    transaction.on_commit(lambda: task_status.finish())
+    logger.info(f"{experiment_accession}: Data loaded")
+    transaction.on_commit(lambda: finish_task(task_status))
+
+
+@permission_required("search.add_experiment", raise_exception=True)
+def resume(request, task_id):
+    """Resume a failed upload from its unfinished stages"""
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+
+    task_status = get_status(task_id)
+    if task_status is None or task_status.user != request.user:
+        raise PermissionDenied(f"User does not have permission for task {task_id}")
+
+    resume_upload(task_status)
+
+    if request.headers.get("accept") == JSON_MIME or request.POST.get("accept") == JSON_MIME:
+        return JsonResponse({"task_status_id": task_status.id})
+    else:
+        return render(request, "uploads/upload_complete.html", {"task_status": task_status})
@@ -1,26 +1,25 @@
 from django.db import connection
 
-from cegs_portal.search.models import DNAFeature, RegulatoryEffectObservation
+# How many ids are reserved from a sequence at a time
+ID_BLOCK_SIZE = 10_000
 
 
-class FeatureIds:
-    # Only one "FeatureIds" should be in use at a time. Otherwise
-    # the FeatureIds instances will potentially assign the same ids
-    # to different rows, and one of the commits will fail.
-    in_use = False
+class SequenceIds:
+    """
+    Ids for new rows of a table, reserved in blocks from the table's id sequence.
 
-    def __init__(self):
-        self.current_id = None
+    Each id comes from nextval, so ids are never handed out twice, even to different processes or to
+    rows inserted through the ORM. This lets several uploads load data at the same time. Ids that are reserved
+    but not used (at the end of the last block, or when a transaction is rolled back) are skipped.
+    """
+
+    table: str
+
+    def __init__(self, block_size: int = ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self.block = iter(())
 
     def __enter__(self):
-        assert FeatureIds.in_use is False
-        FeatureIds.in_use = True
-
-        last_object = DNAFeature.objects.all().values_list("id", flat=True).order_by("-id")
-        if last_object.exists():
-            self.current_id = last_object[0]
-        else:
-            self.current_id = 0
         return self
 
     def next_id(self):
@@ -30,46 +29,32 @@ class FeatureIds:
         return self
 
     def __next__(self):
-        self.current_id += 1
-        return self.current_id
+        try:
+            return next(self.block)
+        except StopIteration:
+            self.block = iter(self._reserve_block())
+            return next(self.block)
 
     def __exit__(self, exc_type, exc_value, exc_tb):
-        FeatureIds.in_use = False
-        with connection.cursor() as cursor:
-            cursor.execute("ALTER SEQUENCE search_dnafeature_id_seq RESTART WITH %s", (self.current_id,))
-
+        self.block = iter(())
 
-class ReoIds:
-    # Only one "FeatureIds" should be in use at a time. Otherwise
-    # the FeatureIds instances will potentially assign the same ids
-    # to different rows, and one of the commits will fail.
-    in_use = False
+    def _reserve_block(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """SELECT nextval(pg_get_serial_sequence(%s, 'id'))
+                FROM generate_series(1, %s)""",
+                [self.table, self.block_size],
+            )
+            return sorted(row[0] for row in cursor.fetchall())
 
-    def __init__(self):
-        self.current_id = None
 
-    def __enter__(self):
-        assert ReoIds.in_use is False
-        ReoIds.in_use = True
-
-        last_object = RegulatoryEffectObservation.objects.all().values_list("id", flat=True).order_by("-id")
-        if last_object.exists():
-            self.current_id = last_object[0]
-        else:
-            self.current_id = 0
-        return self
+class FeatureIds(SequenceIds):
+    table = "search_dnafeature"
 
-    def next_id(self):
-        return self.__next__()
 
-    def __iter__(self):
-        return self
+class ReoIds(SequenceIds):
+    table = "search_regulatoryeffectobservation"
 
-    def __next__(self):
-        self.current_id += 1
-        return self.current_id
 
-    def __exit__(self, exc_type, exc_value, exc_tb):
-        ReoIds.in_use = False
-        with connection.cursor() as cursor:
-            cursor.execute("ALTER SEQUENCE search_regulatoryeffect_id_seq RESTART WITH %s", (self.current_id,))
+class GencodeAnnotationIds(SequenceIds):
+    table = "search_gencodeannotation"
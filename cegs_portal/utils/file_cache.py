@@ -0,0 +1,148 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    mtime_ns: int
+    size: int
+
+
+class FileCache:
+    """
+    A process-wide cache of data loaded from files, bounded by the total size of the cached files.
+
+    Entries are keyed by file path and are reloaded when the file's modification time changes, so
+    regenerated files replace stale entries without a restart.
+
+    The cache is split into two LRU segments. New entries go into the "probationary" segment and are
+    moved into the "protected" segment when they are used again. A single request that loads many files
+    once (e.g., a large combined experiment view) only churns the probationary segment, leaving the
+    frequently used entries alone.
+    """
+
+    def __init__(self, max_bytes: int, protected_fraction: float = 0.8):
+        self.max_bytes = max_bytes
+        self.max_protected_bytes = int(max_bytes * protected_fraction)
+        self._probationary: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._protected: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._probationary_bytes = 0
+        self._protected_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def size(self) -> int:
+        return self._probationary_bytes + self._protected_bytes
+
+    def __len__(self) -> int:
+        return len(self._probationary) + len(self._protected)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def get(self, filename: str, loader: Callable[[str], Any]) -> Any:
+        """
+        Return the cached data for filename, calling loader(filename) if the file isn't cached
+        or has been modified since it was cached.
+        """
+        file_stat = os.stat(filename)
+
+        with self._lock:
+            if (entry := self._lookup(filename, file_stat.st_mtime_ns)) is not None:
+                self.hits += 1
+                return entry.value
+            self.misses += 1
+
+        # Load without holding the lock so different files can be loaded concurrently
+        value = loader(filename)
+
+        with self._lock:
+            self._insert(filename, CacheEntry(value, file_stat.st_mtime_ns, file_stat.st_size))
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._probationary.clear()
+            self._protected.clear()
+            self._probationary_bytes = 0
+            self._protected_bytes = 0
+
+    def _lookup(self, filename, mtime_ns):
+        if (entry := self._protected.get(filename)) is not None:
+            if entry.mtime_ns != mtime_ns:
+                self._remove(filename)
+                self.invalidations += 1
+                return None
+
+            self._protected.move_to_end(filename)
+            return entry
+
+        if (entry := self._probationary.get(filename)) is not None:
+            if entry.mtime_ns != mtime_ns:
+                self._remove(filename)
+                self.invalidations += 1
+                return None
+
+            # Second use, so promote it to the protected segment
+            del self._probationary[filename]
+            self._probationary_bytes -= entry.size
+            self._protected[filename] = entry
+            self._protected_bytes += entry.size
+            self._shrink_protected()
+            return entry
+
+        return None
+
+    def _insert(self, filename, entry):
+        # Another thread may have loaded the same file while the lock wasn't held
+        self._remove(filename)
+
+        if entry.size > self.max_bytes:
+            return
+
+        self._probationary[filename] = entry
+        self._probationary_bytes += entry.size
+        self._evict()
+
+    def _remove(self, filename):
+        if (entry := self._protected.pop(filename, None)) is not None:
+            self._protected_bytes -= entry.size
+        if (entry := self._probationary.pop(filename, None)) is not None:
+            self._probationary_bytes -= entry.size
+
+    def _shrink_protected(self):
+        # Entries pushed out of the protected segment get another chance in the probationary segment
+        while self._protected_bytes > self.max_protected_bytes and len(self._protected) > 1:
+            filename, entry = self._protected.popitem(last=False)
+            self._protected_bytes -= entry.size
+            self._probationary[filename] = entry
+            self._probationary_bytes += entry.size
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes:
+            if len(self._probationary) > 0:
+                _, entry = self._probationary.popitem(last=False)
+                self._probationary_bytes -= entry.size
+            else:
+                _, entry = self._protected.popitem(last=False)
+                self._protected_bytes -= entry.size
+            self.evictions += 1
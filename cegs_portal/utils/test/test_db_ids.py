@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.db import connection, transaction
+from psycopg.types.range import Int4Range
+
+from cegs_portal.search.models import DNAFeature, DNAFeatureType
+from cegs_portal.utils.db_ids import FeatureIds, ReoIds
+
+LOADER_COUNT = 4
+FEATURES_PER_LOADER = 250
+
+
+def load_features(loader):
+    # Each loader runs on its own connection, like an upload running in a separate huey worker
+    try:
+        with transaction.atomic(), FeatureIds(block_size=100) as feature_ids:
+            features = [
+                DNAFeature(
+                    id=feature_id,
+                    accession_id=f"DCPGRNA{loader:02X}{i:06X}",
+                    chrom_name="chr1",
+                    location=Int4Range(i, i + 10),
+                    ref_genome="GRCh38",
+                    feature_type=DNAFeatureType.GRNA,
+                )
+                for i, feature_id in zip(range(FEATURES_PER_LOADER), feature_ids)
+            ]
+            DNAFeature.objects.bulk_create(features)
+        return [feature.id for feature in features]
+    finally:
+        connection.close()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_parallel_loaders():
+    with ThreadPoolExecutor(max_workers=LOADER_COUNT) as executor:
+        loaded_ids = list(executor.map(load_features, range(LOADER_COUNT)))
+
+    all_ids = [feature_id for ids in loaded_ids for feature_id in ids]
+    assert len(set(all_ids)) == LOADER_COUNT * FEATURES_PER_LOADER
+    assert DNAFeature.objects.filter(id__in=all_ids).count() == LOADER_COUNT * FEATURES_PER_LOADER
+
+    # Rows created outside of the loaders don't collide with the reserved ids either
+    feature = DNAFeature.objects.create(
+        accession_id="DCPGRNAFF000000",
+        chrom_name="chr1",
+        location=Int4Range(0, 10),
+        ref_genome="GRCh38",
+        feature_type=DNAFeatureType.GRNA,
+    )
+    assert feature.id not in all_ids
+
+
+@pytest.mark.django_db
+def test_ids_are_increasing_and_unique():
+    with ReoIds(block_size=10) as reo_ids:
+        ids = [reo_ids.next_id() for _ in range(25)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == 25
@@ -0,0 +1,114 @@
+import os
+
+import pytest
+
+from cegs_portal.utils.file_cache import FileCache
+
+
+def write_file(path, size, mtime_ns=None):
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+    return str(path)
+
+
+class CountingLoader:
+    def __init__(self):
+        self.loads = []
+
+    def __call__(self, filename):
+        self.loads.append(filename)
+        return f"data: {filename}"
+
+
+@pytest.fixture
+def loader():
+    return CountingLoader()
+
+
+def test_hit_and_miss(tmp_path, loader):
+    cache = FileCache(max_bytes=100)
+    file = write_file(tmp_path / "a.ecd", 10)
+
+    assert cache.get(file, loader) == f"data: {file}"
+    assert cache.get(file, loader) == f"data: {file}"
+    assert loader.loads == [file]
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.size == 10
+
+
+def test_mtime_invalidation(tmp_path, loader):
+    cache = FileCache(max_bytes=100)
+    file = write_file(tmp_path / "a.ecd", 10, mtime_ns=1_000_000_000)
+
+    cache.get(file, loader)
+    write_file(tmp_path / "a.ecd", 20, mtime_ns=2_000_000_000)
+    cache.get(file, loader)
+
+    assert loader.loads == [file, file]
+    assert cache.invalidations == 1
+    assert cache.size == 20
+
+
+def test_evicts_by_size(tmp_path, loader):
+    cache = FileCache(max_bytes=25)
+    files = [write_file(tmp_path / f"{i}.ecd", 10) for i in range(3)]
+
+    for file in files:
+        cache.get(file, loader)
+
+    assert cache.evictions == 1
+    assert cache.size == 20
+    assert len(cache) == 2
+
+    cache.get(files[0], loader)
+    assert loader.loads == files + [files[0]]
+
+
+def test_too_large_not_cached(tmp_path, loader):
+    cache = FileCache(max_bytes=5)
+    file = write_file(tmp_path / "a.ecd", 10)
+
+    cache.get(file, loader)
+    cache.get(file, loader)
+
+    assert loader.loads == [file, file]
+    assert len(cache) == 0
+
+
+def test_scan_keeps_frequently_used(tmp_path, loader):
+    cache = FileCache(max_bytes=100)
+    hot_files = [write_file(tmp_path / f"hot_{i}.ecd", 10) for i in range(5)]
+    for file in hot_files:
+        cache.get(file, loader)
+        cache.get(file, loader)
+
+    # Load many files once each, like a large combined experiment view
+    for i in range(50):
+        cache.get(write_file(tmp_path / f"scan_{i}.ecd", 10), loader)
+
+    loader.loads.clear()
+    for file in hot_files:
+        cache.get(file, loader)
+
+    assert loader.loads == []
+    assert cache.size <= 100
+
+
+def test_stats(tmp_path, loader):
+    cache = FileCache(max_bytes=100)
+    file = write_file(tmp_path / "a.ecd", 10)
+    cache.get(file, loader)
+    cache.get(file, loader)
+
+    assert cache.stats() == {
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+        "invalidations": 0,
+        "entries": 1,
+        "bytes": 10,
+        "max_bytes": 100,
+    }
@@ -329,6 +329,32 @@ WHITENOISE_SKIP_COMPRESS_EXTENSIONS = (
     "fd",  # Feature Data
 )
 
+# How long, in seconds, filtered experiment coverage data stays in the cache
+COVERAGE_CACHE_TIMEOUT = env.int("COVERAGE_CACHE_TIMEOUT", default=60 * 60 * 24)
+# Maximum total size, in bytes, of the coverage and feature files each process keeps loaded
+COVERAGE_FILE_CACHE_MAX_BYTES = env.int("COVERAGE_FILE_CACHE_MAX_BYTES", default=1024 * 1024 * 1024)
+# Whether coverage and feature files are read through a memory map of the file instead of a read buffer
+COVERAGE_MAP_FILES = env.bool("COVERAGE_MAP_FILES", default=False)
+# How many cov_viz runs generate an analysis's coverage files at once. Each run reads the analysis from the
+# database, so this bounds the load coverage generation puts on it.
+COVERAGE_GEN_WORKERS = env.int("COVERAGE_GEN_WORKERS", default=2)
+# The largest region, in bases, the coverage window API returns. Regions are also clamped to their chromosome.
+COVERAGE_WINDOW_MAX_SPAN = env.int("COVERAGE_WINDOW_MAX_SPAN", default=250_000_000)
+# The COPY format used to load uploaded data, "text" or "binary"
+UPLOAD_COPY_FORMAT = env.str("UPLOAD_COPY_FORMAT", default="text")
+# Find the cCREs overlapping uploaded features with a join in the database, instead of reading every cCRE
+UPLOAD_CCRE_OVERLAP_IN_DB = env.bool("UPLOAD_CCRE_OVERLAP_IN_DB", default=True)
+# Parse uploaded tested elements and observations files a batch of columns at a time, instead of line by line
+UPLOAD_COLUMNAR_PARSE = env.bool("UPLOAD_COLUMNAR_PARSE", default=False)
+# How many bytes of an uploaded file, or a file downloaded for an upload, are read at a time
+UPLOAD_STREAM_CHUNK_SIZE = env.int("UPLOAD_STREAM_CHUNK_SIZE", default=1_048_576)
+# Tables that an upload adds at least this many rows to are analyzed once the upload commits
+UPLOAD_ANALYZE_ROWS = env.int("UPLOAD_ANALYZE_ROWS", default=500_000)
+# How many of an analysis's REOs are denormalized together when adding it to ReoSourcesTargets
+DENORMALIZE_REO_RANGE_SIZE = env.int("DENORMALIZE_REO_RANGE_SIZE", default=100_000)
+# How many REO id ranges are denormalized at once, each on its own database connection
+DENORMALIZE_WORKERS = env.int("DENORMALIZE_WORKERS", default=4)
+
 IGVF_HOST = env("IGVF_HOST", default=None)
 IGVF_DB = env("IGVF_DB", default=None)
 IGVF_USERNAME = env("IGVF_USERNAME", default=None)
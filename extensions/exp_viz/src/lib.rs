@@ -14,7 +14,7 @@ use crate::load::{
     load_feature_data_allow_threads,
 };
 use crate::merge::merge_filtered_data;
-use crate::set_ops::PyExperimentFeatureData;
+use crate::set_ops::{calc_feature_set, calc_feature_set_allow_threads, PyExperimentFeatureData};
 
 /// A Python module implemented in Rust.
 #[pymodule]
@@ -26,6 +26,8 @@ fn exp_viz(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_function(wrap_pyfunction!(filter_coverage_data, m)?)?;
     m.add_function(wrap_pyfunction!(filter_coverage_data_allow_threads, m)?)?;
     m.add_function(wrap_pyfunction!(merge_filtered_data, m)?)?;
+    m.add_function(wrap_pyfunction!(calc_feature_set, m)?)?;
+    m.add_function(wrap_pyfunction!(calc_feature_set_allow_threads, m)?)?;
     m.add_class::<PyCoverageType>()?;
     m.add_class::<PyExperimentFeatureData>()?;
     m.add_class::<PyFilter>()?;
@@ -1,5 +1,10 @@
 use pyo3::exceptions::PyOSError;
 use pyo3::prelude::*;
+use serde::de::DeserializeOwned;
+use std::fs::File;
+use std::io;
+use std::ops::Deref;
+use std::os::unix::io::AsRawFd;
 use std::path::PathBuf;
 
 use cov_viz_ds::{CoverageData, ExperimentFeatureData};
@@ -7,40 +12,120 @@ use cov_viz_ds::{CoverageData, ExperimentFeatureData};
 use crate::filter_data_structures::PyCoverageData;
 use crate::PyExperimentFeatureData;
 
+/// A read-only, shared memory map of a whole file. The file is unmapped when this is dropped.
+struct MappedFile {
+    ptr: *mut libc::c_void,
+    len: usize,
+}
+
+impl MappedFile {
+    fn open(location: &PathBuf) -> io::Result<MappedFile> {
+        let file = File::open(location)?;
+        let len = file.metadata()?.len() as usize;
+        if len == 0 {
+            return Ok(MappedFile {
+                ptr: std::ptr::null_mut(),
+                len,
+            });
+        }
+
+        // Safety: the mapping is read-only and private to this struct. Coverage files are written once,
+        // when an analysis is loaded, and are replaced, not modified, when they are regenerated, so the
+        // mapped file doesn't change while it's being read.
+        let ptr = unsafe {
+            libc::mmap(
+                std::ptr::null_mut(),
+                len,
+                libc::PROT_READ,
+                libc::MAP_SHARED,
+                file.as_raw_fd(),
+                0,
+            )
+        };
+        if ptr == libc::MAP_FAILED {
+            return Err(io::Error::last_os_error());
+        }
+
+        Ok(MappedFile { ptr, len })
+    }
+}
+
+impl Deref for MappedFile {
+    type Target = [u8];
+
+    fn deref(&self) -> &[u8] {
+        if self.len == 0 {
+            return &[];
+        }
+        unsafe { std::slice::from_raw_parts(self.ptr as *const u8, self.len) }
+    }
+}
+
+impl Drop for MappedFile {
+    fn drop(&mut self) {
+        if self.len > 0 {
+            unsafe {
+                libc::munmap(self.ptr, self.len);
+            }
+        }
+    }
+}
+
+/// Deserializes a bincode file directly from a memory map of it, rather than through a read buffer.
+/// The file's pages come from the OS page cache, which is shared by every worker process.
+fn deserialize_mapped<T: DeserializeOwned>(location: &PathBuf) -> Result<T, String> {
+    let mapped = MappedFile::open(location).map_err(|e| e.to_string())?;
+    bincode::deserialize(&mapped).map_err(|e| e.to_string())
+}
+
 /// Loads the coverage data from disk
 #[pyfunction]
-pub fn load_coverage_data(location: PathBuf) -> PyResult<PyCoverageData> {
-    let result = match CoverageData::deserialize(&location) {
-        Ok(data) => Ok(PyCoverageData { wraps: data }),
-        Err(e) => Err(PyOSError::new_err(e.to_string())),
+#[pyo3(signature = (location, mapped=false))]
+pub fn load_coverage_data(location: PathBuf, mapped: bool) -> PyResult<PyCoverageData> {
+    let data = if mapped {
+        deserialize_mapped::<CoverageData>(&location)
+    } else {
+        CoverageData::deserialize(&location).map_err(|e| e.to_string())
     };
 
-    result
+    match data {
+        Ok(data) => Ok(PyCoverageData { wraps: data }),
+        Err(e) => Err(PyOSError::new_err(e)),
+    }
 }
 
 #[pyfunction]
+#[pyo3(signature = (location, mapped=false))]
 pub fn load_coverage_data_allow_threads(
     py: Python<'_>,
     location: PathBuf,
+    mapped: bool,
 ) -> PyResult<PyCoverageData> {
-    py.allow_threads(|| load_coverage_data(location))
+    py.allow_threads(|| load_coverage_data(location, mapped))
 }
 
 /// Loads the experiment feature data from disk
 #[pyfunction]
-pub fn load_feature_data(location: PathBuf) -> PyResult<PyExperimentFeatureData> {
-    let result = match ExperimentFeatureData::deserialize(&location) {
-        Ok(data) => Ok(PyExperimentFeatureData { data }),
-        Err(e) => Err(PyOSError::new_err(e.to_string())),
+#[pyo3(signature = (location, mapped=false))]
+pub fn load_feature_data(location: PathBuf, mapped: bool) -> PyResult<PyExperimentFeatureData> {
+    let data = if mapped {
+        deserialize_mapped::<ExperimentFeatureData>(&location)
+    } else {
+        ExperimentFeatureData::deserialize(&location).map_err(|e| e.to_string())
     };
 
-    result
+    match data {
+        Ok(data) => Ok(PyExperimentFeatureData { data }),
+        Err(e) => Err(PyOSError::new_err(e)),
+    }
 }
 
 #[pyfunction]
+#[pyo3(signature = (location, mapped=false))]
 pub fn load_feature_data_allow_threads(
     py: Python<'_>,
     location: PathBuf,
+    mapped: bool,
 ) -> PyResult<PyExperimentFeatureData> {
-    py.allow_threads(|| load_feature_data(location))
+    py.allow_threads(|| load_feature_data(location, mapped))
 }
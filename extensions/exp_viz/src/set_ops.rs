@@ -1,7 +1,16 @@
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
+use rustc_hash::FxHashMap;
+use std::borrow::Cow;
+use std::collections::HashMap;
+use std::thread;
 
 use cov_viz_ds::ExperimentFeatureData;
 
+// Subexpressions at this depth or deeper in the expression tree are evaluated on the current thread,
+// which bounds the number of threads used to 2^MAX_PARALLEL_DEPTH.
+const MAX_PARALLEL_DEPTH: usize = 4;
+
 #[derive(Clone, Debug)]
 #[pyclass(name = "ExperimentFeatureData")]
 pub struct PyExperimentFeatureData {
@@ -18,3 +27,138 @@ impl PyExperimentFeatureData {
         self.data.intersection(&other.data);
     }
 }
+
+#[derive(Clone, Copy, Debug)]
+enum SetOp {
+    Intersection,
+    Union,
+}
+
+enum SetExpr<'a> {
+    Features(&'a ExperimentFeatureData),
+    Op(SetOp, Box<SetExpr<'a>>, Box<SetExpr<'a>>),
+}
+
+impl<'a> SetExpr<'a> {
+    /// Builds an expression tree from a list of set operations in reverse polish notation,
+    /// e.g., ["A", "B", "i", "C", "u"] is (A ∩ B) ∪ C
+    fn parse(
+        combinations: &[String],
+        features: &FxHashMap<&str, &'a ExperimentFeatureData>,
+    ) -> Result<SetExpr<'a>, String> {
+        let mut stack: Vec<SetExpr<'a>> = Vec::new();
+        for item in combinations {
+            let op = match item.as_str() {
+                "i" => SetOp::Intersection,
+                "u" => SetOp::Union,
+                name => {
+                    let data = features
+                        .get(name)
+                        .ok_or_else(|| format!("No features for {}", name))?;
+                    stack.push(SetExpr::Features(data));
+                    continue;
+                }
+            };
+
+            let right = stack.pop();
+            let left = stack.pop();
+            match (left, right) {
+                (Some(left), Some(right)) => {
+                    stack.push(SetExpr::Op(op, Box::new(left), Box::new(right)))
+                }
+                _ => {
+                    return Err(format!(
+                        "Invalid set operations: [{}]",
+                        combinations.join(", ")
+                    ))
+                }
+            }
+        }
+
+        if stack.len() != 1 {
+            return Err(format!(
+                "Invalid set operations: [{}]",
+                combinations.join(", ")
+            ));
+        }
+
+        Ok(stack.pop().unwrap())
+    }
+
+    /// Evaluates the expression without modifying any of the input features. Features are only
+    /// copied when they are the first operand of an operation; independent subexpressions
+    /// are evaluated in parallel.
+    fn eval(&self, depth: usize) -> Cow<'a, ExperimentFeatureData> {
+        match self {
+            SetExpr::Features(data) => Cow::Borrowed(*data),
+            SetExpr::Op(op, left, right) => {
+                let (left, right) = if depth < MAX_PARALLEL_DEPTH
+                    && matches!(**left, SetExpr::Op(..))
+                    && matches!(**right, SetExpr::Op(..))
+                {
+                    thread::scope(|s| {
+                        let left = s.spawn(|| left.eval(depth + 1));
+                        let right = right.eval(depth + 1);
+                        (left.join().unwrap(), right)
+                    })
+                } else {
+                    (left.eval(depth + 1), right.eval(depth + 1))
+                };
+
+                // Union and intersection are commutative, so reuse an already owned result
+                // as the accumulator if there is one.
+                let (mut acc, other) = match (left, right) {
+                    (left, Cow::Owned(right)) if matches!(left, Cow::Borrowed(_)) => (right, left),
+                    (left, right) => (left.into_owned(), right),
+                };
+
+                match op {
+                    SetOp::Intersection => acc.intersection(&other),
+                    SetOp::Union => acc.union(&other),
+                }
+
+                Cow::Owned(acc)
+            }
+        }
+    }
+}
+
+/// Evaluates a list of set operations in reverse polish notation over experiment features,
+/// returning a new set of features. The features passed in are not modified.
+#[pyfunction]
+pub fn calc_feature_set(
+    combinations: Vec<String>,
+    features: HashMap<String, PyRef<PyExperimentFeatureData>>,
+) -> PyResult<PyExperimentFeatureData> {
+    let feature_data: FxHashMap<&str, &ExperimentFeatureData> = features
+        .iter()
+        .map(|(name, features)| (name.as_str(), &features.data))
+        .collect();
+
+    eval_feature_set(&combinations, &feature_data)
+}
+
+#[pyfunction]
+pub fn calc_feature_set_allow_threads(
+    py: Python<'_>,
+    combinations: Vec<String>,
+    features: HashMap<String, PyRef<PyExperimentFeatureData>>,
+) -> PyResult<PyExperimentFeatureData> {
+    let feature_data: FxHashMap<&str, &ExperimentFeatureData> = features
+        .iter()
+        .map(|(name, features)| (name.as_str(), &features.data))
+        .collect();
+
+    py.allow_threads(|| eval_feature_set(&combinations, &feature_data))
+}
+
+fn eval_feature_set(
+    combinations: &[String],
+    features: &FxHashMap<&str, &ExperimentFeatureData>,
+) -> PyResult<PyExperimentFeatureData> {
+    let expr = SetExpr::parse(combinations, features).map_err(PyValueError::new_err)?;
+
+    Ok(PyExperimentFeatureData {
+        data: expr.eval(0).into_owned(),
+    })
+}
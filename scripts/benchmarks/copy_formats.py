@@ -0,0 +1,90 @@
+import time
+
+from django.db import connection, transaction
+from psycopg.types.range import Int4Range
+
+from cegs_portal.search.models import DNAFeatureType
+from cegs_portal.uploads.data_loading.db import (
+    COPY_SPOOLS,
+    FEATURE_COLUMNS,
+    REO_COLUMNS,
+    copy_rows,
+    feature_entry,
+    reo_entry,
+)
+
+
+def feature_rows(row_count):
+    for i in range(row_count):
+        yield feature_entry(
+            id_=i,
+            accession_id=f"DCPGRNA{i:08X}",
+            chrom_name="chr1",
+            location=Int4Range(i * 100, i * 100 + 20),
+            genome_assembly="GRCh38",
+            feature_type=DNAFeatureType.GRNA,
+            name=f"guide {i}",
+            closest_gene_id=i % 20_000,
+            closest_gene_distance=i % 10_000,
+            closest_gene_name=f"GENE{i % 20_000}",
+            closest_gene_ensembl_id=f"ENSG{i % 20_000:011}",
+            strand="+",
+            experiment_accession_id="DCPEXPR0000000000",
+            misc={"grna": f"guide {i}"},
+        )
+
+
+def reo_rows(row_count):
+    for i in range(row_count):
+        yield reo_entry(
+            id_=i,
+            name=None,
+            accession_id=f"DCPREO{i:010X}",
+            experiment_id=1,
+            experiment_accession_id="DCPEXPR0000000000",
+            analysis_accession_id="DCPAN0000000000",
+            facet_num_values={"Effect Size": (i % 7) - 3.5, "Significance": 0.05, "Raw p value": 0.01},
+        )
+
+
+def load(copy_format, table, columns, rows):
+    with COPY_SPOOLS[copy_format]([column_type for _, column_type in columns]) as spool:
+        start_time = time.perf_counter()
+        for row in rows:
+            spool.write_row(row)
+        spool_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        with connection.cursor() as cursor:
+            copy_rows(cursor, table, columns, spool)
+        copy_time = time.perf_counter() - start_time
+    return spool_time, copy_time
+
+
+def run(row_count: int = 1_000_000):
+    """
+    Compares loading DNAFeature and RegulatoryEffectObservation rows with text COPY against binary COPY, in
+    rows/sec. Both include spooling the rows and the COPY itself. The rows are copied into temporary tables
+    (without indexes or constraints) that are dropped when the benchmark finishes.
+    """
+    tables = [
+        ("search_dnafeature", FEATURE_COLUMNS, feature_rows),
+        ("search_regulatoryeffectobservation", REO_COLUMNS, reo_rows),
+    ]
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            for table, _, _ in tables:
+                cursor.execute(f"CREATE TEMPORARY TABLE bench_{table} (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+
+        for table, columns, rows in tables:
+            for copy_format in COPY_SPOOLS:
+                spool_time, copy_time = load(copy_format, f"bench_{table}", columns, rows(row_count))
+                total_time = spool_time + copy_time
+                print(
+                    f"{table} {copy_format}: {row_count / total_time:,.0f} rows/sec "
+                    f"(spooling {spool_time:.3f}s, COPY {copy_time:.3f}s)"
+                )
+
+                with connection.cursor() as cursor:
+                    cursor.execute(f"TRUNCATE bench_{table}")
@@ -0,0 +1,21 @@
+import time
+
+from django.test import override_settings
+
+from cegs_portal.get_expr_data.models import ReoSourcesTargets
+
+
+def run(analysis_accession: str, worker_counts: str = "1,2,4,8"):
+    """
+    Compares adding an analysis to ReoSourcesTargets (and ReoSourcesTargetsSigOnly) with different numbers of
+    parallel workers, in rows/sec. Loading an analysis replaces its existing rows, so the tables are left as
+    they were.
+    """
+    for worker_count in [int(count) for count in worker_counts.split(",")]:
+        with override_settings(DENORMALIZE_WORKERS=worker_count):
+            start_time = time.perf_counter()
+            row_count = ReoSourcesTargets.load_analysis(analysis_accession)
+            total_time = time.perf_counter() - start_time
+        print(
+            f"{worker_count} worker(s): {row_count / total_time:,.0f} rows/sec ({row_count:,} rows in {total_time:.3f}s)"
+        )
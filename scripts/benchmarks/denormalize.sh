@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+ANALYSIS_ACCESSION=${1}
+WORKER_COUNTS=${2:-1,2,4,8}
+
+python manage.py shell -c "from scripts.benchmarks import denormalize; denormalize.run(\"${ANALYSIS_ACCESSION}\", \"${WORKER_COUNTS}\")"
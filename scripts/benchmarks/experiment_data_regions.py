@@ -0,0 +1,61 @@
+import random
+import time
+
+from cegs_portal.get_expr_data.view_models import (
+    Facets,
+    ReoDataSource,
+    retrieve_experiment_data,
+)
+from cegs_portal.search.models import Experiment
+
+CHROMS = [f"chr{i}" for i in range(1, 23)] + ["chrX", "chrY"]
+CHROM_LENGTH = 150_000_000
+REGION_SIZE = 10_000
+
+
+def random_regions(count: int, seed: int = 42) -> list[tuple[str, int, int]]:
+    rng = random.Random(seed)
+    regions = []
+    for _ in range(count):
+        start = rng.randrange(0, CHROM_LENGTH - REGION_SIZE)
+        regions.append((rng.choice(CHROMS), start, start + REGION_SIZE))
+    return regions
+
+
+def per_region(experiments, regions, data_source):
+    # This is how multi-region queries worked before they were batched: one query per region, with
+    # the results deduplicated in python.
+    experiment_data = set()
+    for region in regions:
+        experiment_data.update(retrieve_experiment_data([], [region], experiments, None, Facets(), data_source))
+    return experiment_data
+
+
+def batched(experiments, regions, data_source):
+    return set(retrieve_experiment_data([], regions, experiments, None, Facets(), data_source))
+
+
+def run(region_counts: str = "10,1000,10000", data_source: str = "BOTH"):
+    """
+    Compares querying each region of a multi-region (i.e., BED file) download separately against querying all
+    the regions in a single statement.
+    """
+    source = ReoDataSource[data_source]
+    experiments = list(Experiment.objects.filter(archived=False).values_list("accession_id", flat=True))
+
+    for count in (int(c) for c in region_counts.split(",")):
+        regions = random_regions(count)
+
+        start_time = time.perf_counter()
+        per_region_data = per_region(experiments, regions, source)
+        per_region_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        batched_data = batched(experiments, regions, source)
+        batched_time = time.perf_counter() - start_time
+
+        assert per_region_data == batched_data
+        print(
+            f"{count} regions ({len(batched_data)} rows): per-region {per_region_time:.3f}s, "
+            f"batched {batched_time:.3f}s ({per_region_time / max(batched_time, 1e-9):.1f}x)"
+        )
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+REGION_COUNTS=${1:-10,1000,10000}
+DATA_SOURCE=${2:-BOTH}
+
+python manage.py shell -c "from scripts.benchmarks import experiment_data_regions; experiment_data_regions.run(\"${REGION_COUNTS}\", \"${DATA_SOURCE}\")"
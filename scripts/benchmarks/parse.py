@@ -0,0 +1,120 @@
+import csv
+import os
+import random
+import tempfile
+import time
+from collections import deque
+
+from cegs_portal.uploads.data_loading.analysis import (
+    parse_observation_columns,
+    parse_observations,
+)
+from cegs_portal.uploads.data_loading.columnar import read_column_batches
+from cegs_portal.uploads.data_loading.experiment import (
+    parse_tested_element_columns,
+    parse_tested_elements,
+)
+
+DIRECTIONS = ["Enriched Only", "Depleted Only", "Non-significant"]
+OBSERVATIONS_HEADER = [
+    "chrom",
+    "start",
+    "end",
+    "strand",
+    "bounds",
+    "gene_name",
+    "gene_ensembl_id",
+    "raw_p_val",
+    "adj_p_val",
+    "effect_size",
+    "facets",
+]
+TESTED_ELEMENTS_HEADER = [
+    "chrom",
+    "start",
+    "end",
+    "strand",
+    "bounds",
+    "parent_chrom",
+    "parent_start",
+    "parent_end",
+    "parent_strand",
+    "parent_bounds",
+    "facets",
+    "misc",
+]
+
+
+def write_observations(file, row_count):
+    rng = random.Random(42)
+    file.write("\t".join(OBSERVATIONS_HEADER) + "\n")
+    for i in range(row_count):
+        start = rng.randrange(100_000_000)
+        file.write(
+            f"chr{rng.randint(1, 22)}\t{start}\t{start + 200}\t.\t[)\tGENE{i % 1000}\tENSG{i % 1000:011d}\t"
+            f"{rng.random()}\t{rng.random()}\t{rng.uniform(-1, 1)}\tDirection={rng.choice(DIRECTIONS)}\n"
+        )
+
+
+def write_tested_elements(file, row_count):
+    rng = random.Random(42)
+    file.write("\t".join(TESTED_ELEMENTS_HEADER) + "\n")
+    for _ in range(row_count):
+        start = rng.randrange(100_000_000)
+        chrom = f"chr{rng.randint(1, 22)}"
+        file.write(
+            f"{chrom}\t{start}\t{start + 20}\t+\t[)\t{chrom}\t{start - 100}\t{start + 100}\t+\t[)\t"
+            f"gRNA type=targeting\tguide={rng.choice('ACGT') * 20}\n"
+        )
+
+
+def timed(f, filename):
+    with open(filename, newline="") as file:
+        start_time = time.perf_counter()
+        # Only the parsing is timed, so the rows are thrown away as they're made
+        deque(f(file), maxlen=0)
+        return time.perf_counter() - start_time
+
+
+def run(row_count: int = 10_000_000):
+    """
+    Compares the parse throughput, in rows/sec, of reading observations and tested elements files line by line
+    with csv.DictReader against reading them a batch of columns at a time. The files have row_count rows of
+    random data.
+    """
+
+    def dict_reader(file):
+        return csv.DictReader(file, delimiter="\t", quoting=csv.QUOTE_NONE)
+
+    benchmarks = [
+        (
+            "observations",
+            write_observations,
+            [
+                ("csv.DictReader", lambda file: parse_observations(dict_reader(file), "DHS", DIRECTIONS)),
+                (
+                    "columnar",
+                    lambda file: parse_observation_columns(read_column_batches(file), "DHS", DIRECTIONS),
+                ),
+            ],
+        ),
+        (
+            "tested elements",
+            write_tested_elements,
+            [
+                ("csv.DictReader", lambda file: parse_tested_elements(dict_reader(file))),
+                ("columnar", lambda file: parse_tested_element_columns(read_column_batches(file))),
+            ],
+        ),
+    ]
+
+    for file_type, write_file, parsers in benchmarks:
+        with tempfile.NamedTemporaryFile("w", suffix=".tsv", delete=False) as file:
+            write_file(file, row_count)
+
+        try:
+            for name, f in parsers:
+                total_time = timed(f, file.name)
+                print(f"{file_type}, {name}: {row_count / total_time:,.0f} rows/sec ({total_time:.3f}s)")
+        finally:
+            os.remove(file.name)
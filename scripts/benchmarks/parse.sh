@@ -0,0 +1,6 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+ROW_COUNT=${1:-10000000}
+
+python manage.py shell -c "from scripts.benchmarks import parse; parse.run(${ROW_COUNT})"
@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+ROW_COUNT=${1:-100000}
+FEATURE_COUNT=${2:-10000}
+
+python manage.py shell -c "from scripts.benchmarks import source_flagging; source_flagging.run(${ROW_COUNT}, ${FEATURE_COUNT})"
@@ -0,0 +1,82 @@
+import csv
+import multiprocessing
+import resource
+import time
+from io import StringIO
+
+from cegs_portal.uploads.data_loading.analysis import ObservationRow
+from cegs_portal.uploads.data_loading.db import CopySpool, reo_entry, text_row
+from cegs_portal.uploads.data_loading.types import Facets
+
+OBSERVATION_HEADER = ["chrom", "start", "end", "strand", "gene_ensembl_id", "raw_p_val", "adj_p_val", "effect_size"]
+
+
+class NullCopy:
+    # Stands in for a psycopg COPY so the benchmark doesn't need a database
+    def write(self, data):
+        pass
+
+
+def observation_lines(row_count):
+    yield "\t".join(OBSERVATION_HEADER) + "\n"
+    for i in range(row_count):
+        yield f"chr1\t{i * 100}\t{i * 100 + 20}\t+\tENSG{i % 20_000:011}\t0.01\t0.05\t{(i % 7) - 3.5}\n"
+
+
+def parse(row_count):
+    for line in csv.DictReader(observation_lines(row_count), delimiter="\t", quoting=csv.QUOTE_NONE):
+        yield ObservationRow(
+            None,
+            [(line["chrom"], int(line["start"]), int(line["end"]), line["strand"])],
+            [line["gene_ensembl_id"]],
+            [],
+            {
+                Facets.EFFECT_SIZE: float(line["effect_size"]),
+                Facets.SIGNIFICANCE: float(line["adj_p_val"]),
+                Facets.RAW_P_VALUE: float(line["raw_p_val"]),
+            },
+        )
+
+
+def effect_row(reo_id, observation):
+    facet_num_values = {key.value: value for key, value in observation.numeric_facets.items()}
+    return reo_entry(reo_id, None, f"DCPREO{reo_id:010X}", 1, "DCPEXPR0000000000", "DCPAN0000000000", facet_num_values)
+
+
+def buffered(row_count):
+    # How uploads were loaded before streaming: every observation in a list, then all the COPY data in a StringIO
+    observations = list(parse(row_count))
+    effects = StringIO()
+    for reo_id, observation in enumerate(observations):
+        effects.write(text_row(effect_row(reo_id, observation)))
+    NullCopy().write(effects.getvalue())
+
+
+def streaming(row_count):
+    with CopySpool() as effects:
+        for reo_id, observation in enumerate(parse(row_count)):
+            effects.write_row(effect_row(reo_id, observation))
+        effects.copy_to(NullCopy())
+
+
+def _measure(loader, row_count, results):
+    start_time = time.perf_counter()
+    loader(row_count)
+    elapsed = time.perf_counter() - start_time
+    # ru_maxrss is in kilobytes on Linux
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def run(row_count: int = 1_000_000):
+    """
+    Compares peak RSS of loading an analysis's observations into COPY data all at once against streaming them
+    through a CopySpool. Each loader runs in its own process so their peak RSS is measured separately.
+    """
+    context = multiprocessing.get_context("fork")
+    for name, loader in [("buffered", buffered), ("streaming", streaming)]:
+        results = context.Queue()
+        process = context.Process(target=_measure, args=(loader, row_count, results))
+        process.start()
+        elapsed, peak_rss = results.get()
+        process.join()
+        print(f"{name}: {row_count} observations in {elapsed:.3f}s, peak RSS {peak_rss:.1f} MiB")
@@ -0,0 +1,6 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+ROW_COUNT=${1:-1000000}
+
+python manage.py shell -c "from scripts.benchmarks import upload_memory; upload_memory.run(${ROW_COUNT})"
@@ -0,0 +1,190 @@
+import math
+import os
+import struct
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+import numpy as np
+from django.db import connection
+
+from cegs_portal.search.models import Analysis
+from cegs_portal.uploads.data_generation.observations import (
+    NO_FEATURE,
+    OBSERVATION_COLUMNS,
+    OBSERVATIONS_FETCH_ROWS,
+    AnalysisObservations,
+    _control_facet_ids,
+    concat_observation_columns,
+    observation_columns,
+)
+from cegs_portal.uploads.data_generation.qq_plot import MIN_SIG, gen_qq_plot
+from cegs_portal.uploads.data_generation.volcano_plot import gen_volcano_plot
+
+P_VALUE_THRESHOLD = 0.05
+
+LEGACY_COLUMN_TYPES = [
+    ("reo_id", "int8"),
+    ("effect_size", "float8"),
+    ("adj_p_value", "float8"),
+    ("raw_p_value", "float8"),
+    ("log_significance", "float8"),
+    ("target_gene_symbol", "text"),
+    ("targeting_category", "int4"),
+    ("cat_facets", "int8[]"),
+    ("source_id", "int8"),
+    ("source_chrom", "text"),
+    ("source_start", "int4"),
+    ("source_end", "int4"),
+    ("target_id", "int8"),
+    ("target_chrom", "text"),
+    ("target_start", "int4"),
+    ("target_end", "int4"),
+]
+LEGACY_OBSERVATIONS_QUERY = """COPY (
+    SELECT reo_id, effect_size, adj_p_value, raw_p_value, log_significance, target_gene_symbol,
+        CASE WHEN cat_facets && %s::bigint[] THEN 0 WHEN cat_facets && %s::bigint[] THEN 1 ELSE 0 END,
+        cat_facets,
+        source_id, source_chrom, lower(source_loc), upper(source_loc),
+        target_id, target_chrom, lower(target_loc), upper(target_loc)
+    FROM get_expr_data_reo_sources_targets
+    WHERE reo_analysis = %s
+) TO STDOUT (FORMAT BINARY)"""
+
+
+def synthetic_columns(row_count: int, seed: int = 42) -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    raw_p_value = rng.uniform(0, 1, row_count)
+    gene_numbers = np.arange(row_count) % 20_000
+    return {
+        "reo_id": np.arange(row_count, dtype=np.int64),
+        "effect_size": rng.normal(0, 0.5, row_count),
+        "adj_p_value": np.minimum(raw_p_value * 10, 1),
+        "raw_p_value": raw_p_value,
+        "log_significance": -np.log10(np.maximum(raw_p_value, MIN_SIG)),
+        "target_gene_symbol": np.where(
+            np.arange(row_count) % 2 == 0, np.char.add(b"GENE", gene_numbers.astype("S5")), b""
+        ),
+        "targeting_category": (rng.uniform(0, 1, row_count) < 0.05).astype(np.int32),
+        "source_id": np.arange(row_count, dtype=np.int64),
+        "source_start": np.arange(0, row_count * 10, 10, dtype=np.int32),
+        "source_end": np.arange(20, row_count * 10 + 20, 10, dtype=np.int32),
+        "target_id": np.full(row_count, NO_FEATURE, dtype=np.int64),
+        "target_start": np.zeros(row_count, dtype=np.int32),
+        "target_end": np.zeros(row_count, dtype=np.int32),
+        "source_chrom": np.full(row_count, b"chr1"),
+        "target_chrom": np.full(row_count, b""),
+        "cat_facets": np.ones((row_count, 1), dtype=np.int64),
+    }
+
+
+def row_by_row(rows, analysis_dir):
+    # This is how the QQ and volcano plot data were calculated before they were vectorized: one python
+    # iteration per observation.
+    qq_data = {0: [], 1: []}
+    with open(os.path.join(analysis_dir, "vpdata.pd"), "wb") as out_file:
+        for p_val, raw_p_val, p_val_log_10, avg_log_fc, gene_symbol, category in zip(
+            rows["adj_p_value"],
+            rows["raw_p_value"],
+            rows["log_significance"],
+            rows["effect_size"],
+            rows["target_gene_symbol"],
+            rows["targeting_category"],
+        ):
+            qq_data[category].append(-math.log10(max(float(raw_p_val), MIN_SIG)))
+            if p_val > P_VALUE_THRESHOLD and abs(avg_log_fc) < 1:
+                continue
+
+            symbol = b"" if gene_symbol is None else gene_symbol.encode("utf-8")
+            out_file.write(struct.pack(f">ffBB{len(symbol)}s", p_val_log_10, avg_log_fc, category, len(symbol), symbol))
+
+    sample_size = min(len(x) for x in qq_data.values())
+    quantile_count = min(10_000, sample_size)
+    percentiles = [x * (1 / quantile_count) for x in range(1, 1 + quantile_count)]
+    return [np.quantile(np.array(qq_data[category]), q=percentiles) for category in qq_data]
+
+
+def legacy_rows(analysis):
+    # This is how the observations were read before they were fetched in batches of columns: psycopg
+    # decodes each row of the binary COPY into a tuple, and the tuples are zipped into columns.
+    non_ctrl, ctrl = _control_facet_ids()
+    with connection.cursor() as cursor:
+        with cursor.copy(LEGACY_OBSERVATIONS_QUERY, [non_ctrl, ctrl, analysis.accession_id]) as copy:
+            copy.set_types([column_type for _, column_type in LEGACY_COLUMN_TYPES])
+            rows = list(copy.rows())
+
+    if len(rows) == 0:
+        return {name: [] for name, _ in LEGACY_COLUMN_TYPES}
+    return {name: values for (name, _), values in zip(LEGACY_COLUMN_TYPES, zip(*rows))}
+
+
+def vectorized(observations, analysis_dir):
+    analysis = SimpleNamespace(accession_id="benchmark", p_value_threshold=P_VALUE_THRESHOLD)
+    gen_volcano_plot(analysis, analysis_dir, observations)
+    gen_qq_plot(analysis, analysis_dir, observations)
+
+
+def timed(f, *args):
+    start_time = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start_time
+
+
+def run(row_count: int = 5_000_000, analysis_accession: Optional[str] = None):
+    """
+    Compares generating volcano and QQ plot data row by row against the vectorized generators.
+
+    For a synthetic analysis only the plot generation is compared, since the row by row rows are built in memory.
+    Converting the synthetic rows, as they're fetched from the database, into columns is timed separately. If analysis_accession is given,
+    both ways are also timed end to end for that analysis, including reading its observations from the database.
+    """
+    columns = synthetic_columns(row_count)
+    rows = {name: values.tolist() for name, values in columns.items()}
+    rows["target_gene_symbol"] = [symbol.decode() if symbol else None for symbol in rows["target_gene_symbol"]]
+    # The rows as they're fetched from the database
+    db_rows = list(
+        zip(
+            *[
+                [symbol.decode() for symbol in values.tolist()] if values.dtype.kind == "S" else values.tolist()
+                for values in (columns[name] for name, _ in OBSERVATION_COLUMNS)
+            ]
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as analysis_dir:
+        _, row_time = timed(row_by_row, rows, analysis_dir)
+        observations, columns_time = timed(
+            lambda: AnalysisObservations.from_columns(
+                concat_observation_columns(
+                    [
+                        observation_columns(db_rows[start : start + OBSERVATIONS_FETCH_ROWS])
+                        for start in range(0, len(db_rows), OBSERVATIONS_FETCH_ROWS)
+                    ]
+                )
+            )
+        )
+        _, vectorized_time = timed(vectorized, observations, analysis_dir)
+
+    print(
+        f"{row_count} synthetic observations: plots row by row {row_time:.3f}s, vectorized {vectorized_time:.3f}s "
+        f"({row_time / max(vectorized_time, 1e-9):.1f}x); converting the fetched rows into columns {columns_time:.3f}s"
+    )
+
+    if analysis_accession is not None:
+        analysis = Analysis.objects.get(accession_id=analysis_accession)
+        with tempfile.TemporaryDirectory() as analysis_dir:
+            legacy, legacy_read_time = timed(legacy_rows, analysis)
+            _, legacy_plot_time = timed(row_by_row, legacy, analysis_dir)
+            del legacy
+            observations, read_time = timed(AnalysisObservations.load, analysis)
+            _, plot_time = timed(vectorized, observations, analysis_dir)
+
+        legacy_time = legacy_read_time + legacy_plot_time
+        total_time = read_time + plot_time
+        print(
+            f"{analysis_accession} ({len(observations)} observations): "
+            f"row by row {legacy_time:.3f}s (reading {legacy_read_time:.3f}s), "
+            f"vectorized {total_time:.3f}s (reading {read_time:.3f}s) "
+            f"({legacy_time / max(total_time, 1e-9):.1f}x)"
+        )
@@ -0,0 +1,11 @@
+#!/usr/bin/env bash
+set -euo pipefail
+
+ROW_COUNT=${1:-5000000}
+ANALYSIS=${2:-}
+
+if [[ -n "${ANALYSIS}" ]]; then
+    python manage.py shell -c "from scripts.benchmarks import visualization_data; visualization_data.run(${ROW_COUNT}, \"${ANALYSIS}\")"
+else
+    python manage.py shell -c "from scripts.benchmarks import visualization_data; visualization_data.run(${ROW_COUNT})"
+fi
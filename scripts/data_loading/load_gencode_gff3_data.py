@@ -1,5 +1,7 @@
 import json
+from dataclasses import dataclass
 from io import SEEK_SET, StringIO
+from itertools import islice
 from urllib.parse import unquote
 
 from django.db import connection, transaction
@@ -13,9 +15,10 @@ from cegs_portal.search.models import (
     GencodeAnnotation,
     GencodeRegion,
 )
-from cegs_portal.utils.db_ids import FeatureIds
+from cegs_portal.utils.db_ids import FeatureIds, GencodeAnnotationIds
 from utils import timer
 
+from . import cancel_loads, process_pool
 from .db import bulk_feature_save, feature_entry
 
 # Attributes that are saved in the annotation table rather than the attribute tabale
@@ -42,6 +45,7 @@ def bulk_annotation_save(genome_annotations: StringIO):
     with transaction.atomic(), connection.cursor() as cursor:
         with cursor.copy(
             """COPY search_gencodeannotation (
+                id,
                 chrom_name,
                 location,
                 strand,
@@ -56,76 +60,156 @@ def bulk_annotation_save(genome_annotations: StringIO):
                 level,
                 region_id,
                 version,
-                attributes,
+                attributes
             ) FROM STDIN"""
         ) as copy:
-            copy.write(genome_annotations)
-
-
-@timer("Loading annotations", level=1)
-def load_genome_annotations(genome_annotations, ref_genome, ref_genome_patch, version):
+            copy.write(genome_annotations.getvalue())
+
+
+@dataclass
+class RegionChunk:
+    """The lines of an annotation file from one ##sequence-region line up to the next one"""
+
+    region_id: int
+    chrom_name: str
+    # Byte offset of the first line after the ##sequence-region line
+    offset: int
+    line_count: int = 0
+    annotation_count: int = 0
+
+
+@timer("Finding sequence regions", level=2, unit="s")
+def find_regions(annotation_filename) -> list[RegionChunk]:
+    """Saves the GencodeRegion of each ##sequence-region line and returns the chunk of lines in each region"""
+    chunks: list[RegionChunk] = []
+    offset = 0
+    with open(annotation_filename, "rb") as annotation_file:
+        for line in annotation_file:
+            offset += len(line)
+            if line.startswith(b"##sequence-region"):
+                _, chrom_name, start, end = line.decode().split(" ")
+                # Genocode values are 1-based, and probably closed
+                # Adjust start/end to use 0-based indexing
+                start = int(start) - 1
+                end = int(end)
+                region = GencodeRegion(chrom_name=chrom_name, base_range=Int4Range(start, end, "[)"))
+                region.save()
+                chunks.append(RegionChunk(region.id, chrom_name, offset))
+                continue
+
+            if len(chunks) == 0:
+                if line.startswith(b"#") or line.isspace():
+                    continue
+                raise ValueError(f"Annotation before the first ##sequence-region line: {line.decode()!r}")
+
+            chunks[-1].line_count += 1
+            if not (line.startswith(b"#") or line.isspace()):
+                chunks[-1].annotation_count += 1
+
+    return chunks
+
+
+def load_region_annotations(
+    annotation_filename, chunk: RegionChunk, annotation_ids, ref_genome, ref_genome_patch, version
+):
+    """
+    Loads the annotations in one region of an annotation file. Runs in a worker process, so each region is
+    copied into the database on its own connection. Ids are reserved by the caller, in file order, so the
+    ids of the annotations don't depend on which worker finishes first.
+    """
+    annotation_ids = iter(annotation_ids)
     annotations: StringIO = StringIO()
-    region = None
-    for i, line in enumerate(genome_annotations, start=1):
-        if line.startswith("##sequence-region"):
-            _, chrom_name, start, end = line.split(" ")
+    with open(annotation_filename, "rb") as annotation_file:
+        annotation_file.seek(chunk.offset, SEEK_SET)
+        for i, line in enumerate(islice(annotation_file, chunk.line_count), start=1):
+            line = line.decode()
+            if line.startswith("#") or line.isspace():
+                continue
+
+            fields = line.split("\t")
+            seqid, _source, annotation_type, start, end, score_str, strand, phase_str, attrs = map(unquote, fields)
             # Genocode values are 1-based, and probably closed
             # Adjust start/end to use 0-based indexing
             start = int(start) - 1
             end = int(end)
-            region = GencodeRegion(chrom_name=chrom_name, base_range=Int4Range(start, end, "[)"))
-            region.save()
-            continue
-
-        if line.startswith("#"):
-            continue
-
-        fields = line.split("\t")
-        seqid, _source, annotation_type, start, end, score_str, strand, phase_str, attrs = map(unquote, fields)
-        # Genocode values are 1-based, and probably closed
-        # Adjust start/end to use 0-based indexing
-        start = int(start) - 1
-        end = int(end)
-        attr_list = attrs.split(";")
-        attr_dict = {}
-        for attr in attr_list:
-            attr_name, value = attr.split("=")
-            attr_dict[attr_name.strip()] = value.strip()
-
-        annotation_id = attr_dict["ID"]
-        gene_name = attr_dict["gene_name"]
-        gene_type = attr_dict["gene_type"]
-        level = attr_dict["level"]
-
-        for v in ANNOTATION_VALUE_ATTRIBUTES:
-            del attr_dict[v]
-
-        # The assumption is that all items with the same ID are on continguous lines
-        # \N represents a "null" value to psycopg2
-        phase = phase_str if phase_str is not None and phase_str != "." else "\\N"
-        score = score_str if score_str is not None and score_str != "." else "\\N"
-
-        # If there is a new annotation
-        # Write the buffer to the database
-        if i % ANNOTATION_BUFFER_SIZE == 0:
-            bulk_annotation_save(annotations)
-            annotations.close()
-            annotations = StringIO()
-
-        # Create a new annotation
-        annotations.write(
-            f"{seqid}\t[{start},{end})\t{strand}\t{score}\t{phase}\t{annotation_type}\t{annotation_id}\t{ref_genome}\t{ref_genome_patch}\t{gene_name}\t{gene_type}\t{level}\t{region.id}\t{version}\t{json.dumps(attr_dict)}\n"
-        )
+            attr_list = attrs.split(";")
+            attr_dict = {}
+            for attr in attr_list:
+                attr_name, value = attr.split("=")
+                attr_dict[attr_name.strip()] = value.strip()
+
+            annotation_id = attr_dict["ID"]
+            gene_name = attr_dict["gene_name"]
+            gene_type = attr_dict["gene_type"]
+            level = attr_dict["level"]
+
+            for v in ANNOTATION_VALUE_ATTRIBUTES:
+                del attr_dict[v]
+
+            # The assumption is that all items with the same ID are on continguous lines
+            # \N represents a "null" value to psycopg2
+            phase = phase_str if phase_str is not None and phase_str != "." else "\\N"
+            score = score_str if score_str is not None and score_str != "." else "\\N"
+
+            # If there is a new annotation
+            # Write the buffer to the database
+            if i % ANNOTATION_BUFFER_SIZE == 0:
+                bulk_annotation_save(annotations)
+                annotations.close()
+                annotations = StringIO()
+
+            # Create a new annotation
+            annotations.write(
+                f"{next(annotation_ids)}\t{seqid}\t[{start},{end})\t{strand}\t{score}\t{phase}\t{annotation_type}\t{annotation_id}\t{ref_genome}\t{ref_genome_patch}\t{gene_name}\t{gene_type}\t{level}\t{chunk.region_id}\t{version}\t{json.dumps(attr_dict)}\n"
+            )
 
     bulk_annotation_save(annotations)
     annotations.close()
 
 
+@timer("Loading annotations", level=1)
+def load_genome_annotations(annotation_filename, ref_genome, ref_genome_patch, version):
+    """
+    Loads the annotations of each sequence region (i.e., chromosome) in parallel, across a pool of worker
+    processes. Workers commit each region as it's loaded, so if any region fails the regions and the
+    annotations that were already loaded are deleted.
+    """
+    chunks = find_regions(annotation_filename)
+    with GencodeAnnotationIds() as annotation_ids, process_pool() as workers:
+        loads = []
+        try:
+            for chunk in chunks:
+                loads.append(
+                    workers.submit(
+                        load_region_annotations,
+                        annotation_filename,
+                        chunk,
+                        list(islice(annotation_ids, chunk.annotation_count)),
+                        ref_genome,
+                        ref_genome_patch,
+                        version,
+                    )
+                )
+            for chunk, load in zip(chunks, loads):
+                load.result()
+                print(f"Loaded {chunk.annotation_count} {chunk.chrom_name} annotations")
+        except BaseException:
+            cancel_loads(loads)
+            region_ids = [chunk.region_id for chunk in chunks]
+            GencodeAnnotation.objects.filter(region_id__in=region_ids).delete()
+            GencodeRegion.objects.filter(id__in=region_ids).delete()
+            raise
+
+
 @timer("Creating Genes", level=1)
 def create_genes(accession_ids, ref_genome, ref_genome_patch):
-    gene_annotations = GencodeAnnotation.objects.filter(
-        annotation_type="gene", ref_genome=ref_genome, ref_genome_patch=ref_genome_patch
-    ).values()
+    gene_annotations = (
+        GencodeAnnotation.objects.filter(
+            annotation_type="gene", ref_genome=ref_genome, ref_genome_patch=ref_genome_patch
+        )
+        .order_by("id")
+        .values()
+    )
 
     assembly_buffer = StringIO()
     ensembl_ids = {}
@@ -174,9 +258,13 @@ def create_genes(accession_ids, ref_genome, ref_genome_patch):
 
 @timer("Creating Transcripts", level=1)
 def create_transcripts(accession_ids, gene_ensembl_ids, ref_genome, ref_genome_patch):
-    tx_annotations = GencodeAnnotation.objects.filter(
-        annotation_type="transcript", ref_genome=ref_genome, ref_genome_patch=ref_genome_patch
-    ).values()
+    tx_annotations = (
+        GencodeAnnotation.objects.filter(
+            annotation_type="transcript", ref_genome=ref_genome, ref_genome_patch=ref_genome_patch
+        )
+        .order_by("id")
+        .values()
+    )
 
     assembly_buffer = StringIO()
     ensembl_ids = {}
@@ -227,9 +315,13 @@ def create_transcripts(accession_ids, gene_ensembl_ids, ref_genome, ref_genome_p
 
 @timer("Creating Exons", level=1)
 def create_exons(accession_ids, tx_ensembl_ids, ref_genome, ref_genome_patch):
-    exon_annotations = GencodeAnnotation.objects.filter(
-        annotation_type="exon", ref_genome=ref_genome, ref_genome_patch=ref_genome_patch
-    ).values()
+    exon_annotations = (
+        GencodeAnnotation.objects.filter(
+            annotation_type="exon", ref_genome=ref_genome, ref_genome_patch=ref_genome_patch
+        )
+        .order_by("id")
+        .values()
+    )
 
     assembly_buffer = StringIO()
     with FeatureIds() as feature_ids:
@@ -304,8 +396,7 @@ def run(annotation_filename: str, ref_genome: str, ref_genome_patch: str, versio
     # unload_genome_annotations() uncommented is not, strictly, idempotent.
     # unload_genome_annotations(ref_genome, ref_genome_patch)
 
-    with open(annotation_filename, "r") as annotation_file:
-        load_genome_annotations(annotation_file, ref_genome, ref_genome_patch, version)
+    load_genome_annotations(annotation_filename, ref_genome, ref_genome_patch, version)
 
     with AccessionIds(message=f"Gencode data for {ref_genome}.{ref_genome_patch}") as accession_ids:
         gene_ensembl_ids = create_genes(accession_ids, ref_genome, ref_genome_patch)
@@ -1,6 +1,8 @@
 import csv
 import os.path
+import tempfile
 import time
+from dataclasses import dataclass
 from io import StringIO
 
 from cegs_portal.search.models import (
@@ -15,7 +17,7 @@ from cegs_portal.utils.db_ids import FeatureIds
 from utils import get_delimiter, timer
 from utils.file import FileMetadata
 
-from . import get_closest_gene
+from . import cancel_loads, get_closest_genes, process_pool
 from .db import bulk_feature_facet_save, bulk_feature_save, feature_entry
 
 LOAD_BATCH_SIZE = 100_000
@@ -29,81 +31,158 @@ def get_facets(facet_string):
     return [CCRE_FACET_VALUES[value] for value in facet_values]
 
 
-# loading does buffered writes to the DB, with a buffer size of LOAD_BATCH_SIZE annotations
-@timer("Load cCREs")
-def load_ccres(ccres_file, accession_ids, source_file, ref_genome, ref_genome_patch, delimiter=",", cell_line=None):
+@dataclass
+class ChromosomeChunk:
+    """The unique cCREs of one chromosome, in file order, written to their own file"""
+
+    chrom_name: str
+    filename: str
+    ccre_count: int = 0
+
+
+@timer("Splitting cCREs by chromosome", level=1, unit="s")
+def split_ccres(ccres_file, dir_name, delimiter=",") -> list[ChromosomeChunk]:
+    """
+    Writes the cCREs of each chromosome to a tab-delimited file in dir_name. Chromosomes are returned in the
+    order they first appear in ccres_file.
+    """
     reader = csv.reader(ccres_file, delimiter=delimiter, quoting=csv.QUOTE_NONE)
-    source_file_id = source_file.id
     ccres = set()
-    start_time = time.perf_counter()
+    chunks: dict[str, ChromosomeChunk] = {}
+    chunk_files = {}
 
-    new_ccres = StringIO()
-    new_feature_facets = StringIO()
-    with FeatureIds() as feature_ids:
-        for i, line in enumerate(reader, start=1):
-            if i % LOAD_BATCH_SIZE == 0:
-                bulk_feature_save(new_ccres)
-                bulk_feature_facet_save(new_feature_facets)
-                end_time = time.perf_counter()
-                print(f"Loaded {LOAD_BATCH_SIZE} cCREs in: {end_time - start_time} s")
-                start_time = time.perf_counter()
-                new_ccres.close()
-                new_ccres = StringIO()
-                new_feature_facets.close()
-                new_feature_facets = StringIO()
-
-            chrom_name, ccre_start_str, ccre_end_str, _, screen_accession_id, ccre_categories = line
+    try:
+        for line in reader:
+            chrom_name, ccre_start_str, ccre_end_str = line[:3]
 
             if "_" in chrom_name:
                 continue
 
-            ccre_start = int(ccre_start_str)
-            ccre_end = int(ccre_end_str)
-
             # There shouldn't be duplicate cCREs, but the liftover from
             # hg38 to hg37 is imperfect and results in some duplicates
-            if (chrom_name, ccre_start, ccre_end) in ccres:
+            ccre = (chrom_name, int(ccre_start_str), int(ccre_end_str))
+            if ccre in ccres:
                 continue
             else:
-                ccres.add((chrom_name, ccre_start, ccre_end))
-
-            # Doesn't use the iterable features of FeatureIds so we don't skip ids when a cCRE is skipped
-            # due to not being unique
-            feature_id = feature_ids.next_id()
-            ccre_location = f"[{ccre_start},{ccre_end})"
-            closest_gene, distance, gene_name = get_closest_gene(ref_genome, chrom_name, ccre_start, ccre_end)
-            closest_gene_ensembl_id = closest_gene["ensembl_id"] if closest_gene is not None else "\\N"
-
-            new_ccres.write(
-                feature_entry(
-                    id_=feature_id,
-                    accession_id=accession_ids.incr(AccessionType.CCRE),
-                    cell_line=cell_line,
-                    chrom_name=chrom_name,
-                    location=ccre_location,
-                    closest_gene_id=closest_gene["id"],
-                    closest_gene_distance=distance,
-                    closest_gene_name=gene_name,
-                    closest_gene_ensembl_id=closest_gene_ensembl_id,
-                    genome_assembly=ref_genome,
-                    genome_assembly_patch=ref_genome_patch,
-                    feature_type=DNAFeatureType.CCRE,
-                    source_file_id=source_file_id,
-                    misc={"screen_accession_id": screen_accession_id},
-                )
+                ccres.add(ccre)
+
+            if (chunk := chunks.get(chrom_name)) is None:
+                chunk = ChromosomeChunk(chrom_name, os.path.join(dir_name, f"{len(chunks)}.tsv"))
+                chunks[chrom_name] = chunk
+                chunk_files[chrom_name] = open(chunk.filename, "w")
+
+            chunk_files[chrom_name].write("\t".join(line) + "\n")
+            chunk.ccre_count += 1
+    finally:
+        for chunk_file in chunk_files.values():
+            chunk_file.close()
+
+    return list(chunks.values())
+
+
+def load_chromosome_ccres(
+    chunk: ChromosomeChunk, feature_ids, accession_ids, source_file_id, ref_genome, ref_genome_patch, cell_line=None
+):
+    """
+    Loads the cCREs of one chromosome. Runs in a worker process, so each chromosome is copied into the
+    database on its own connection. Feature and accession ids are reserved by the caller, in chromosome order,
+    so they don't depend on which worker finishes first.
+    """
+    with open(chunk.filename) as chunk_file:
+        lines = list(csv.reader(chunk_file, delimiter="\t", quoting=csv.QUOTE_NONE))
+
+    closest_genes = get_closest_genes(
+        ref_genome,
+        [chrom_name for chrom_name, *_ in lines],
+        [int(line[1]) for line in lines],
+        [int(line[2]) for line in lines],
+    )
+
+    new_ccres = StringIO()
+    new_feature_facets = StringIO()
+    for i, (line, feature_id, accession_id, (closest_gene, distance, gene_name)) in enumerate(
+        zip(lines, feature_ids, accession_ids, closest_genes), start=1
+    ):
+        if i % LOAD_BATCH_SIZE == 0:
+            bulk_feature_save(new_ccres)
+            bulk_feature_facet_save(new_feature_facets)
+            new_ccres.close()
+            new_ccres = StringIO()
+            new_feature_facets.close()
+            new_feature_facets = StringIO()
+
+        chrom_name, ccre_start_str, ccre_end_str, _, screen_accession_id, ccre_categories = line
+        ccre_location = f"[{ccre_start_str},{ccre_end_str})"
+        closest_gene_id = closest_gene["id"] if closest_gene is not None else "\\N"
+        closest_gene_ensembl_id = closest_gene["ensembl_id"] if closest_gene is not None else "\\N"
+
+        new_ccres.write(
+            feature_entry(
+                id_=feature_id,
+                accession_id=accession_id,
+                cell_line=cell_line,
+                chrom_name=chrom_name,
+                location=ccre_location,
+                closest_gene_id=closest_gene_id,
+                closest_gene_distance=distance,
+                closest_gene_name=gene_name,
+                closest_gene_ensembl_id=closest_gene_ensembl_id,
+                genome_assembly=ref_genome,
+                genome_assembly_patch=ref_genome_patch,
+                feature_type=DNAFeatureType.CCRE,
+                source_file_id=source_file_id,
+                misc={"screen_accession_id": screen_accession_id},
             )
-            feature_facets_ids = get_facets(ccre_categories)
-            for facet_id in feature_facets_ids:
-                new_feature_facets.write(f"{feature_id}\t{facet_id}\n")
+        )
+        feature_facets_ids = get_facets(ccre_categories)
+        for facet_id in feature_facets_ids:
+            new_feature_facets.write(f"{feature_id}\t{facet_id}\n")
 
     bulk_feature_save(new_ccres)
     bulk_feature_facet_save(new_feature_facets)
-    end_time = time.perf_counter()
-    print(f"Loaded {LOAD_BATCH_SIZE} cCREs in: {end_time - start_time}s")
     new_ccres.close()
     new_feature_facets.close()
 
 
+# Each chromosome is loaded in a worker process, which does buffered writes to the DB, with a buffer size of
+# LOAD_BATCH_SIZE annotations
+@timer("Load cCREs")
+def load_ccres(ccres_file, accession_ids, source_file, ref_genome, ref_genome_patch, delimiter=",", cell_line=None):
+    """
+    Workers commit each chromosome as it's loaded, so if any chromosome fails the cCREs that were already
+    loaded from source_file are deleted. The accession ids reserved for them stay reserved, so they are never
+    handed out again.
+    """
+    with tempfile.TemporaryDirectory() as dir_name:
+        chunks = split_ccres(ccres_file, dir_name, delimiter)
+        with FeatureIds() as feature_ids, process_pool() as workers:
+            loads = []
+            try:
+                for chunk in chunks:
+                    loads.append(
+                        workers.submit(
+                            load_chromosome_ccres,
+                            chunk,
+                            [feature_ids.next_id() for _ in range(chunk.ccre_count)],
+                            [accession_ids.incr(AccessionType.CCRE) for _ in range(chunk.ccre_count)],
+                            source_file.id,
+                            ref_genome,
+                            ref_genome_patch,
+                            cell_line,
+                        )
+                    )
+                start_time = time.perf_counter()
+                for chunk, load in zip(chunks, loads):
+                    load.result()
+                    print(
+                        f"Loaded {chunk.ccre_count} {chunk.chrom_name} cCREs after: {time.perf_counter() - start_time}s"
+                    )
+            except BaseException:
+                cancel_loads(loads)
+                DNAFeature.objects.filter(source_file=source_file).delete()
+                raise
+
+
 @timer("Unloading CCREs", level=1)
 def unload_ccres(file_metadata):
     DNAFeature.objects.filter(source_file=file_metadata.file).delete()
@@ -0,0 +1,76 @@
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+import pytest
+from django.db import connection
+
+from cegs_portal.search.models import AccessionIds, DNAFeature
+from cegs_portal.search.models.tests.facet_factory import (
+    FacetFactory,
+    FacetValueFactory,
+)
+from cegs_portal.search.models.tests.file_factory import FileFactory
+
+CCRES = """chr1,10,20,EH38D0000001,EH38E0000001,pELS
+chr1,30,40,EH38D0000002,EH38E0000002,dELS
+chr2,10,20,EH38D0000003,EH38E0000003,pELS
+chr3,10,20,EH38D0000004,EH38E0000004,PLS
+"""
+
+
+@pytest.fixture
+def load_screen_ccres(monkeypatch):
+    # The loader reads the cCRE facet values when it's imported
+    facet = FacetFactory(name="cCRE Category")
+    facet_values = {value: FacetValueFactory(facet=facet, value=value).id for value in ["pELS", "dELS", "PLS"]}
+    module = importlib.import_module("scripts.data_loading.load_screen_ccres")
+    monkeypatch.setattr(module, "CCRE_FACET_VALUES", facet_values)
+    # One worker thread loads the chromosomes in order, each on its own connection
+    monkeypatch.setattr(module, "process_pool", lambda: ThreadPoolExecutor(max_workers=1))
+    return module
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_ccres_chunk_failure(load_screen_ccres, monkeypatch):
+    load_chromosome_ccres = load_screen_ccres.load_chromosome_ccres
+    loaded_chroms = []
+
+    def failing_load(chunk, *args):
+        try:
+            if chunk.chrom_name == "chr2":
+                raise RuntimeError("chr2 failed to load")
+            load_chromosome_ccres(chunk, *args)
+            loaded_chroms.append(chunk.chrom_name)
+        finally:
+            connection.close()
+
+    monkeypatch.setattr(load_screen_ccres, "load_chromosome_ccres", failing_load)
+    source_file = FileFactory()
+
+    with pytest.raises(RuntimeError), AccessionIds(message="cCRE test") as accession_ids:
+        load_screen_ccres.load_ccres(StringIO(CCRES), accession_ids, source_file, "GRCh38", "0")
+
+    assert loaded_chroms == ["chr1"]
+    assert not DNAFeature.objects.filter(source_file=source_file).exists()
+
+
+@pytest.mark.django_db(transaction=True)
+def test_load_ccres(load_screen_ccres, monkeypatch):
+    load_chromosome_ccres = load_screen_ccres.load_chromosome_ccres
+
+    def threaded_load(*args):
+        try:
+            load_chromosome_ccres(*args)
+        finally:
+            connection.close()
+
+    monkeypatch.setattr(load_screen_ccres, "load_chromosome_ccres", threaded_load)
+    source_file = FileFactory()
+
+    with AccessionIds(message="cCRE test") as accession_ids:
+        load_screen_ccres.load_ccres(StringIO(CCRES), accession_ids, source_file, "GRCh38", "0")
+
+    features = DNAFeature.objects.filter(source_file=source_file)
+    assert features.count() == 4
+    assert sorted(features.values_list("chrom_name", flat=True)) == ["chr1", "chr1", "chr2", "chr3"]